@@ -10,4 +10,11 @@ app = Celery('blogginh_platform_api')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 #Look for tasks.py in all installed apps
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+#Task counts and durations for the /metrics/ endpoint
+from celery.signals import task_prerun, task_postrun
+from . import metrics
+
+task_prerun.connect(metrics.task_started, weak=False)
+task_postrun.connect(metrics.task_finished, weak=False)
@@ -0,0 +1,65 @@
+import hashlib
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PreconditionFailed(APIException):
+  status_code = status.HTTP_412_PRECONDITION_FAILED
+  default_detail = 'The resource changed since you fetched it. Fetch it again and retry.'
+  default_code = 'precondition_failed'
+
+
+def make_etag(*parts):
+  #Short opaque tag; the parts themselves (ids, versions, user) stay private
+  return quote_etag(hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+
+
+class ConditionalRequestMixin:
+  """
+  ETag / Last-Modified support computed without serializing. get_validators()
+  returns (etag, last_modified) from a small query, or (None, None) when the
+  resource doesn't exist. GET answers 304 for a current client copy, and
+  PUT/PATCH honour If-Match, checked with the row locked so concurrent writers
+  can't both pass.
+  """
+  def get_validators(self, for_update=False):
+    raise NotImplementedError
+
+  def _conditional_response(self, request, etag, last_modified):
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+  def _set_validators(self, response, etag, last_modified):
+    if etag:
+      response['ETag'] = etag
+    if last_modified:
+      response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+  def get(self, request, *args, **kwargs):
+    etag, last_modified = self.get_validators()
+    if etag is not None:
+      response = self._conditional_response(request, etag, last_modified)
+      if response is not None:
+        return self._set_validators(response, etag, last_modified)
+
+    response = super().get(request, *args, **kwargs)  # type: ignore [misc]
+    if response.status_code == status.HTTP_200_OK:
+      self._set_validators(response, etag, last_modified)
+    return response
+
+  def update(self, request, *args, **kwargs):
+    with transaction.atomic():
+      if 'HTTP_IF_MATCH' in request.META or 'HTTP_IF_UNMODIFIED_SINCE' in request.META:
+        etag, last_modified = self.get_validators(for_update=True)
+        if etag is not None and self._conditional_response(request, etag, last_modified) is not None:
+          raise PreconditionFailed()
+      response = super().update(request, *args, **kwargs)  # type: ignore [misc]
+
+    #The new validators, so the client can chain its next conditional write
+    if response.status_code == status.HTTP_200_OK:
+      self._set_validators(response, *self.get_validators())
+    return response
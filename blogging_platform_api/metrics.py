@@ -0,0 +1,243 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+
+#Prometheus' default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class Registry:
+  """
+  This process's metric values, kept in plain dicts under one uncontended lock.
+
+  With METRICS_DIR set, the values are written to <METRICS_DIR>/metrics-<pid>.json
+  at most every METRICS_FLUSH_INTERVAL seconds (atomically, via a rename), and
+  the scrape endpoint merges the files of every process: gunicorn workers and
+  Celery workers alike. Without it, the endpoint shows this process only.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.metrics = {}
+    #(name, labels) -> value for counters, [bucket counts, sum, count] for histograms
+    self.values = {}
+    self.last_flush = 0.0
+
+  def register(self, metric):
+    self.metrics[metric.name] = metric
+    return metric
+
+  def inc(self, key, amount):
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+    self.maybe_flush()
+
+  def observe(self, key, buckets, value):
+    with self.lock:
+      entry = self.values.get(key)
+      if entry is None:
+        entry = self.values[key] = [[0] * len(buckets), 0.0, 0]
+      for index, bound in enumerate(buckets):
+        if value <= bound:
+          entry[0][index] += 1
+          break
+      entry[1] += value
+      entry[2] += 1
+    self.maybe_flush()
+
+  def snapshot(self):
+    with self.lock:
+      return [
+        [name, list(labels), value if not isinstance(value, list) else [list(value[0]), value[1], value[2]]]
+        for (name, labels), value in self.values.items()
+      ]
+
+  def maybe_flush(self):
+    if metrics_dir() and time.monotonic() - self.last_flush >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+      self.flush()
+
+  def flush(self):
+    directory = metrics_dir()
+    if not directory:
+      return
+    self.last_flush = time.monotonic()
+    path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as handle:
+      json.dump(self.snapshot(), handle)
+    os.replace(temporary, path)
+
+  def collect(self):
+    """
+    Values summed over every process's file (this process's current values included).
+    """
+    directory = metrics_dir()
+    if not directory:
+      snapshots = [self.snapshot()]
+    else:
+      self.flush()
+      snapshots = []
+      for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+          with open(path) as handle:
+            snapshots.append(json.load(handle))
+        except (OSError, ValueError):
+          #A file being replaced mid-read; its process's next flush will have it
+          continue
+
+    merged = {}
+    for snapshot in snapshots:
+      for name, labels, value in snapshot:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if not isinstance(value, list):
+          merged[key] = merged.get(key, 0) + value
+          continue
+        entry = merged.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+        entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+        entry[1] += value[1]
+        entry[2] += value[2]
+    return merged
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def metrics_dir():
+  return getattr(settings, 'METRICS_DIR', None)
+
+
+def _labels(labels):
+  return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Counter:
+  type = 'counter'
+
+  def __init__(self, name, documentation):
+    self.name = name
+    self.documentation = documentation
+    registry.register(self)
+
+  def inc(self, amount=1, **labels):
+    registry.inc((self.name, _labels(labels)), amount)
+
+
+class Histogram:
+  type = 'histogram'
+
+  def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+    self.name = name
+    self.documentation = documentation
+    self.buckets = tuple(buckets)
+    registry.register(self)
+
+  def observe(self, value, **labels):
+    registry.observe((self.name, _labels(labels)), self.buckets, value)
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by route, method and status.')
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'HTTP request latency by route.')
+REQUEST_QUERIES = Counter('http_request_db_queries_total', 'SQL queries run while serving requests, by route.')
+REQUEST_DB_TIME = Counter('http_request_db_seconds_total', 'Time spent in SQL while serving requests, by route.')
+TASKS = Counter('celery_tasks_total', 'Celery tasks run, by task and final state.')
+TASK_DURATION = Histogram('celery_task_duration_seconds', 'Celery task run time by task.')
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by cache and result (hit or miss).')
+
+
+def record_cache(cache, hit):
+  CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def _escape(value):
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+  pairs = list(labels) + list(extra)
+  if not pairs:
+    return ''
+  return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def exposition():
+  """
+  All metrics in the Prometheus text format (version 0.0.4).
+  """
+  merged = registry.collect()
+  lines = []
+  for name, metric in sorted(registry.metrics.items()):
+    series = sorted((labels, value) for (metric_name, labels), value in merged.items() if metric_name == name)
+    lines.append(f'# HELP {name} {metric.documentation}')
+    lines.append(f'# TYPE {name} {metric.type}')
+    for labels, value in series:
+      if metric.type == 'counter':
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+        continue
+      counts, total, count = value
+      cumulative = 0
+      for bound, bucket in zip(metric.buckets, counts):
+        cumulative += bucket
+        lines.append(f'{name}_bucket{_format_labels(labels, [("le", repr(bound))])} {cumulative}')
+      lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+      lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+      lines.append(f'{name}_count{_format_labels(labels)} {count}')
+  return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+  #Traffic and SQL counts per endpoint aren't public: scrapers send METRICS_TOKEN
+  #as a bearer token, people sign in as staff (e.g. through the admin)
+  token = getattr(settings, 'METRICS_TOKEN', None)
+  scraper = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+  user = getattr(request, 'user', None)
+  if not scraper and not (user is not None and user.is_staff):
+    return HttpResponseForbidden()
+  return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+  """
+  Counts every request and its SQL and observes its latency, labelled by the
+  URL pattern (not the path, so IDs and usernames don't explode the series).
+  The SQL counts are the ones RequestTimingMiddleware, further down the
+  chain, keeps in request.timing.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    start = time.perf_counter()
+    response = self.get_response(request)
+    duration = time.perf_counter() - start
+
+    match = getattr(request, 'resolver_match', None)
+    route = match.route if match is not None else '<unmatched>'
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    REQUEST_DURATION.observe(duration, route=route, method=request.method)
+    timing = getattr(request, 'timing', None)
+    if timing is not None:
+      REQUEST_QUERIES.inc(timing.query_count, route=route)
+      REQUEST_DB_TIME.inc(timing.db_time, route=route)
+    return response
+
+
+_task_starts = {}
+
+
+def task_started(task_id=None, **kwargs):
+  _task_starts[task_id] = time.perf_counter()
+
+
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+  start = _task_starts.pop(task_id, None)
+  name = getattr(task, 'name', 'unknown')
+  TASKS.inc(task=name, state=state or 'UNKNOWN')
+  if start is not None:
+    TASK_DURATION.observe(time.perf_counter() - start, task=name)
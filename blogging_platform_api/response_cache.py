@@ -0,0 +1,139 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from rest_framework.response import Response
+from .metrics import record_cache
+
+
+DEFAULTS = {
+  'CACHE': 'default',
+  #Seconds an entry is served without recomputing, if none of its tags changed
+  'TIMEOUT': 60,
+  #Seconds past that an outdated entry may still be served while one request refreshes it
+  'STALE_TIMEOUT': 30,
+  #Upper bound on a refresh, in case the refreshing process dies
+  'LOCK_TIMEOUT': 10,
+}
+
+
+def cache_settings():
+  return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+def _cache():
+  return caches[cache_settings()['CACHE']]
+
+
+def _tag_key(tag):
+  return 'rc:gen:' + hashlib.md5(tag.encode('utf-8')).hexdigest()
+
+
+def generations(tags):
+  """
+  Current generation of each tag. A tag's generation changes whenever content
+  tagged with it does, so entries stored under older generations are outdated.
+  """
+  cache = _cache()
+  keys = [_tag_key(tag) for tag in tags]
+  values = cache.get_many(keys)
+  missing = [key for key in keys if key not in values]
+  for key in missing:
+    #Start from the clock rather than 0, so a tag evicted from the cache can't
+    #come back at a generation an old entry was stored under
+    cache.add(key, time.time_ns(), timeout=None)
+  if missing:
+    values.update(cache.get_many(missing))
+  return [values.get(key) for key in keys]
+
+
+def invalidate(*tags):
+  """
+  Outdates every cached response tagged with any of 'tags'. Also bumps again on
+  commit, so a request that read the old rows mid-transaction can't re-cache them.
+  """
+  def bump():
+    cache = _cache()
+    for tag in tags:
+      key = _tag_key(tag)
+      try:
+        cache.incr(key)
+      except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+  bump()
+  if connection.in_atomic_block:
+    transaction.on_commit(bump)
+
+
+def request_key(request):
+  #Path plus query params sorted by name, so '?a=1&b=2' and '?b=2&a=1' share an entry
+  params = sorted((name, sorted(values)) for name, values in request.query_params.lists())
+  raw = f'{request.get_host()}{request.path}?{params}'
+  return 'rc:resp:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _cached_response(entry, state):
+  response = Response(entry['data'], status=entry['status'])
+  response['X-Cache'] = state
+  return response
+
+
+def serve(request, tags, compute):
+  """
+  Returns the cached response for this request if it is current, otherwise runs
+  'compute' and caches its result. While one request refreshes an outdated
+  entry, concurrent ones are served the outdated copy (stale-while-revalidate).
+  """
+  config = cache_settings()
+  cache = _cache()
+  key = request_key(request)
+  current = generations(tags)
+  entry = cache.get(key)
+  now = time.time()
+
+  if entry is not None and entry['generations'] == current and now < entry['expires']:
+    record_cache('response', True)
+    return _cached_response(entry, 'HIT')
+
+  #cache.add is atomic, so exactly one request wins the refresh
+  lock = key + ':lock'
+  if entry is not None and not cache.add(lock, 1, timeout=config['LOCK_TIMEOUT']):
+    record_cache('response', True)
+    return _cached_response(entry, 'STALE')
+
+  record_cache('response', False)
+  try:
+    response = compute()
+    if response.status_code == 200:
+      cache.set(key, {
+        'generations': current,
+        'expires': now + config['TIMEOUT'],
+        'status': response.status_code,
+        'data': response.data,
+      }, timeout=config['TIMEOUT'] + config['STALE_TIMEOUT'])
+  finally:
+    if entry is not None:
+      cache.delete(lock)
+
+  response['X-Cache'] = 'MISS'
+  return response
+
+
+class AnonymousCacheMixin:
+  """
+  Caches GET responses for anonymous users (authenticated payloads are
+  per-user, e.g. has_liked). Views list the tags their content depends on;
+  the signals invalidate those tags when the content changes.
+  """
+  cache_tags = ()
+
+  def get_cache_tags(self):
+    return list(self.cache_tags)
+
+  def get(self, request, *args, **kwargs):
+    view = super()
+    if request.user.is_authenticated:
+      return view.get(request, *args, **kwargs)
+    return serve(request, self.get_cache_tags(), lambda: view.get(request, *args, **kwargs))
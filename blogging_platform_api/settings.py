@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 from decouple import config
 from dotenv import load_dotenv
 
@@ -54,6 +55,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so their timings cover the other middleware too
+    'blogging_platform_api.metrics.MetricsMiddleware',
+    'blogging_platform_api.timing.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -62,19 +66,22 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last, so the view span leaves the middleware above out
+    'blogging_platform_api.timing.ViewTimingMiddleware',
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ['Server-Timing']
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': (
       'django_filters.rest_framework.DjangoFilterBackend',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'posts.pagination.PageSizePagination',
     'PAGE_SIZE': 10
 }
 
@@ -166,9 +173,125 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 DEFAULT_FROM_EMAIL = 'notifications@blogapi.com'
 
+# New-post emails are sent in batches of this many recipients, one task (and retry) each
+NOTIFICATION_BATCH_SIZE = 200
+# Users whose digest is built and sent per task (two queries per batch)
+DIGEST_BATCH_SIZE = 1000
+
+# Transactional outbox (posts/outbox.py), drained by 'manage.py relay_outbox'
+# Failed events are retried with exponential backoff up to this many seconds apart...
+OUTBOX_MAX_BACKOFF = 600
+# ...and given up on (kept with failed_at set) after this many attempts
+OUTBOX_MAX_ATTEMPTS = 8
+
 CELERY_BROKEN_URL = 'redis://localhost:6379/0'
 CELERY_TASK_ALWAYS_EAGER = True
 
+# Personalized feed (fan-out on write timelines)
+# Authors above this follower count are merged into followers' feeds at read time
+FEED_FANOUT_FOLLOWER_LIMIT = 10000
+# Recent posts copied into a timeline when a user follows an author or subscribes to a category
+FEED_BACKFILL_LIMIT = 200
+
+# Most posts per batch engagement request (/api/engagement/, /api/like/batch/, /api/rate/batch/)
+ENGAGEMENT_BATCH_SIZE = 100
+
+# Values per facet (category, tags, author) in ?facets=true responses
+FACET_LIMIT = 20
+
+# Newest comments embedded in each post payload; the rest are paged at /api/<id>/comments/
+POST_LATEST_COMMENTS = 3
+
+# Leaderboards (/api/top/)
+LEADERBOARD_SIZE = 10
+# Bayesian average: ratings are smoothed toward this mean with the weight of this many votes
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 5
+# Seconds of recency worth 10x the engagement in the trending score
+TRENDING_TIMESCALE = 45000
+
+CELERY_BEAT_SCHEDULE = {
+    'rebuild-leaderboards': {
+        'task': 'posts.tasks.rebuild_leaderboards',
+        'schedule': 600.0,
+    },
+    'hourly-notification-digests': {
+        'task': 'posts.tasks.send_notification_digests',
+        'schedule': 3600.0,
+        'args': ('hourly',),
+    },
+    'daily-notification-digests': {
+        'task': 'posts.tasks.send_notification_digests',
+        'schedule': 86400.0,
+        'args': ('daily',),
+    },
+}
+
+# Per-request timing (Server-Timing header and a JSON log line per request)
+REQUEST_TIMING = {
+    'SAMPLE_RATE': 1.0,
+    'SLOW_REQUEST_MS': 500,
+    'TOP_QUERIES': 5,
+}
+
+# Token -> user resolution cached per process (and optionally in a shared cache)
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 30,
+    'SHARED_CACHE': None,
+    'SHARED_TTL': 300,
+}
+
+# Prometheus metrics at /metrics/
+# Shared directory where each process (gunicorn and Celery workers) writes its values;
+# empty it when the service starts. Unset, the endpoint only reports its own process
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+# Scrapers send 'Authorization: Bearer <token>'; unset, only staff sessions can read /metrics/
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# One line per request is noise in the test runner
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+# Caches. Local memory is per process, so in production point 'default' at a
+# backend every process shares, e.g. django.core.cache.backends.redis.RedisCache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if TESTING:
+    # Nothing cached leaks between tests; the cache tests opt in with override_settings
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        },
+    }
+
+# Full responses of the public list and profile pages, for anonymous requests
+# (see blogging_platform_api/response_cache.py)
+RESPONSE_CACHE = {
+    'CACHE': 'default',
+    'TIMEOUT': 60,
+    'STALE_TIMEOUT': 30,
+    'LOCK_TIMEOUT': 10,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'blogging_platform_api.timing': {
+            'handlers': ['console'],
+            'level': 'ERROR' if TESTING else 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # Profile ImageFied settings
 
 MEDIA_URL = '/media/'
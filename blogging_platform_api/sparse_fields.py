@@ -0,0 +1,70 @@
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer
+
+
+def _param_set(request, name):
+  query_params = getattr(request, 'query_params', request.GET)
+  return {part.strip() for value in query_params.getlist(name) for part in value.split(',') if part.strip()}
+
+
+def _level(names, prefix):
+  """
+  The entries of 'names' that address the serializer at 'prefix' ('' for the root,
+  'posts.' for a nested one). 'posts.title' also names 'posts' at the root.
+  """
+  level = set()
+  for name in names:
+    if not name.startswith(prefix):
+      continue
+    level.add(name[len(prefix):].split('.', 1)[0])
+  return level
+
+
+class DynamicFieldsMixin:
+  """
+  Sparse fieldsets for reads: ?fields=a,b keeps only those fields, ?exclude=a
+  drops some, and ?expand=x adds the 'expandable_fields' left out by default.
+  Nested serializers are addressed with dotted names (?fields=posts.title).
+  Dropped fields are never evaluated, and field_names_for() lets views shape
+  their querysets the same way. 'detail_only_fields' are never sent for lists
+  (many=True), even when expanded.
+  """
+  expandable_fields = ()
+  detail_only_fields = ()
+
+  @classmethod
+  def field_names_for(cls, request, prefix='', many=False):
+    names = list(cls.Meta.fields)  # type: ignore [attr-defined]
+    if many:
+      names = [name for name in names if name not in cls.detail_only_fields]
+    #Full default shape outside a request (e.g. management commands)
+    if request is None:
+      return set(names)
+
+    expand = _level(_param_set(request, 'expand'), prefix)
+    selected = set(names) - (set(cls.expandable_fields) - expand)
+    if request.method not in SAFE_METHODS:
+      return selected
+
+    only = _level(_param_set(request, 'fields'), prefix)
+    if only:
+      selected = {name for name in names if name in only}
+    #Only leaf names exclude: ?exclude=posts.title must keep 'posts'
+    exclude = {name[len(prefix):] for name in _param_set(request, 'exclude') if name.startswith(prefix)}
+    return selected - exclude
+
+  def field_prefix(self):
+    parts = []
+    node = self
+    while node.parent is not None:  # type: ignore [attr-defined]
+      if node.field_name:  # type: ignore [attr-defined]
+        parts.append(node.field_name)  # type: ignore [attr-defined]
+      node = node.parent  # type: ignore [attr-defined]
+    return ''.join(f'{part}.' for part in reversed(parts))
+
+  def get_fields(self):
+    fields = super().get_fields()  # type: ignore [misc]
+    many = isinstance(self.parent, ListSerializer)  # type: ignore [attr-defined]
+    keep = self.field_names_for(self.context.get('request'), self.field_prefix(), many)  # type: ignore [attr-defined]
+    return {name: field for name, field in fields.items() if name in keep}
+
@@ -0,0 +1,196 @@
+import contextvars
+import json
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+  #Share of requests that are instrumented; the others only count their queries (for metrics)
+  'SAMPLE_RATE': 1.0,
+  #Sampled requests whose view took longer than this are logged with their most expensive SQL
+  'SLOW_REQUEST_MS': 500,
+  'TOP_QUERIES': 5,
+  #Project frames kept per statement to show where it was issued from
+  'STACK_DEPTH': 3,
+  'HEADER': True,
+}
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+def timing_settings():
+  return {**DEFAULTS, **getattr(settings, 'REQUEST_TIMING', {})}
+
+
+class RequestTiming:
+  """
+  Everything measured for one request: named spans, and each SQL statement with
+  its duration and the project code that issued it. Unsampled requests are not
+  'detailed' and only keep the query count and DB time.
+  """
+  def __init__(self, stack_depth, detailed=True):
+    self.stack_depth = stack_depth
+    self.detailed = detailed
+    self.spans = defaultdict(float)
+    self.query_count = 0
+    self.db_time = 0.0
+    #sql -> [count, total seconds, origin of the first execution]
+    self.statements = {}
+
+  def add(self, name, seconds):
+    self.spans[name] += seconds
+
+  def record_query(self, sql, seconds):
+    self.query_count += 1
+    self.db_time += seconds
+    if not self.detailed:
+      return
+    entry = self.statements.get(sql)
+    if entry is None:
+      self.statements[sql] = [1, seconds, self.origin()]
+    else:
+      entry[0] += 1
+      entry[1] += seconds
+
+  def origin(self):
+    #Walks up to the innermost frames in the project's own code (not Django, DRF or the venv)
+    base = str(settings.BASE_DIR)
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and len(frames) < self.stack_depth:
+      filename = frame.f_code.co_filename
+      if filename.startswith(base) and 'site-packages' not in filename and filename != __file__:
+        frames.append(f'{filename[len(base) + 1:]}:{frame.f_lineno} in {frame.f_code.co_name}')
+      frame = frame.f_back
+    return frames
+
+  def top_statements(self, limit):
+    ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    return [
+      {'sql': sql, 'count': count, 'total_ms': round(seconds * 1000, 2), 'origin': origin}
+      for sql, (count, seconds, origin) in ranked
+    ]
+
+
+@contextmanager
+def timed(name):
+  """
+  Adds the time spent in the block to the current request's 'name' span.
+  Does nothing outside a sampled request.
+  """
+  timing = _current.get()
+  if timing is None:
+    yield
+    return
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    timing.add(name, time.perf_counter() - start)
+
+
+class TimedSerializerMixin:
+  """
+  Times a root serializer's .data (nested serializers are covered by their root)
+  as the request's 'serialize' span.
+  """
+  @property
+  def data(self):
+    with timed('serialize'):
+      return super().data
+
+
+class QueryTimer:
+  #connection.execute_wrapper hook, the only one per request (MetricsMiddleware reads its counts)
+  def __init__(self, timing):
+    self.timing = timing
+
+  def __call__(self, execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      self.timing.record_query(sql, time.perf_counter() - start)
+
+
+class RequestTimingMiddleware:
+  """
+  Records per request the query count, DB time, serializer and Markdown time and
+  the view time (see ViewTimingMiddleware). Emits them as a Server-Timing header
+  and a JSON log line; slow views also log their most expensive SQL with where
+  it came from. Configured with the REQUEST_TIMING setting (see DEFAULTS).
+
+  Every request, sampled or not, gets its counts in request.timing.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    config = timing_settings()
+    sampled = random.random() < config['SAMPLE_RATE']
+    timing = request.timing = RequestTiming(config['STACK_DEPTH'], detailed=sampled)
+    token = _current.set(timing) if sampled else None
+    start = time.perf_counter()
+    try:
+      with ExitStack() as stack:
+        for connection in connections.all():
+          stack.enter_context(connection.execute_wrapper(QueryTimer(timing)))
+        response = self.get_response(request)
+    finally:
+      total = time.perf_counter() - start
+      if token is not None:
+        _current.reset(token)
+
+    if not sampled:
+      return response
+    if config['HEADER']:
+      response['Server-Timing'] = self.server_timing(timing, total)
+    self.log(request, response, timing, total, config)
+    return response
+
+  def server_timing(self, timing, total):
+    metrics = [f'db;dur={timing.db_time * 1000:.1f};desc="{timing.query_count} queries"']
+    metrics += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timing.spans.items()]
+    metrics.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(metrics)
+
+  def log(self, request, response, timing, total, config):
+    record = {
+      'method': request.method,
+      'path': request.path,
+      'status': response.status_code,
+      'total_ms': round(total * 1000, 2),
+      'db_ms': round(timing.db_time * 1000, 2),
+      'queries': timing.query_count,
+      **{f'{name}_ms': round(seconds * 1000, 2) for name, seconds in timing.spans.items()},
+    }
+    #Middleware time isn't the view's fault; without ViewTimingMiddleware the total stands in
+    if timing.spans.get('view', total) * 1000 < config['SLOW_REQUEST_MS']:
+      logger.info(json.dumps(record))
+      return
+
+    record['slow'] = True
+    record['top_queries'] = timing.top_statements(config['TOP_QUERIES'])
+    logger.warning(json.dumps(record))
+
+
+class ViewTimingMiddleware:
+  """
+  Times the view, from the end of the middleware chain to its rendered
+  response, as the request's 'view' span. Goes last in MIDDLEWARE, so the
+  other middleware's own work is left out.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    with timed('view'):
+      return self.get_response(request)
@@ -4,6 +4,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.http import JsonResponse
+from .metrics import metrics_view
 
 def home(request):
     return JsonResponse({
@@ -29,6 +30,7 @@ urlpatterns = [
     path("", home),
     path("api/", api_root),
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view),
     path('api/', include('users.urls')),
     path('api/', include('posts.urls')),
 ]
@@ -6,7 +6,10 @@ from .models import Post, Category
 # Register your models here.
 @admin.action(description="Mark selected posts as Published")
 def make_published(modeladmin, _request, queryset):
-    queryset.update(status='PB')
+    #Save each post so publish side effects (published_at, feed fan-out) run
+    for post in queryset.exclude(status='PB'):
+      post.status = 'PB'
+      post.save()
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
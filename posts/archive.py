@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models import Count, DateField, F
+from django.db.models.functions import Greatest, TruncMonth
+from django.utils import timezone
+from .models import Post, Category, ArchiveMonth
+from .cache_tags import ARCHIVE
+from blogging_platform_api.response_cache import invalidate
+
+
+def month_of(published_at):
+  #Months follow TIME_ZONE, like TruncMonth in rebuild()
+  return timezone.localtime(published_at).date().replace(day=1)
+
+
+def _keys(month, category_id):
+  #A post counts toward its month's total, and its category's month if it has one
+  keys = [(month, None)]
+  if category_id is not None:
+    keys.append((month, category_id))
+  return keys
+
+
+def _adjust(month, category_id, delta):
+  keys = _keys(month, category_id)
+  if delta > 0:
+    #Creates missing rows; a concurrent insert of the same row is simply skipped
+    ArchiveMonth.objects.bulk_create(
+      [ArchiveMonth(month=key_month, category_id=key_category, post_count=0) for key_month, key_category in keys],
+      ignore_conflicts=True
+    )
+  for key_month, key_category in keys:
+    ArchiveMonth.objects.filter(month=key_month, category_id=key_category).update(
+      post_count=Greatest(F('post_count') + delta, 0)
+    )
+
+
+def _contribution(status, published_at, category_id):
+  if status != Post.Status.PUBLISHED or published_at is None:
+    return None
+  return month_of(published_at), category_id
+
+
+def post_saved(post):
+  """
+  Moves a saved post's count between archive rows when it was published,
+  unpublished, moved to another category or re-dated. Returns True if it did.
+  """
+  before = _contribution(post.loaded_value('status'), post.loaded_value('published_at'), post.loaded_value('category_id'))
+  after = _contribution(post.status, post.published_at, post.category_id)
+  if before == after:
+    return False
+  if before is not None:
+    _adjust(*before, -1)
+  if after is not None:
+    _adjust(*after, 1)
+  invalidate(ARCHIVE)
+  return True
+
+
+def post_deleted(post):
+  contribution = _contribution(post.status, post.published_at, post.category_id)
+  if contribution is None:
+    return False
+  _adjust(*contribution, -1)
+  invalidate(ARCHIVE)
+  return True
+
+
+def rebuild():
+  """
+  Recomputes the whole table from the posts (two grouped queries), fixing any
+  drift left by bulk updates that skip the signals. Returns the number of rows.
+  """
+  published = (
+    Post.objects.filter(status=Post.Status.PUBLISHED, published_at__isnull=False)
+    .annotate(month=TruncMonth('published_at', output_field=DateField())).order_by()
+  )
+  rows = [
+    ArchiveMonth(month=row['month'], post_count=row['post_count'])
+    for row in published.values('month').annotate(post_count=Count('id'))
+  ]
+  rows += [
+    ArchiveMonth(month=row['month'], category_id=row['category_id'], post_count=row['post_count'])
+    for row in published.filter(category__isnull=False).values('month', 'category_id').annotate(post_count=Count('id'))
+  ]
+
+  with transaction.atomic():
+    ArchiveMonth.objects.all().delete()
+    ArchiveMonth.objects.bulk_create(rows, batch_size=1000)
+  invalidate(ARCHIVE)
+  return len(rows)
+
+
+def months(category_name=None):
+  #Newest first; read straight from the table, no aggregation over posts
+  queryset = ArchiveMonth.objects.filter(post_count__gt=0)
+  if category_name is None:
+    queryset = queryset.filter(category__isnull=True)
+  else:
+    #Looked up first, so the rows are read through the (category, month) index
+    category_id = Category.objects.filter(name__iexact=category_name).values_list('pk', flat=True).first()
+    queryset = queryset.filter(category_id=category_id) if category_id is not None else queryset.none()
+  return queryset.order_by('-month')
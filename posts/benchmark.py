@@ -0,0 +1,189 @@
+import math
+import subprocess
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from users.models import Follow, Profile
+from .models import Post, Comment, Rating, Like
+
+
+FORMAT_VERSION = 1
+
+#Writes run inside a transaction that is rolled back, so every run sees the same data
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class Scenario:
+  """
+  One benchmarked endpoint. 'paths' is cycled through, so writes can spread
+  over many rows instead of hammering one.
+  """
+  def __init__(self, name, paths, method='GET', user=None, data=None):
+    self.name = name
+    self.paths = paths
+    self.method = method
+    self.user = user
+    self.data = data
+
+  def path(self, iteration):
+    return self.paths[iteration % len(self.paths)]
+
+
+def percentile(values, pct):
+  #Nearest-rank percentile of an already sorted list
+  if not values:
+    return None
+  rank = max(1, math.ceil(pct / 100 * len(values)))
+  return values[rank - 1]
+
+
+def benchmark_host():
+  #The test client's default 'testserver' isn't in ALLOWED_HOSTS outside the test runner
+  for host in settings.ALLOWED_HOSTS:
+    if host != '*':
+      return host.lstrip('.')
+  return 'testserver'
+
+
+def current_commit():
+  try:
+    return subprocess.run(
+      ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def dataset_summary():
+  return {
+    'users': User.objects.count(),
+    'follows': Follow.objects.count(),
+    'posts': Post.objects.count(),
+    'published_posts': Post.objects.filter(status=Post.Status.PUBLISHED).count(),
+    'likes': Like.objects.count(),
+    'ratings': Rating.objects.count(),
+    'comments': Comment.objects.count(),
+  }
+
+
+def default_scenarios(page_size=20, write_targets=50):
+  """
+  The main read endpoints plus the like and rate writes, against the busiest
+  reader, the most followed author and the newest published posts.
+  """
+  reader = User.objects.annotate(following_total=Count('following')).order_by('-following_total', 'id').first()
+  author = Profile.objects.select_related('user').order_by('-follower_count', 'id').first()
+  post_ids = list(
+    Post.objects.filter(status=Post.Status.PUBLISHED).order_by('-published_at', '-id').values_list('id', flat=True)[:write_targets]
+  )
+  if reader is None or author is None or not post_ids:
+    return []
+
+  page = f'?page_size={page_size}'
+  return [
+    Scenario('posts_list', [reverse('post-list') + page]),
+    Scenario('posts_list_authenticated', [reverse('post-list') + page], user=reader),
+    Scenario('posts_search', [reverse('post-list') + page + '&search=' + term for term in ('cache', 'django', 'index')]),
+    Scenario('feed', [reverse('user-feed') + page], user=reader),
+    Scenario('explore', [reverse('explore') + page]),
+    Scenario('top_likes', [reverse('top-posts') + '?sort_by=likes']),
+    Scenario('top_trending', [reverse('top-posts') + '?sort_by=trending&window=7d']),
+    Scenario('profile', [reverse('profile-detail', kwargs={'username': author.user.username})]),
+    Scenario('post_detail', [reverse('post-detail', kwargs={'pk': pk}) for pk in post_ids]),
+    Scenario('like', [reverse('post-like', kwargs={'pk': pk}) for pk in post_ids], method='POST', user=reader),
+    Scenario('rate', [reverse('post-rate', kwargs={'pk': pk}) for pk in post_ids], method='POST', user=reader, data={'score': 4}),
+  ]
+
+
+def run_scenario(client, scenario, requests, warmup):
+  client.force_authenticate(user=scenario.user)
+  send = getattr(client, scenario.method.lower())
+  kwargs = {'data': scenario.data, 'format': 'json'} if scenario.data is not None else {}
+
+  #Warm up caches and lazy imports before measuring
+  for iteration in range(warmup):
+    send(scenario.path(iteration), **kwargs)
+
+  timings, query_counts, errors = [], [], 0
+  started = time.perf_counter()
+  for iteration in range(requests):
+    with CaptureQueriesContext(connection) as ctx:
+      begin = time.perf_counter()
+      response = send(scenario.path(warmup + iteration), **kwargs)
+      timings.append((time.perf_counter() - begin) * 1000)
+    query_counts.append(len(ctx.captured_queries))
+    if response.status_code >= 400:
+      errors += 1
+  total = time.perf_counter() - started
+
+  timings.sort()
+  return {
+    'method': scenario.method,
+    'requests': requests,
+    'errors': errors,
+    'p50_ms': round(percentile(timings, 50), 3),
+    'p95_ms': round(percentile(timings, 95), 3),
+    'p99_ms': round(percentile(timings, 99), 3),
+    'mean_ms': round(sum(timings) / len(timings), 3),
+    'throughput_rps': round(requests / total, 2) if total else None,
+    'queries_mean': round(sum(query_counts) / len(query_counts), 2),
+    'queries_max': max(query_counts),
+  }
+
+
+def run_benchmarks(requests=100, warmup=10, page_size=20, only=None):
+  """
+  Drives every scenario sequentially through the in-process test client and
+  returns a JSON-serializable report. Writes are rolled back, so their on_commit
+  work (e.g. leaderboard updates) is not part of the timings.
+  """
+  client = APIClient(HTTP_HOST=benchmark_host(), raise_request_exception=False)
+  results = {}
+  for scenario in default_scenarios(page_size=page_size):
+    if only and scenario.name not in only:
+      continue
+    if scenario.method in WRITE_METHODS:
+      with transaction.atomic():
+        results[scenario.name] = run_scenario(client, scenario, requests, warmup)
+        transaction.set_rollback(True)
+    else:
+      results[scenario.name] = run_scenario(client, scenario, requests, warmup)
+
+  return {
+    'version': FORMAT_VERSION,
+    'created_at': timezone.now().isoformat(),
+    'commit': current_commit(),
+    'database': connection.vendor,
+    'dataset': dataset_summary(),
+    'config': {'requests': requests, 'warmup': warmup, 'page_size': page_size},
+    'scenarios': results,
+  }
+
+
+def compare(baseline, current, threshold=10.0):
+  """
+  Per scenario changes against a baseline report. A scenario regresses when its
+  p95 grows by more than 'threshold' percent or it runs more queries.
+  """
+  rows = []
+  for name, after in current['scenarios'].items():
+    before = baseline.get('scenarios', {}).get(name)
+    if before is None:
+      continue
+    change = (after['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+    rows.append({
+      'scenario': name,
+      'p95_before_ms': before['p95_ms'],
+      'p95_after_ms': after['p95_ms'],
+      'p95_change_pct': round(change, 1),
+      'queries_before': before['queries_max'],
+      'queries_after': after['queries_max'],
+      'regression': change > threshold or after['queries_max'] > before['queries_max'],
+    })
+  return rows
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from blogging_platform_api.response_cache import invalidate
+
+
+#Tags of the anonymous response cache (see blogging_platform_api/response_cache.py)
+EXPLORE = 'explore'
+TOP = 'top'
+CATEGORIES = 'categories'
+#Only moved by posts/archive.py, when a post enters, leaves or moves between months
+ARCHIVE = 'archive'
+
+
+def category(name):
+  #Category pages are looked up case-insensitively
+  return f'category:{name.lower()}'
+
+
+def profile(username):
+  return f'profile:{username}'
+
+
+def invalidate_post(author_id, *category_ids):
+  """
+  Everything a published post shows up in: the public lists, its author's
+  profile and its category pages (old and new, when it moved).
+  """
+  from .models import Category
+
+  tags = [EXPLORE, TOP, CATEGORIES]
+  tags += [profile(name) for name in User.objects.filter(pk=author_id).values_list('username', flat=True)]
+  tags += [category(name) for name in Category.objects.filter(pk__in=[pk for pk in category_ids if pk]).values_list('name', flat=True)]
+  invalidate(*tags)
+
+
+def invalidate_published_post(post_id):
+  #Counters, comments and tags of a post show wherever it is listed
+  from .models import Post
+
+  post = Post.objects.filter(pk=post_id).values('status', 'author__username', 'category__name').first()
+  if post is None or post['status'] != Post.Status.PUBLISHED:
+    return
+  tags = [EXPLORE, TOP, profile(post['author__username'])]
+  if post['category__name']:
+    tags.append(category(post['category__name']))
+  invalidate(*tags)
+
+
+def invalidate_profiles(*user_ids):
+  invalidate(*[profile(name) for name in User.objects.filter(pk__in=user_ids).values_list('username', flat=True)])
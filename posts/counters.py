@@ -0,0 +1,142 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Count, Sum, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .models import Post, Comment, Rating, Like
+from .tasks import update_leaderboards
+from .cache_tags import invalidate_published_post
+
+
+COUNTER_FIELDS = Post.COUNTER_FIELDS
+
+
+def adjust_post_counters(post_id, **deltas):
+  """
+  Atomically applies counter deltas to a post, e.g. adjust_post_counters(1, like_count=1).
+  The arithmetic happens in the UPDATE itself, so concurrent requests can't lose increments.
+  """
+  #Decrements are clamped at zero so a drifted counter can't break a delete; reconcile fixes drift
+  updates = {
+    field: F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+    for field, delta in deltas.items() if delta
+  }
+  if updates:
+    #The counters are part of the post payload, so they move its conditional GET validators too
+    Post.objects.filter(pk=post_id).update(**updates, version=F('version') + 1, updated_at=timezone.now())
+    _counters_changed(post_id)
+
+
+def _counters_changed(post_id):
+  #After the UPDATE, so a request racing this one can't re-cache the old counts
+  invalidate_published_post(post_id)
+  #Engagement changed, so the post may move on the leaderboards
+  transaction.on_commit(lambda: update_leaderboards.delay(post_id))  # type: ignore
+
+
+def apply_rating_change(post_id, old_score, new_score):
+  """
+  Moves a post's rating aggregates from one user's old score to their new one:
+  old_score None for a new rating, new_score None for a deleted one.
+  """
+  deltas = {'rating_count': (new_score is not None) - (old_score is not None), 'rating_sum': (new_score or 0) - (old_score or 0)}
+  if old_score != new_score:
+    if old_score is not None:
+      deltas[f'rating_count_{old_score}'] = -1
+    if new_score is not None:
+      deltas[f'rating_count_{new_score}'] = 1
+  adjust_post_counters(post_id, **deltas)
+
+
+def toggle_like(post_id, user_id):
+  """
+  Likes the post for the user, or unlikes it if they already did. The DELETE
+  (or the conflict-safe INSERT) and the counter UPDATE commit together, so
+  concurrent toggles can't double count. Returns (liked, like_count) with the
+  count read back from the updated row rather than counted.
+  Raises Post.DoesNotExist for an unknown post.
+  """
+  with transaction.atomic():
+    if Like.objects.filter(post_id=post_id, user_id=user_id).delete()[0]:
+      liked, delta = False, -1
+    else:
+      try:
+        with transaction.atomic():
+          Like.objects.create(post_id=post_id, user_id=user_id)
+        liked, delta = True, 1
+      except IntegrityError:
+        #A concurrent toggle by the same user inserted it first
+        liked, delta = True, 0
+    adjust_post_counters(post_id, like_count=delta)
+    #Also rolls back the insert when the post doesn't exist
+    like_count = Post.objects.values_list('like_count', flat=True).get(pk=post_id)
+  return liked, like_count
+
+
+def touch_post(post_id):
+  """
+  Marks a post changed for conditional requests when something nested in its
+  payload changed (an edited comment, its tags) without a counter update.
+  """
+  Post.objects.filter(pk=post_id).update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def _per_post(queryset, aggregate):
+  #Correlated subquery returning a single aggregate for the outer post
+  return Coalesce(
+    Subquery(
+      queryset.filter(post_id=OuterRef('pk')).order_by().values('post_id').annotate(value=aggregate).values('value'),
+      output_field=IntegerField()
+    ),
+    0
+  )
+
+
+def _counter_sources():
+  #Counter field -> the value it should have, computed from the source tables
+  return {
+    'like_count': _per_post(Like.objects.all(), Count('*')),
+    'rating_count': _per_post(Rating.objects.all(), Count('*')),
+    'rating_sum': _per_post(Rating.objects.all(), Sum('score')),
+    'comment_count': _per_post(Comment.objects.all(), Count('*')),
+    **{
+      f'rating_count_{score}': _per_post(Rating.objects.filter(score=score), Count('*'))
+      for score in Post.RATING_SCORES
+    },
+  }
+
+
+LIKE_FIELDS = ['like_count']
+RATING_FIELDS = ['rating_count', 'rating_sum'] + [f'rating_count_{score}' for score in Post.RATING_SCORES]
+
+
+def recount_post_counters(post_ids, fields):
+  """
+  Sets 'fields' of a few posts from the source tables, for bulk writes that
+  can't tell which of their rows were really written (an INSERT that skipped
+  conflicts, an upsert that updated a row inserted concurrently).
+  The posts are locked first: a concurrent adjust_post_counters either
+  committed before the count and is included in it, or waits for this
+  transaction and then adds its own delta.
+  """
+  post_ids = list(post_ids)
+  if not post_ids:
+    return
+  sources = _counter_sources()
+  with transaction.atomic():
+    list(Post.objects.select_for_update().filter(pk__in=post_ids).values_list('pk', flat=True))
+    Post.objects.filter(pk__in=post_ids).update(
+      **{field: sources[field] for field in fields}, version=F('version') + 1, updated_at=timezone.now()
+    )
+  for post_id in post_ids:
+    _counters_changed(post_id)
+
+
+def reconcile_post_counters(queryset=None):
+  """
+  Recomputes every denormalized counter from the source tables with one UPDATE.
+  Returns the number of posts updated.
+  """
+  if queryset is None:
+    queryset = Post.objects.all()
+
+  return queryset.update(**_counter_sources())
@@ -0,0 +1,134 @@
+from django.db import transaction
+from rest_framework import status
+from .models import Post, Like, Rating
+from .counters import recount_post_counters, LIKE_FIELDS, RATING_FIELDS
+from . import outbox
+
+
+def _published(post_ids, fields):
+  return {post['pk']: post for post in Post.objects.filter(pk__in=post_ids, status=Post.Status.PUBLISHED).values('pk', *fields)}
+
+
+def _not_found(post_id):
+  return {'post': post_id, 'status': status.HTTP_404_NOT_FOUND, 'errors': {'post': ['Post not found.']}}
+
+
+def _avg(post):
+  #Same Bayesian average as PostSerializer.avg_rating
+  return Post.bayesian_average(post['rating_sum'], post['rating_count']) if post['rating_count'] else None
+
+
+HISTOGRAM_FIELDS = [f'rating_count_{score}' for score in Post.RATING_SCORES]
+
+
+def engagement_state(post_ids, user):
+  """
+  Counts and the viewer's like and rating for many posts: one query for the
+  posts, and one each for the viewer's likes and ratings. Results follow the
+  order of 'post_ids'; unknown and unpublished posts get a 404 entry.
+  """
+  posts = _published(post_ids, ['like_count', 'rating_count', 'rating_sum', 'comment_count', *HISTOGRAM_FIELDS])
+  liked, scores = set(), {}
+  if user.is_authenticated and posts:
+    liked = set(Like.objects.filter(user_id=user.pk, post_id__in=posts).values_list('post_id', flat=True))
+    scores = dict(Rating.objects.filter(user_id=user.pk, post_id__in=posts).values_list('post_id', 'score'))
+
+  results = []
+  for post_id in post_ids:
+    post = posts.get(post_id)
+    if post is None:
+      results.append(_not_found(post_id))
+      continue
+    results.append({
+      'post': post_id,
+      'status': status.HTTP_200_OK,
+      'has_liked': post_id in liked,
+      'my_rating': scores.get(post_id),
+      'likes_count': post['like_count'],
+      'rating_count': post['rating_count'],
+      'avg_rating': _avg(post),
+      'rating_histogram': {str(score): post[f'rating_count_{score}'] for score in Post.RATING_SCORES},
+      'comment_count': post['comment_count'],
+    })
+  return results
+
+
+def apply_likes(user, items):
+  """
+  Sets the user's like on many posts in one transaction. 'items' maps post id
+  to True (like) or False (unlike); both are idempotent. Returns one result
+  per item, in order, with 201 for a new like and 404 for unknown posts.
+  """
+  results = {}
+  with transaction.atomic():
+    posts = _published(items, [])
+    found = [post_id for post_id in items if post_id in posts]
+    existing = set(
+      Like.objects.select_for_update().filter(user_id=user.pk, post_id__in=found).values_list('post_id', flat=True)
+    )
+    liking = [post_id for post_id in found if items[post_id] and post_id not in existing]
+    unliking = [post_id for post_id in found if not items[post_id] and post_id in existing]
+
+    #A like inserted concurrently after the read above is skipped here, so the
+    #counts are taken from the rows rather than from 'liking'
+    Like.objects.bulk_create([Like(user_id=user.pk, post_id=post_id) for post_id in liking], ignore_conflicts=True)
+    if unliking:
+      Like.objects.filter(user_id=user.pk, post_id__in=unliking).delete()
+    recount_post_counters(liking + unliking, LIKE_FIELDS)
+
+    counts = dict(Post.objects.filter(pk__in=found).values_list('pk', 'like_count'))
+
+  for post_id, liked in items.items():
+    if post_id not in posts:
+      results[post_id] = _not_found(post_id)
+      continue
+    results[post_id] = {
+      'post': post_id,
+      'status': status.HTTP_201_CREATED if post_id in liking else status.HTTP_200_OK,
+      'has_liked': liked,
+      'likes_count': counts[post_id],
+    }
+  return list(results.values())
+
+
+def apply_ratings(user, items):
+  """
+  Saves the user's score (1-5) for many posts in one transaction with a single
+  upsert, then recounts the aggregates of the posts it changed. 'items' maps
+  post id to score. Returns one result per item, in order, with 201 for a new
+  rating.
+  """
+  results = {}
+  with transaction.atomic():
+    posts = _published(items, [])
+    found = [post_id for post_id in items if post_id in posts]
+    previous = dict(
+      Rating.objects.select_for_update().filter(user_id=user.pk, post_id__in=found).values_list('post_id', 'score')
+    )
+    #The upsert also overwrites a rating inserted concurrently after the read
+    #above, so the aggregates are taken from the rows rather than from 'previous'
+    Rating.objects.bulk_create(
+      [Rating(user_id=user.pk, post_id=post_id, score=items[post_id]) for post_id in found],
+      update_conflicts=True, unique_fields=['user', 'post'], update_fields=['score'],
+    )
+    changed = [post_id for post_id in found if previous.get(post_id) != items[post_id]]
+    recount_post_counters(changed, RATING_FIELDS)
+    for post_id in changed:
+      #bulk_create skips the post_save signal that announces five-star ratings
+      if items[post_id] == 5:
+        outbox.publish('rating.five_star', post_id=post_id)
+
+    totals = {post['pk']: post for post in Post.objects.filter(pk__in=found).values('pk', 'rating_count', 'rating_sum')}
+
+  for post_id, score in items.items():
+    if post_id not in posts:
+      results[post_id] = _not_found(post_id)
+      continue
+    results[post_id] = {
+      'post': post_id,
+      'status': status.HTTP_200_OK if post_id in previous else status.HTTP_201_CREATED,
+      'score': score,
+      'rating_count': totals[post_id]['rating_count'],
+      'avg_rating': _avg(totals[post_id]),
+    }
+  return list(results.values())
@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Greatest
+from .models import Post, Category, Tag, FacetCount
+from .cache_tags import CATEGORIES
+from blogging_platform_api.response_cache import invalidate
+
+
+Facet = FacetCount.Facet
+
+#Facet -> the model its value_id points at, and the field shown as its value
+LABELS = {
+  Facet.CATEGORY: (Category, 'name'),
+  Facet.TAG: (Tag, 'name'),
+  Facet.AUTHOR: (User, 'username'),
+}
+
+PostTag = Post.tags.through
+
+
+def facet_limit():
+  #Values returned per facet, biggest first
+  return settings.FACET_LIMIT
+
+
+def _adjust(facet, value_ids, delta):
+  value_ids = [pk for pk in value_ids if pk is not None]
+  if not value_ids or not delta:
+    return
+  if delta > 0:
+    FacetCount.objects.bulk_create([FacetCount(facet=facet, value_id=pk) for pk in value_ids], ignore_conflicts=True)
+  FacetCount.objects.filter(facet=facet, value_id__in=value_ids).update(post_count=Greatest(F('post_count') + delta, 0))
+
+
+def _count_post(post, category_id, delta):
+  _adjust(Facet.AUTHOR, [post.author_id], delta)
+  _adjust(Facet.CATEGORY, [category_id], delta)
+  _adjust(Facet.TAG, PostTag.objects.filter(post_id=post.pk).values_list('tag_id', flat=True), delta)
+
+
+def post_saved(post):
+  #Publishing, unpublishing and moving a published post between categories
+  was_published = post.loaded_value('status') == Post.Status.PUBLISHED
+  is_published = post.status == Post.Status.PUBLISHED
+  if was_published and is_published:
+    if post.loaded_value('category_id') != post.category_id:
+      _adjust(Facet.CATEGORY, [post.loaded_value('category_id')], -1)
+      _adjust(Facet.CATEGORY, [post.category_id], 1)
+  elif is_published:
+    _count_post(post, post.category_id, 1)
+  elif was_published:
+    _count_post(post, post.loaded_value('category_id'), -1)
+
+
+def post_deleting(post):
+  #Before the delete, while the post's tags are still there to be counted
+  if post.status == Post.Status.PUBLISHED:
+    _count_post(post, post.category_id, -1)
+
+
+def tags_changed(instance, action, reverse, pk_set):
+  """
+  Follows post.tags.add/remove/clear and the reverse tag.post_set calls.
+  Only published posts count.
+  """
+  if action == 'post_add':
+    #Django leaves links that already existed out of pk_set
+    if not reverse:
+      if instance.status == Post.Status.PUBLISHED:
+        _adjust(Facet.TAG, pk_set, 1)
+    else:
+      published = Post.objects.filter(pk__in=pk_set, status=Post.Status.PUBLISHED).count()
+      _adjust(Facet.TAG, [instance.pk], published)
+  elif action == 'pre_remove':
+    #pk_set holds every id passed to remove(), linked or not, so only the
+    #links about to be deleted are counted
+    if not reverse:
+      if instance.status == Post.Status.PUBLISHED:
+        _adjust(Facet.TAG, PostTag.objects.filter(post_id=instance.pk, tag_id__in=pk_set).values_list('tag_id', flat=True), -1)
+    else:
+      published = PostTag.objects.filter(tag_id=instance.pk, post_id__in=pk_set, post__status=Post.Status.PUBLISHED).count()
+      _adjust(Facet.TAG, [instance.pk], -published)
+  elif action == 'pre_clear':
+    if not reverse:
+      if instance.status == Post.Status.PUBLISHED:
+        _adjust(Facet.TAG, PostTag.objects.filter(post_id=instance.pk).values_list('tag_id', flat=True), -1)
+    else:
+      published = PostTag.objects.filter(tag_id=instance.pk, post__status=Post.Status.PUBLISHED).count()
+      _adjust(Facet.TAG, [instance.pk], -published)
+  else:
+    return
+  #Tag facets are part of /api/categories/?facets=true
+  invalidate(CATEGORIES)
+
+
+def value_deleted(facet, pk):
+  FacetCount.objects.filter(facet=facet, value_id=pk).delete()
+
+
+def rebuild():
+  """
+  Recomputes every facet count from the posts (three grouped queries), fixing
+  drift left by bulk updates that skip the signals. Returns the number of rows.
+  """
+  published = Post.objects.filter(status=Post.Status.PUBLISHED).order_by()
+  grouped = {
+    Facet.CATEGORY: published.filter(category__isnull=False).values_list('category_id').annotate(Count('pk')),
+    Facet.AUTHOR: published.values_list('author_id').annotate(Count('pk')),
+    Facet.TAG: PostTag.objects.filter(post__status=Post.Status.PUBLISHED).order_by().values_list('tag_id').annotate(Count('pk')),
+  }
+  rows = [
+    FacetCount(facet=facet, value_id=value_id, post_count=post_count)
+    for facet, counts in grouped.items() for value_id, post_count in counts
+  ]
+
+  with transaction.atomic():
+    FacetCount.objects.all().delete()
+    FacetCount.objects.bulk_create(rows, batch_size=1000)
+  invalidate(CATEGORIES)
+  return len(rows)
+
+
+def _stored(facet):
+  model, field = LABELS[facet]
+  rows = (
+    FacetCount.objects.filter(facet=facet, post_count__gt=0).order_by('-post_count', 'value_id')
+    .annotate(value=Subquery(model.objects.filter(pk=OuterRef('value_id')).values(field)[:1]))
+    .values('value', count=F('post_count'))[:facet_limit()]
+  )
+  return [row for row in rows if row['value'] is not None]
+
+
+def _grouped(queryset, label):
+  #A post matched through several joined rows (tags, search) still counts once
+  return list(
+    queryset.values(value=F(label)).annotate(count=Count('pk', distinct=True)).order_by('-count', 'value')[:facet_limit()]
+  )
+
+
+def counts(queryset=None):
+  """
+  Published post counts per category, tag and author:
+  {'category': [{'value': 'Tech', 'count': 12}, ...], 'tags': [...], 'author': [...]}.
+  The values can be passed back as the ?category=, ?tags= and ?author= filters.
+  Without a queryset they are read from FacetCount; for a filtered post list
+  they take one grouped query per facet over its published posts.
+  """
+  if queryset is None:
+    return {facet: _stored(facet) for facet in Facet.values}
+
+  published = queryset.filter(status=Post.Status.PUBLISHED).order_by()
+  tagged = PostTag.objects.filter(post__in=published.values('pk')).order_by()
+  return {
+    Facet.CATEGORY.value: _grouped(published.filter(category__isnull=False), 'category__name'),
+    Facet.TAG.value: list(
+      tagged.values(value=F('tag__name')).annotate(count=Count('post_id', distinct=True)).order_by('-count', 'value')[:facet_limit()]
+    ),
+    Facet.AUTHOR.value: _grouped(published, 'author__username'),
+  }
+
+
+class FacetsMixin:
+  """
+  ?facets=true adds a 'facets' key with counts(get_facet_queryset()) to a
+  list response.
+  """
+  facets_param = 'facets'
+
+  def wants_facets(self):
+    return self.request.query_params.get(self.facets_param, '').lower() in ('1', 'true', 'yes')  # type: ignore [attr-defined]
+
+  def get_facet_queryset(self):
+    #None: the unfiltered counts
+    return None
+
+  def list(self, request, *args, **kwargs):
+    response = super().list(request, *args, **kwargs)  # type: ignore [misc]
+    if self.wants_facets():
+      response.data['facets'] = counts(self.get_facet_queryset())
+    return response
@@ -1,5 +1,57 @@
 import django_filters
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from django.db.models import Case, F, FloatField, Value, When
+from rest_framework.filters import OrderingFilter
 from .models import Post
+from .leaderboards import bayesian_rating_expression
+
+
+def avg_rating_expression():
+  #PostSerializer.avg_rating in SQL: the Bayesian average, NULL for unrated posts
+  return Case(When(rating_count=0, then=Value(None)), default=bayesian_rating_expression(), output_field=FloatField())
+
+
+def day_start(day):
+  #Midnight in TIME_ZONE, the same days the archive months are cut from
+  return datetime.combine(day, time.min, tzinfo=timezone.get_current_timezone())
+
+
+class PostOrderingFilter(OrderingFilter):
+  """
+  ?ordering=-avg_rating,likes_count for post lists. Every key is a counter
+  column or computed from them, so no ordering aggregates over ratings or
+  likes. Unrated posts come last both ways, and ties break on id.
+  """
+  #Public name (as in the payload) -> column or annotation
+  orderings = {
+    'published_at': 'published_at',
+    'created_at': 'created_at',
+    'likes_count': 'like_count',
+    'comment_count': 'comment_count',
+    'rating_count': 'rating_count',
+    'avg_rating': 'avg_rating_rank',
+  }
+
+  def get_valid_fields(self, queryset, view, context={}):
+    return [(name, name) for name in self.orderings]
+
+  def filter_queryset(self, request, queryset, view):
+    #Without the parameter the list keeps its own (keyset) ordering
+    if not request.query_params.get(self.ordering_param):
+      return queryset
+    ordering = self.get_ordering(request, queryset, view)
+    if not ordering:
+      return queryset
+
+    if any(name.lstrip('-') == 'avg_rating' for name in ordering):
+      queryset = queryset.annotate(avg_rating_rank=avg_rating_expression())
+    expressions = []
+    for name in ordering:
+      column = F(self.orderings[name.lstrip('-')])
+      expressions.append(column.desc(nulls_last=True) if name.startswith('-') else column.asc(nulls_last=True))
+    return queryset.order_by(*expressions, '-id')
+
 
 class PostFilter(django_filters.FilterSet):
   #Filtering for Category(using the 'name' slug)
@@ -18,14 +70,25 @@ class PostFilter(django_filters.FilterSet):
   tags = django_filters.CharFilter(field_name='tags__name', lookup_expr='iexact')
 
   #Date Filtering Refinement
+  #Days are turned into published_at ranges (not published_at__date), so the
+  #published_at indexes serve them
   #This allows users to find posts on a specific day
-  published_date = django_filters.DateFilter(field_name='published_date')
+  published_date = django_filters.DateFilter(method='filter_published_date')
 
-  #Allow filtering between two dates
-  published_after = django_filters.DateFilter(field_name='published_date', lookup_expr='gte')#Greater than or Equal to
-  published_before = django_filters.DateFilter(field_name='published_date', lookup_expr='lte') #Less Than or Equal to
+  #Allow filtering between two dates, both inclusive
+  published_after = django_filters.DateFilter(method='filter_published_after') #On or after
+  published_before = django_filters.DateFilter(method='filter_published_before') #On or before
 
   class Meta:
     model = Post
     #Include fields that can be filtered directly (e.g., published_date)
     fields = ['category', 'author', 'tags', 'published_date']
+
+  def filter_published_date(self, queryset, name, value):
+    return queryset.filter(published_at__gte=day_start(value), published_at__lt=day_start(value + timedelta(days=1)))
+
+  def filter_published_after(self, queryset, name, value):
+    return queryset.filter(published_at__gte=day_start(value))
+
+  def filter_published_before(self, queryset, name, value):
+    return queryset.filter(published_at__lt=day_start(value + timedelta(days=1)))
@@ -0,0 +1,186 @@
+import math
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Q, Value
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from .models import Post, LeaderboardEntry
+from .cache_tags import TOP
+from blogging_platform_api.response_cache import invalidate
+
+
+Metric = LeaderboardEntry.Metric
+Window = LeaderboardEntry.Window
+
+WINDOWS = {
+  Window.DAY: timedelta(hours=24),
+  Window.WEEK: timedelta(days=7),
+  Window.ALL: None,
+}
+
+#Fields the scores are computed from, so posts can be loaded with only()
+SCORE_FIELDS = ['id', 'status', 'published_at', 'like_count', 'rating_count', 'rating_sum', 'comment_count']
+
+#Older posts can't realistically outrank recent ones on trending, so the
+#all-time trending rebuild only scores this many of the newest posts
+TRENDING_CANDIDATES = 5000
+
+
+def board_size():
+  return settings.LEADERBOARD_SIZE
+
+
+def trending_score(post):
+  """
+  Log of engagement plus a recency bonus, Reddit "hot" style. A post published
+  TRENDING_TIMESCALE seconds later needs 10x less engagement to rank equally.
+  Scores never need re-decaying, so boards can be maintained incrementally.
+  """
+  engagement = post.like_count + 2 * post.rating_count + post.comment_count
+  return math.log10(max(engagement, 1)) + post.published_at.timestamp() / settings.TRENDING_TIMESCALE
+
+
+def bayesian_rating_expression():
+  #SQL twin of Post.bayesian_rating, so the rating board can be ordered in the database
+  weight = settings.RATING_PRIOR_WEIGHT
+  return ExpressionWrapper(
+    (Value(weight * settings.RATING_PRIOR_MEAN) + F('rating_sum')) / (Value(float(weight)) + F('rating_count')),
+    output_field=FloatField()
+  )
+
+
+def score(post, metric):
+  if metric == Metric.LIKES:
+    return float(post.like_count)
+  if metric == Metric.RATING:
+    return post.bayesian_rating
+  return trending_score(post)
+
+
+def window_start(window, now=None):
+  span = WINDOWS[window]
+  if span is None:
+    return None
+  return (now or timezone.now()) - span
+
+
+def windows_for(post, now=None):
+  return [
+    window for window in WINDOWS
+    if window_start(window, now) is None or post.published_at >= window_start(window, now)
+  ]
+
+
+def record_engagement(post_id):
+  """
+  Re-scores one post after a like, rating or comment and updates every board it
+  qualifies for. Runs in a fixed number of queries whatever the number of boards:
+  one read for the boards' last places and the post's entries, then at most one
+  delete and one upsert.
+  """
+  post = Post.objects.filter(pk=post_id).only(*SCORE_FIELDS).first()
+  if post is None or post.status != Post.Status.PUBLISHED or post.published_at is None:
+    remove_post(post_id)
+    return
+
+  size = board_size()
+  windows = windows_for(post)
+  rank = models.Window(RowNumber(), partition_by=[F('metric'), F('window')], order_by=[F('score').desc(), F('post_id').desc()])
+  rows = (
+    LeaderboardEntry.objects.filter(window__in=windows).annotate(rank=rank)
+    .filter(Q(rank__gte=size) | Q(post_id=post_id)).order_by('rank')
+    .values_list('id', 'metric', 'window', 'post_id', 'score')
+  )
+  entries, tails = {}, {}
+  for entry_id, metric, window, entry_post_id, entry_score in rows:
+    if entry_post_id == post_id:
+      entries[metric, window] = entry_id
+    else:
+      #The board's last place first, then anything past it
+      tails.setdefault((metric, window), []).append((entry_id, entry_score))
+
+  deleted, upserts = [], []
+  for window in windows:
+    for metric in Metric:
+      entry_id = entries.get((metric, window))
+      #Unrated posts would all tie at the prior mean, so they stay off the rating board
+      if metric == Metric.RATING and not post.rating_count:
+        if entry_id is not None:
+          deleted.append(entry_id)
+        continue
+
+      value = score(post, metric)
+      tail = tails.get((metric, window))
+      if entry_id is None and tail:
+        #A full board: the post has to beat the last place, which it then pushes off
+        if value <= tail[0][1]:
+          continue
+        deleted += [tail_id for tail_id, _ in tail]
+      upserts.append(LeaderboardEntry(metric=metric, window=window, post_id=post_id, score=value))
+
+  if not deleted and not upserts:
+    return
+  with transaction.atomic():
+    if deleted:
+      LeaderboardEntry.objects.filter(id__in=deleted).delete()
+    LeaderboardEntry.objects.bulk_create(
+      upserts, update_conflicts=True, unique_fields=['metric', 'window', 'post'], update_fields=['score']
+    )
+
+  #Cached /api/top/ responses follow the boards, not the posts
+  invalidate(TOP)
+
+
+def remove_post(post_id):
+  LeaderboardEntry.objects.filter(post_id=post_id).delete()
+  invalidate(TOP)
+
+
+def rebuild(now=None):
+  """
+  Recomputes every board from scratch; also drops posts that aged out of a window.
+  """
+  now = now or timezone.now()
+  size = board_size()
+
+  for window in WINDOWS:
+    candidates = Post.objects.filter(status=Post.Status.PUBLISHED, published_at__isnull=False).only(*SCORE_FIELDS)
+    start = window_start(window, now)
+    if start is not None:
+      candidates = candidates.filter(published_at__gte=start)
+
+    top = {
+      Metric.LIKES: list(candidates.order_by('-like_count', '-id')[:size]),
+      Metric.RATING: list(
+        candidates.filter(rating_count__gt=0).annotate(rating_rank=bayesian_rating_expression()).order_by('-rating_rank', '-id')[:size]
+      ),
+      Metric.TRENDING: sorted(
+        candidates.order_by('-published_at')[:TRENDING_CANDIDATES], key=trending_score, reverse=True
+      )[:size],
+    }
+
+    with transaction.atomic():
+      LeaderboardEntry.objects.filter(window=window).delete()
+      LeaderboardEntry.objects.bulk_create([
+        LeaderboardEntry(metric=metric, window=window, post_id=post.id, score=score(post, metric))
+        for metric, posts in top.items() for post in posts
+      ])
+  invalidate(TOP)
+
+
+def top_posts(metric, window, now=None):
+  """
+  The board's posts, best first. Reads at most LEADERBOARD_SIZE rows from the rank index.
+  """
+  queryset = Post.objects.filter(
+    leaderboard_entries__metric=metric,
+    leaderboard_entries__window=window,
+    status=Post.Status.PUBLISHED,
+  )
+  #Entries that aged out since the last rebuild are hidden, not re-ranked
+  start = window_start(window, now)
+  if start is not None:
+    queryset = queryset.filter(published_at__gte=start)
+
+  return queryset.order_by('-leaderboard_entries__score', '-id')
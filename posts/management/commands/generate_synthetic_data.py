@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from posts.synthetic import SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+  help = 'Generates a reproducible synthetic dataset (users, follows, posts, likes, ratings, comments) for benchmarking.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--avg-follows', type=float, default=20, help='Mean follows per user (power-law distributed).')
+    parser.add_argument('--avg-likes', type=float, default=5, help='Mean likes per published post.')
+    parser.add_argument('--avg-ratings', type=float, default=2, help='Mean ratings per published post.')
+    parser.add_argument('--avg-comments', type=float, default=2, help='Mean comments per published post.')
+    parser.add_argument('--draft-ratio', type=float, default=0.1, help='Share of posts left as drafts.')
+    parser.add_argument('--days', type=int, default=30, help='Publication dates are spread over this many days.')
+    parser.add_argument('--prefix', default='synthetic', help='Prefix for generated usernames, category and tag names.')
+    parser.add_argument('--seed', type=int, default=0, help='Same seed and options give the same dataset.')
+
+  def handle(self, *args, **options):
+    if options['users'] < 1 or options['categories'] < 1 or options['tags'] < 1:
+      raise CommandError('--users, --categories and --tags must be at least 1.')
+    if User.objects.filter(username__startswith=options['prefix']).exists():
+      raise CommandError(f"Users named '{options['prefix']}...' already exist, pick another --prefix.")
+
+    generator = SyntheticDataGenerator(
+      users=options['users'], posts=options['posts'], categories=options['categories'], tags=options['tags'],
+      avg_follows=options['avg_follows'], avg_likes=options['avg_likes'], avg_ratings=options['avg_ratings'],
+      avg_comments=options['avg_comments'], draft_ratio=options['draft_ratio'], days=options['days'],
+      prefix=options['prefix'], seed=options['seed'],
+    )
+    with transaction.atomic():
+      counts = generator.generate(log=lambda message: self.stdout.write(f'  {message}'))
+
+    #bulk_create skips the signals, so rebuild what they maintain
+    for command in ['rebuild_timelines', 'rebuild_leaderboards', 'rebuild_search_index', 'rebuild_facets', 'rebuild_archive']:
+      call_command(command, stdout=self.stdout)
+
+    summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+    self.stdout.write(self.style.SUCCESS(f'Done. Generated {summary}.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from posts import archive
+
+
+class Command(BaseCommand):
+  help = 'Recomputes the per-month (and per-category) archive post counts from the posts.'
+
+  def handle(self, *args, **options):
+    rows = archive.rebuild()
+    self.stdout.write(self.style.SUCCESS(f'Done. {rows} archive rows rebuilt.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from posts import facets
+
+
+class Command(BaseCommand):
+  help = 'Recomputes the published post counts per category, tag and author used by ?facets=true.'
+
+  def handle(self, *args, **options):
+    rows = facets.rebuild()
+    self.stdout.write(self.style.SUCCESS(f'Done. {rows} facet counts rebuilt.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from posts import leaderboards
+
+
+class Command(BaseCommand):
+  help = 'Recomputes the top posts leaderboards (likes, rating and trending for every window).'
+
+  def handle(self, *args, **options):
+    leaderboards.rebuild()
+    self.stdout.write(self.style.SUCCESS('Done. Leaderboards rebuilt.'))
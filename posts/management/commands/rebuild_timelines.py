@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from users.models import Follow
+from posts import timelines
+from posts.models import CategorySubscription
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+  help = 'Backfills the materialized feed timelines from existing follows and category subscriptions.'
+
+  def handle(self, *args, **options):
+    follows = Follow.objects.values_list('id', 'follower_id', 'followed_user_id')
+    subscriptions = CategorySubscription.objects.values_list('id', 'user_id', 'category_id')
+
+    for rows, backfill in [(follows, timelines.backfill_author), (subscriptions, timelines.backfill_category)]:
+      for batch in self.batches(rows):
+        #One transaction per batch rather than per backfill, commits dominate otherwise
+        with transaction.atomic():
+          for _, user_id, target_id in batch:
+            backfill(user_id, target_id)
+
+    self.stdout.write(self.style.SUCCESS('Done. Timelines rebuilt.'))
+
+  def batches(self, rows):
+    #Keyset pages on id: only one batch is in memory, and no cursor stays open across the writes
+    last_id = 0
+    while True:
+      batch = list(rows.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+      if not batch:
+        return
+      yield batch
+      last_id = batch[-1][0]
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from posts.counters import reconcile_post_counters
+from posts.models import Post
+
+
+class Command(BaseCommand):
+  help = 'Recomputes the denormalized like/rating/comment counters on every post.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Number of posts updated per statement.')
+
+  def handle(self, *args, **options):
+    chunk_size = options['chunk_size']
+    max_id = Post.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    total = 0
+
+    #Update in primary key ranges so no single statement locks the whole table
+    for start in range(0, max_id, chunk_size):
+      total += reconcile_post_counters(Post.objects.filter(id__gt=start, id__lte=start + chunk_size))
+
+    self.stdout.write(self.style.SUCCESS(f"Done. Counters reconciled on {total} posts."))
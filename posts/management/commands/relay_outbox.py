@@ -0,0 +1,30 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from posts import outbox
+
+
+class Command(BaseCommand):
+  help = 'Carries out pending outbox events (emails, notification fan-out). Runs until stopped unless --once is given.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=100, help='Events claimed per batch.')
+    parser.add_argument('--lease', type=int, default=60, help='Seconds a claimed batch is reserved for this relay.')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when nothing is pending.')
+    parser.add_argument('--once', action='store_true', help='Drain the pending events and exit.')
+    parser.add_argument('--purge-days', type=int, default=7, help='Delete processed events older than this (0 keeps them).')
+
+  def handle(self, *args, **options):
+    worker = outbox.worker_id()
+    if options['purge_days']:
+      outbox.purge(timedelta(days=options['purge_days']))
+
+    while True:
+      totals = outbox.relay(worker, batch_size=options['batch_size'], lease_seconds=options['lease'])
+      if totals['processed'] or totals['failed']:
+        self.stdout.write(f"{totals['processed']} processed, {totals['failed']} failed")
+      if options['once']:
+        break
+      time.sleep(options['interval'])
+
+    self.stdout.write(self.style.SUCCESS('Done. Outbox drained.'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from posts.models import Post
+from posts.rendering import RENDER_VERSION
+
+
+class Command(BaseCommand):
+  help = 'Re-renders the stored content_html of posts rendered by an older renderer/allowlist.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--chunk-size', type=int, default=500, help='Number of posts rendered per batch.')
+    parser.add_argument('--all', action='store_true', help='Re-render every post, not only stale ones.')
+
+  def handle(self, *args, **options):
+    chunk_size = options['chunk_size']
+    queryset = Post.objects.all()
+    if not options['all']:
+      queryset = queryset.exclude(render_version=RENDER_VERSION)
+
+    #Walk the table by primary key so each batch is a cheap indexed range read
+    queryset = queryset.only('id', 'content').order_by('id')
+    last_id = 0
+    total = 0
+
+    while True:
+      batch = list(queryset.filter(id__gt=last_id)[:chunk_size])
+      if not batch:
+        break
+
+      for post in batch:
+        post.refresh_rendered_content(force=True)
+
+      Post.objects.bulk_update(batch, Post.RENDER_FIELDS)
+      last_id = batch[-1].id
+      total += len(batch)
+      self.stdout.write(f"Rendered {total} posts...")
+
+    self.stdout.write(self.style.SUCCESS(f"Done. {total} posts re-rendered."))
@@ -0,0 +1,52 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from posts.benchmark import run_benchmarks, compare
+
+
+class Command(BaseCommand):
+  help = 'Benchmarks the main API endpoints in-process and reports latency percentiles, throughput and query counts as JSON.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requests', type=int, default=100, help='Measured requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario before measuring.')
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--scenario', action='append', dest='scenarios', help='Only run this scenario (repeatable).')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    parser.add_argument('--compare', help='A previous JSON report to compare against.')
+    parser.add_argument('--threshold', type=float, default=10.0, help='p95 growth in percent that counts as a regression.')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error when any scenario regressed.')
+
+  def handle(self, *args, **options):
+    if options['requests'] < 1:
+      raise CommandError('--requests must be at least 1.')
+
+    report = run_benchmarks(
+      requests=options['requests'], warmup=options['warmup'],
+      page_size=options['page_size'], only=options['scenarios'],
+    )
+    if not report['scenarios']:
+      raise CommandError('Nothing to benchmark, generate data first (see generate_synthetic_data).')
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as handle:
+        handle.write(output + '\n')
+      self.stdout.write(self.style.SUCCESS(f"Done. Report written to {options['output']}."))
+    else:
+      self.stdout.write(output)
+
+    if options['compare']:
+      with open(options['compare']) as handle:
+        baseline = json.load(handle)
+      rows = compare(baseline, report, threshold=options['threshold'])
+      #The comparison goes to stderr so stdout stays valid JSON
+      for row in rows:
+        line = (
+          f"{row['scenario']:<26} p95 {row['p95_before_ms']:>9.2f} -> {row['p95_after_ms']:>9.2f} ms "
+          f"({row['p95_change_pct']:+.1f}%)  queries {row['queries_before']} -> {row['queries_after']}"
+        )
+        self.stderr.write(self.style.ERROR(line) if row['regression'] else line)
+
+      regressions = [row['scenario'] for row in rows if row['regression']]
+      if regressions and options['fail_on_regression']:
+        raise CommandError(f"Regressed: {', '.join(regressions)}")
@@ -0,0 +1,59 @@
+# Generated by Django 6.0 on 2026-10-17 06:38
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    Rating = apps.get_model('posts', 'Rating')
+    PostLike = Post.likes.through
+
+    def per_post(model, aggregate):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(post_id=OuterRef('pk')).order_by().values('post_id').annotate(value=aggregate).values('value'),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+
+    Post.objects.update(
+        like_count=per_post(PostLike, Count('*')),
+        rating_count=per_post(Rating, Count('*')),
+        rating_sum=per_post(Rating, Sum('score')),
+        comment_count=per_post(Comment, Count('*')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_render_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
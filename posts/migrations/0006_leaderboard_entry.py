@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-17 06:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_timeline_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('likes', 'Likes'), ('rating', 'Rating'), ('trending', 'Trending')], max_length=10)),
+                ('window', models.CharField(choices=[('24h', 'Last 24 hours'), ('7d', 'Last 7 days'), ('all', 'All time')], max_length=3)),
+                ('score', models.FloatField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='posts.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['metric', 'window', '-score'], name='leaderboard_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('metric', 'window', 'post'), name='unique_leaderboard_entry')],
+            },
+        ),
+    ]
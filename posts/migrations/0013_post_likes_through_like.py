@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def copy_likes(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Like = apps.get_model('posts', 'Like')
+    PostLike = Post.likes.through
+
+    rows = PostLike.objects.values_list('post_id', 'user_id').order_by('pk').iterator(chunk_size=2000)
+    Like.objects.bulk_create(
+        (Like(post_id=post_id, user_id=user_id) for post_id, user_id in rows), batch_size=2000, ignore_conflicts=True
+    )
+    #Like may already hold rows of its own, so the counter is recomputed from the merged store
+    Post.objects.update(like_count=Coalesce(
+        Subquery(
+            Like.objects.filter(post_id=OuterRef('pk')).order_by().values('post_id').annotate(value=Count('*')).values('value'),
+            output_field=IntegerField(),
+        ),
+        0,
+    ))
+
+
+def restore_likes(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Like = apps.get_model('posts', 'Like')
+    PostLike = Post.likes.through
+
+    rows = Like.objects.values_list('post_id', 'user_id').order_by('pk').iterator(chunk_size=2000)
+    PostLike.objects.bulk_create(
+        (PostLike(post_id=post_id, user_id=user_id) for post_id, user_id in rows), batch_size=2000, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_pending_notification'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_likes, restore_likes),
+        #Drops the implicit posts_post_likes table; the field comes back backed by Like
+        migrations.RemoveField(
+            model_name='post',
+            name='likes',
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes',
+            field=models.ManyToManyField(blank=True, related_name='liked_posts', through='posts.Like', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
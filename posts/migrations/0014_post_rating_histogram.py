@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-17 08:10
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_histogram(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Rating = apps.get_model('posts', 'Rating')
+
+    def per_post(score):
+        return Coalesce(
+            Subquery(
+                Rating.objects.filter(post_id=OuterRef('pk'), score=score).order_by().values('post_id').annotate(value=Count('*')).values('value'),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+
+    Post.objects.update(**{f'rating_count_{score}': per_post(score) for score in range(1, 6)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_likes_through_like'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='rating_count_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_count_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_count_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_count_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_count_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_histogram, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-17 08:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DateField
+from django.db.models.functions import TruncMonth
+
+
+def backfill_archive(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ArchiveMonth = apps.get_model('posts', 'ArchiveMonth')
+
+    published = (
+        Post.objects.filter(status='PB', published_at__isnull=False)
+        .annotate(month=TruncMonth('published_at', output_field=DateField())).order_by()
+    )
+    rows = [
+        ArchiveMonth(month=row['month'], post_count=row['post_count'])
+        for row in published.values('month').annotate(post_count=Count('id'))
+    ]
+    rows += [
+        ArchiveMonth(month=row['month'], category_id=row['category_id'], post_count=row['post_count'])
+        for row in published.filter(category__isnull=False).values('month', 'category_id').annotate(post_count=Count('id'))
+    ]
+    ArchiveMonth.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_rating_histogram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archive_months', to='posts.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('month',), name='unique_archive_month_total'), models.UniqueConstraint(condition=models.Q(('category__isnull', False)), fields=('category', 'month'), name='unique_archive_month_category')],
+            },
+        ),
+        migrations.RunPython(backfill_archive, migrations.RunPython.noop),
+    ]
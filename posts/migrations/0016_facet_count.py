@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-17 08:18
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_facets(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    FacetCount = apps.get_model('posts', 'FacetCount')
+
+    published = Post.objects.filter(status='PB').order_by()
+    grouped = {
+        'category': published.filter(category__isnull=False).values_list('category_id').annotate(Count('pk')),
+        'author': published.values_list('author_id').annotate(Count('pk')),
+        'tags': Post.tags.through.objects.filter(post__status='PB').order_by().values_list('tag_id').annotate(Count('pk')),
+    }
+    FacetCount.objects.bulk_create(
+        [
+            FacetCount(facet=facet, value_id=value_id, post_count=post_count)
+            for facet, counts in grouped.items() for value_id, post_count in counts
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_archive_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('category', 'Category'), ('tags', 'Tag'), ('author', 'Author')], max_length=10)),
+                ('value_id', models.PositiveIntegerField()),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['facet', '-post_count', 'value_id'], name='facet_count_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('facet', 'value_id'), name='unique_facet_count')],
+            },
+        ),
+        migrations.RunPython(backfill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_facet_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationdelivery',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='notificationdelivery',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-17 08:54
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, F
+from django.db.models.functions import TruncMonth
+
+
+def backfill_published_at(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ArchiveMonth = apps.get_model('posts', 'ArchiveMonth')
+
+    #Published before published_at was set on publish: date them by creation
+    if not Post.objects.filter(status='PB', published_at__isnull=True).update(published_at=F('created_at')):
+        return
+
+    #The archive skipped these posts, so it is recomputed as in 0015
+    published = (
+        Post.objects.filter(status='PB')
+        .annotate(month=TruncMonth('published_at', output_field=DateField())).order_by()
+    )
+    rows = [
+        ArchiveMonth(month=row['month'], post_count=row['post_count'])
+        for row in published.values('month').annotate(post_count=Count('id'))
+    ]
+    rows += [
+        ArchiveMonth(month=row['month'], category_id=row['category_id'], post_count=row['post_count'])
+        for row in published.filter(category__isnull=False).values('month', 'category_id').annotate(post_count=Count('id'))
+    ]
+    ArchiveMonth.objects.all().delete()
+    ArchiveMonth.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_pending_notification_failure'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_published_at, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='post',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('status', 'PB'), _negated=True), ('published_at__isnull', False), _connector='OR'), name='post_published_has_date'),
+        ),
+    ]
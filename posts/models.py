@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from django.conf import settings
+from .rendering import RENDER_VERSION, content_hash, render_markdown
 
 
 # Create your models here.
@@ -18,6 +20,24 @@ class Tag(models.Model):
   def __str__(self):
     return self.name
 
+def bump_version(instance, save_kwargs):
+  #Existing rows get the next version, also when saved with update_fields. Bumped
+  #in the UPDATE so a stale instance can't set it back; see reload_version
+  if instance._state.adding:
+    return
+  instance.version = models.F('version') + 1
+  update_fields = save_kwargs.get('update_fields')
+  if update_fields is not None:
+    save_kwargs['update_fields'] = set(update_fields) | set(instance.VERSION_FIELDS)
+
+
+def reload_version(instance):
+  #Django 6.0 reads the bumped version back through RETURNING; older versions
+  #and backends without it leave the F() expression on the instance
+  if hasattr(instance.version, 'resolve_expression'):
+    instance.refresh_from_db(fields=['version'])
+
+
 class Post(models.Model):
   id = models.AutoField(primary_key=True)
 
@@ -36,26 +56,153 @@ class Post(models.Model):
   author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
   category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
   tags = models.ManyToManyField(Tag, blank=True)
-  likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
+  likes = models.ManyToManyField(User, through='Like', related_name='liked_posts', blank=True)
 
   #Date Fields
   created_at = models.DateTimeField(auto_now_add=True)
 
+  #Validators for conditional requests: bumped by every save and counter update
+  updated_at = models.DateTimeField(auto_now=True)
+  version = models.PositiveIntegerField(default=1, editable=False)
+  VERSION_FIELDS = ['updated_at', 'version']
+
+  #Render cache: sanitized HTML of 'content', keyed by content hash + renderer version
+  content_html = models.TextField(blank=True, editable=False)
+  content_hash = models.CharField(max_length=64, blank=True, editable=False)
+  render_version = models.CharField(max_length=16, blank=True, editable=False)
+
+  RENDER_FIELDS = ['content_html', 'content_hash', 'render_version']
+
+  #Denormalized engagement counters, kept current with F() updates (see posts/counters.py)
+  like_count = models.PositiveIntegerField(default=0, editable=False)
+  rating_count = models.PositiveIntegerField(default=0, editable=False)
+  rating_sum = models.PositiveIntegerField(default=0, editable=False)
+  comment_count = models.PositiveIntegerField(default=0, editable=False)
+  #Ratings per score, rating_count_1 ... rating_count_5
+  rating_count_1 = models.PositiveIntegerField(default=0, editable=False)
+  rating_count_2 = models.PositiveIntegerField(default=0, editable=False)
+  rating_count_3 = models.PositiveIntegerField(default=0, editable=False)
+  rating_count_4 = models.PositiveIntegerField(default=0, editable=False)
+  rating_count_5 = models.PositiveIntegerField(default=0, editable=False)
+
+  RATING_SCORES = range(1, 6)
+
+  COUNTER_FIELDS = ['like_count', 'rating_count', 'rating_sum', 'comment_count'] + [f'rating_count_{score}' for score in RATING_SCORES]
+
+  #Values as loaded from the database, so signals can tell what a save changed
+  TRACKED_FIELDS = ('status', 'category_id', 'published_at')
+  _loaded_values = None
+
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super().from_db(db, field_names, values)
+    instance._loaded_values = {name: getattr(instance, name) for name in cls.TRACKED_FIELDS if name in field_names}
+    return instance
+
+  def loaded_value(self, name):
+    """
+    The value 'name' had when this instance was loaded (None for new posts).
+    Fields that were deferred on load report their current value.
+    """
+    if self._loaded_values is None:
+      return None
+    return self._loaded_values.get(name, getattr(self, name))
+
   def save(self, *args, **kwargs):
     #Automatically set published_at when status changes to Published
     if self.status == self.Status.PUBLISHED and not self.published_at:
       self.published_at = timezone.now()
 
-    super().save(*args, **kwargs)
+    #A full save of an existing row leaves the counters alone: they only move
+    #through F() updates, and this instance's copies may already be stale
+    if not self._state.adding and kwargs.get('update_fields') is None:
+      kwargs['update_fields'] = [
+        field.name for field in self._meta.concrete_fields
+        if not field.primary_key and field.name not in self.COUNTER_FIELDS
+      ]
+
+    #Re-render only when the content or the renderer actually changed
+    update_fields = kwargs.get('update_fields')
+    if self.refresh_rendered_content() and update_fields is not None:
+      kwargs['update_fields'] = set(update_fields) | set(self.RENDER_FIELDS)
+    bump_version(self, kwargs)
+
+    #One transaction with the post_save receivers, so the outbox events they
+    #record (posts/outbox.py) commit or roll back together with the post
+    with transaction.atomic():
+      super().save(*args, **kwargs)
+    reload_version(self)
+    self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+
+  @property
+  def has_current_render(self):
+    return self.render_version == RENDER_VERSION
+
+  def refresh_rendered_content(self, force=False):
+    """
+    Re-renders 'content' into 'content_html' if it is stale. Returns True when it did.
+    """
+    digest = content_hash(self.content)
+    if not force and self.has_current_render and self.content_hash == digest:
+      return False
+
+    self.content_html = render_markdown(self.content)
+    self.content_hash = digest
+    self.render_version = RENDER_VERSION
+    return True
 
   def __str__(self):
     return self.title
   
   def total_likes(self):
-    return self.likes.count()
+    return self.like_count
+
+  @property
+  def avg_rating(self):
+    if not self.rating_count:
+      return None
+    return self.rating_sum / self.rating_count
+
+  @staticmethod
+  def bayesian_average(rating_sum, rating_count):
+    #Average pulled toward a prior mean, so one 5-star vote doesn't outrank fifty 4.8s
+    weight = settings.RATING_PRIOR_WEIGHT
+    return (weight * settings.RATING_PRIOR_MEAN + rating_sum) / (weight + rating_count)
+
+  @property
+  def bayesian_rating(self):
+    return self.bayesian_average(self.rating_sum, self.rating_count)
+
+  @property
+  def rating_histogram(self):
+    return {str(score): getattr(self, f'rating_count_{score}') for score in self.RATING_SCORES}
 
   class Meta:
     ordering = ['-created_at']
+    #Matched to the list queries: equality columns first, then the keyset ordering
+    indexes = [
+      #Explore feed, top/archive listings: status=PB ORDER BY published_at, id
+      models.Index(fields=['status', '-published_at', '-id'], name='post_status_published_idx'),
+      #Post list for anonymous readers: status=PB ORDER BY created_at, id
+      models.Index(fields=['status', '-created_at', '-id'], name='post_status_created_idx'),
+      #Drafts and an author's own listing: author=?, status=? ORDER BY created_at
+      models.Index(fields=['author', 'status', '-created_at'], name='post_author_status_created_idx'),
+      #Published-only partial indexes for the per-category and per-author feeds
+      models.Index(
+        fields=['category', '-published_at', '-id'], name='post_category_published_idx',
+        condition=models.Q(status='PB')
+      ),
+      models.Index(
+        fields=['author', '-published_at', '-id'], name='post_author_published_idx',
+        condition=models.Q(status='PB')
+      ),
+    ]
+    constraints = [
+      #Keyset cursors on the published listings need a date on every published row
+      models.CheckConstraint(
+        condition=~models.Q(status='PB') | models.Q(published_at__isnull=False), name='post_published_has_date'
+      ),
+    ]
 
 
 class Comment(models.Model):
@@ -63,16 +210,31 @@ class Comment(models.Model):
   author = models.ForeignKey(User, on_delete=models.CASCADE)
   content = models.TextField()
   created_at = models.DateTimeField(auto_now_add=True)
+  updated_at = models.DateTimeField(auto_now=True)
+  version = models.PositiveIntegerField(default=1, editable=False)
+  VERSION_FIELDS = ['updated_at', 'version']
+
+  def save(self, *args, **kwargs):
+    bump_version(self, kwargs)
+    super().save(*args, **kwargs)
+    reload_version(self)
 
   class Meta:
     ordering = ['-created_at'] #Newest comments first
+    indexes = [
+      models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_idx')
+    ]
 
   def __str__(self):
     return f"Comment by {self.author.username} on {self.post.title}"
   
 
 class Like(models.Model):
-  user = models.ForeignKey(User, on_delete=models.CASCADE)
+  """
+  The store behind Post.likes. Lookups by viewer use unique_like, which leads
+  with the user, so the user column needs no index of its own.
+  """
+  user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
   post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_likes')
 
   class Meta:
@@ -85,6 +247,22 @@ class Rating(models.Model):
   post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='ratings')
   score = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
 
+  #The score as stored, so the post's rating aggregates move by the actual change
+  _loaded_score = None
+
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super().from_db(db, field_names, values)
+    if 'score' in field_names:
+      instance._loaded_score = instance.score
+    return instance
+
+  def save(self, *args, **kwargs):
+    #One transaction with the post_save receiver that applies the rating delta
+    with transaction.atomic():
+      super().save(*args, **kwargs)
+    self._loaded_score = self.score
+
   class Meta:
     constraints = [models.UniqueConstraint(fields=['user', 'post'], name='unique_rating')]
 
@@ -98,4 +276,160 @@ class CategorySubscription(models.Model):
     #Prevents a user from subscribing to the same category twice
     constraints = [
       models.UniqueConstraint(fields=['user', 'category'], name='unique_category_sub')
-    ]
\ No newline at end of file
+    ]
+
+
+class NotificationDelivery(models.Model):
+  """
+  One row per (post, recipient) of the new-post email, so a retried or
+  re-enqueued batch never mails anyone twice (see posts/notifications.py).
+  """
+  post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='notification_deliveries')
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_deliveries')
+  created_at = models.DateTimeField(auto_now_add=True)
+  #Null until the message was handed to the mail server
+  sent_at = models.DateTimeField(null=True, blank=True)
+  #Set when the server refused the recipient; such deliveries are never retried
+  failed_at = models.DateTimeField(null=True, blank=True)
+  error = models.TextField(blank=True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['post', 'user'], name='unique_notification_delivery')
+    ]
+
+
+class PendingNotification(models.Model):
+  """
+  A published post waiting for its recipient's next digest email. Digest users
+  get one row per post here instead of one email each.
+  """
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pending_notifications')
+  post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+  created_at = models.DateTimeField(auto_now_add=True)
+  #Set when the server refused the user's digest; the row stays for inspection and is never retried
+  failed_at = models.DateTimeField(null=True, blank=True)
+  error = models.TextField(blank=True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['user', 'post'], name='unique_pending_notification')
+    ]
+
+
+class OutboxEvent(models.Model):
+  """
+  A side effect (an email, a fan-out task) recorded in the same transaction as
+  the change that caused it, and carried out later by the relay_outbox command
+  (see posts/outbox.py).
+  """
+  topic = models.CharField(max_length=100)
+  payload = models.JSONField(default=dict)
+  created_at = models.DateTimeField(auto_now_add=True)
+  #Not handed to a relay before this time (pushed back after each failure)
+  available_at = models.DateTimeField(default=timezone.now)
+  #Lease: the relay that claimed the event owns it until then, after which another may
+  claimed_by = models.CharField(max_length=100, blank=True)
+  claimed_until = models.DateTimeField(null=True, blank=True)
+  attempts = models.PositiveIntegerField(default=0)
+  last_error = models.TextField(blank=True)
+  processed_at = models.DateTimeField(null=True, blank=True)
+  #Set when the event ran out of attempts; it stays for inspection and is never retried
+  failed_at = models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    indexes = [
+      #The relay's claim query: pending events in order of availability
+      models.Index(fields=['available_at', 'id'], condition=models.Q(processed_at__isnull=True, failed_at__isnull=True), name='outbox_pending_idx'),
+    ]
+
+  def __str__(self):
+    return f'{self.topic} #{self.pk}'
+
+
+class TimelineEntry(models.Model):
+  """
+  A published post materialized into a reader's feed (fan-out on write).
+  """
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+  post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+  #Copied from the post so a feed page is a range read on one index
+  published_at = models.DateTimeField()
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry')
+    ]
+    indexes = [
+      models.Index(fields=['user', '-published_at', '-post'], name='timeline_user_recent_idx')
+    ]
+
+
+class LeaderboardEntry(models.Model):
+  """
+  One row of a precomputed top-N board, e.g. the 24h trending board.
+  """
+  class Metric(models.TextChoices):
+    LIKES = 'likes', 'Likes'
+    RATING = 'rating', 'Rating'
+    TRENDING = 'trending', 'Trending'
+
+  class Window(models.TextChoices):
+    DAY = '24h', 'Last 24 hours'
+    WEEK = '7d', 'Last 7 days'
+    ALL = 'all', 'All time'
+
+  metric = models.CharField(max_length=10, choices=Metric.choices)
+  window = models.CharField(max_length=3, choices=Window.choices)
+  post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='leaderboard_entries')
+  score = models.FloatField()
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['metric', 'window', 'post'], name='unique_leaderboard_entry')
+    ]
+    indexes = [
+      models.Index(fields=['metric', 'window', '-score'], name='leaderboard_rank_idx')
+    ]
+
+
+class ArchiveMonth(models.Model):
+  """
+  Published posts per month, precomputed for the archive sidebar. A row with no
+  category is the month's total; the others count a single category. Kept
+  current by posts/archive.py as posts are published, moved or deleted.
+  """
+  month = models.DateField()
+  category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='archive_months')
+  post_count = models.PositiveIntegerField(default=0)
+
+  class Meta:
+    constraints = [
+      #NULLs never conflict in a plain unique constraint, so the totals get their own
+      models.UniqueConstraint(fields=['month'], condition=models.Q(category__isnull=True), name='unique_archive_month_total'),
+      models.UniqueConstraint(fields=['category', 'month'], condition=models.Q(category__isnull=False), name='unique_archive_month_category'),
+    ]
+
+
+class FacetCount(models.Model):
+  """
+  Published posts per category, tag and author, precomputed so unfiltered
+  facet counts are a lookup. Kept current by posts/facets.py.
+  """
+  class Facet(models.TextChoices):
+    CATEGORY = 'category', 'Category'
+    TAG = 'tags', 'Tag'
+    AUTHOR = 'author', 'Author'
+
+  facet = models.CharField(max_length=10, choices=Facet.choices)
+  #Primary key of the category, tag or user
+  value_id = models.PositiveIntegerField()
+  post_count = models.PositiveIntegerField(default=0)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['facet', 'value_id'], name='unique_facet_count')
+    ]
+    indexes = [
+      models.Index(fields=['facet', '-post_count', 'value_id'], name='facet_count_top_idx')
+    ]
@@ -0,0 +1,191 @@
+from smtplib import SMTPRecipientsRefused
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from users.models import Follow, Profile
+from .models import Post, CategorySubscription, NotificationDelivery, PendingNotification
+
+
+def recipients(post):
+  """
+  Users to tell about a newly published post: followers of its author and
+  subscribers of its category, deduplicated by the database (one row per user
+  whatever the number of matching follows/subscriptions), minus the author,
+  users without an email and users already notified or refused by the server.
+  """
+  interested = Q(Exists(Follow.objects.filter(follower=OuterRef('pk'), followed_user_id=post.author_id)))
+  if post.category_id is not None:
+    interested |= Q(Exists(CategorySubscription.objects.filter(user=OuterRef('pk'), category_id=post.category_id)))
+  already_sent = NotificationDelivery.objects.filter(
+    Q(sent_at__isnull=False) | Q(failed_at__isnull=False), post=post, user=OuterRef('pk')
+  )
+
+  return (
+    User.objects.filter(interested, is_active=True)
+    .exclude(pk=post.author_id)
+    .exclude(email='')
+    .exclude(Exists(already_sent))
+    .order_by('pk')
+  )
+
+
+def recipient_batches(post, size):
+  #Streams the ids, so a post with a million subscribers never sits in memory at once
+  batch = []
+  for user_id in recipients(post).values_list('pk', flat=True).iterator(chunk_size=size):
+    batch.append(user_id)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def build_message(post, user, connection):
+  category_name = post.category.name if post.category else 'General'
+  #One message per recipient, so no subscriber sees another's address
+  return EmailMessage(
+    subject=f'New Post: {post.title}',
+    body=f'{post.author.username} just published a new post in {category_name}!\n\nRead it here: http://myblog.com/posts/{post.id}/',
+    from_email=settings.DEFAULT_FROM_EMAIL,
+    to=[user.email],
+    connection=connection,
+  )
+
+
+def send_batch(post_id, user_ids):
+  """
+  Mails one batch over a single SMTP connection, after moving the recipients
+  who prefer digests to their pending queue. The recipients whose message
+  went out are marked sent even when a later one fails, so a retried batch only
+  sends the rest. A recipient the server refuses is marked failed and skipped;
+  only connection-level errors fail the batch. Returns the number of messages sent.
+  """
+  post = Post.objects.select_related('author', 'category').filter(pk=post_id, status=Post.Status.PUBLISHED).first()
+  #Unpublished or deleted before the batch ran
+  if post is None:
+    return 0
+
+  #Digest users only get the post queued for their next digest
+  digest_ids = set(
+    Profile.objects.filter(user_id__in=user_ids).exclude(notification_frequency=Profile.NotificationFrequency.IMMEDIATE)
+    .values_list('user_id', flat=True)
+  )
+  if digest_ids:
+    PendingNotification.objects.bulk_create(
+      [PendingNotification(post_id=post_id, user_id=user_id) for user_id in digest_ids], ignore_conflicts=True
+    )
+    user_ids = [user_id for user_id in user_ids if user_id not in digest_ids]
+
+  NotificationDelivery.objects.bulk_create(
+    [NotificationDelivery(post_id=post_id, user_id=user_id) for user_id in user_ids], ignore_conflicts=True
+  )
+  pending = User.objects.filter(
+    pk__in=NotificationDelivery.objects.filter(
+      post_id=post_id, user_id__in=user_ids, sent_at__isnull=True, failed_at__isnull=True
+    ).values('user_id')
+  ).exclude(email='').order_by('pk')
+
+  sent, refused = [], {}
+  try:
+    with get_connection() as connection:
+      for user in pending:
+        try:
+          connection.send_messages([build_message(post, user, connection)])
+        except SMTPRecipientsRefused as error:
+          #A bad address, retrying the batch would stop at it again
+          refused[user.pk] = str(error.recipients)
+          continue
+        sent.append(user.pk)
+  finally:
+    #Also when a send failed half way, so the retry skips everyone already mailed
+    now = timezone.now()
+    if sent:
+      NotificationDelivery.objects.filter(post_id=post_id, user_id__in=sent).update(sent_at=now)
+    for user_id, error in refused.items():
+      NotificationDelivery.objects.filter(post_id=post_id, user_id=user_id).update(failed_at=now, error=error)
+  return len(sent)
+
+
+def digest_frequencies(frequency):
+  #The hourly run also picks up leftovers of users who switched back to immediate
+  if frequency == Profile.NotificationFrequency.HOURLY:
+    return [Profile.NotificationFrequency.HOURLY, Profile.NotificationFrequency.IMMEDIATE]
+  return [frequency]
+
+
+def digest_users(frequency, size):
+  #Streams the ids of users with something pending, 'size' at a time
+  batch = []
+  user_ids = (
+    PendingNotification.objects.filter(
+      user__profile__notification_frequency__in=digest_frequencies(frequency), failed_at__isnull=True
+    ).order_by('user_id').values_list('user_id', flat=True).distinct()
+  )
+  for user_id in user_ids.iterator(chunk_size=size):
+    batch.append(user_id)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def build_digest(user, posts, connection):
+  lines = [
+    f"- {post.title} by {post.author.username} ({post.category.name if post.category else 'General'}): http://myblog.com/posts/{post.id}/"
+    for post in posts
+  ]
+  subject = f'New Post: {posts[0].title}' if len(posts) == 1 else f'{len(posts)} new posts from authors you follow'
+  return EmailMessage(
+    subject=subject,
+    body='New since your last digest:\n\n' + '\n'.join(lines),
+    from_email=settings.DEFAULT_FROM_EMAIL,
+    to=[user.email],
+    connection=connection,
+  )
+
+
+def send_digest_batch(user_ids):
+  """
+  One email per user covering all their pending posts, read with two queries
+  for the whole batch. A user's rows are deleted once their digest went out,
+  so a failure part way only leaves the rest for the next run. A user whose
+  address the server refuses has their rows marked failed, and the batch
+  moves on to the next user. Returns the number of digests sent.
+  """
+  users = {user.pk: user for user in User.objects.filter(pk__in=user_ids)}
+  pending = {}
+  stale = []
+  rows = (
+    PendingNotification.objects.filter(user_id__in=user_ids, failed_at__isnull=True)
+    .select_related('post__author', 'post__category').order_by('user_id', 'post__published_at', 'post_id')
+  )
+  for row in rows:
+    #Unpublished since it was queued, or the user can't be mailed
+    if row.post.status != Post.Status.PUBLISHED or not users[row.user_id].email:
+      stale.append(row.pk)
+      continue
+    pending.setdefault(row.user_id, []).append(row)
+
+  sent, refused, digests = [], {}, 0
+  try:
+    with get_connection() as connection:
+      for user_id, user_rows in pending.items():
+        try:
+          connection.send_messages([build_digest(users[user_id], [row.post for row in user_rows], connection)])
+        except SMTPRecipientsRefused as error:
+          refused[user_id] = str(error.recipients)
+          continue
+        sent.extend(row.pk for row in user_rows)
+        digests += 1
+  finally:
+    if sent or stale:
+      PendingNotification.objects.filter(pk__in=sent + stale).delete()
+    for user_id, error in refused.items():
+      PendingNotification.objects.filter(pk__in=[row.pk for row in pending[user_id]]).update(
+        failed_at=timezone.now(), error=error
+      )
+  return digests
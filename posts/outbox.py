@@ -0,0 +1,128 @@
+import os
+import socket
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Post, OutboxEvent
+from .tasks import send_rating_notification_email, notify_subscribers, share_post_via_email
+
+
+#topic -> callable(**payload)
+HANDLERS = {}
+
+
+def handler(topic):
+  def register(function):
+    HANDLERS[topic] = function
+    return function
+  return register
+
+
+def publish(topic, **payload):
+  """
+  Records a side effect to run after the current transaction commits. The row is
+  written in that transaction, so the effect happens if and only if the change
+  that caused it does, and survives a crash before it runs.
+  """
+  return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def worker_id():
+  return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def claim(worker, batch_size, lease_seconds):
+  """
+  Leases up to 'batch_size' due events to 'worker'. An event whose lease ran
+  out (its relay died mid-batch) is due again. The UPDATE only takes rows that
+  are still unleased, so two relays can't both claim the same event.
+  """
+  now = timezone.now()
+  free = Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+  due = OutboxEvent.objects.filter(free, processed_at__isnull=True, failed_at__isnull=True, available_at__lte=now)
+
+  with transaction.atomic():
+    candidates = due.order_by('available_at', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+      candidates = candidates.select_for_update(skip_locked=True)
+    ids = list(candidates.values_list('id', flat=True)[:batch_size])
+    due.filter(id__in=ids).update(claimed_by=worker, claimed_until=now + timedelta(seconds=lease_seconds))
+
+  return list(OutboxEvent.objects.filter(id__in=ids, claimed_by=worker).order_by('id'))
+
+
+def backoff(attempts):
+  #Exponential, capped: 2s, 4s, 8s... up to OUTBOX_MAX_BACKOFF
+  return min(2 ** attempts, settings.OUTBOX_MAX_BACKOFF)
+
+
+def dispatch(event, worker):
+  """
+  Runs one claimed event. Returns True when it succeeded. Finishing is
+  conditional on still holding the lease, so a relay that outlived its lease
+  can't overwrite the outcome of the one that took the event over.
+  """
+  mine = OutboxEvent.objects.filter(pk=event.pk, claimed_by=worker, processed_at__isnull=True)
+  try:
+    HANDLERS[event.topic](**event.payload)
+  except Exception as exc:
+    attempts = event.attempts + 1
+    now = timezone.now()
+    changes = {'attempts': attempts, 'last_error': f'{type(exc).__name__}: {exc}', 'claimed_by': '', 'claimed_until': None}
+    if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+      changes['failed_at'] = now
+    else:
+      changes['available_at'] = now + timedelta(seconds=backoff(attempts))
+    mine.update(**changes)
+    return False
+
+  mine.update(processed_at=timezone.now(), claimed_until=None)
+  return True
+
+
+def relay(worker=None, batch_size=100, lease_seconds=60, max_batches=None):
+  """
+  Drains due events batch by batch until none are left (or 'max_batches').
+  Returns {'processed': n, 'failed': n}.
+  """
+  worker = worker or worker_id()
+  totals = {'processed': 0, 'failed': 0}
+  batches = 0
+  while max_batches is None or batches < max_batches:
+    events = claim(worker, batch_size, lease_seconds)
+    if not events:
+      break
+    batches += 1
+    for event in events:
+      #Past the lease another relay may already own the rest of the batch
+      if timezone.now() >= event.claimed_until:
+        break
+      totals['processed' if dispatch(event, worker) else 'failed'] += 1
+  return totals
+
+
+def purge(older_than):
+  #Processed events are only kept for inspection
+  return OutboxEvent.objects.filter(processed_at__lt=timezone.now() - older_than).delete()[0]
+
+
+#Handlers: hand the work to Celery. A broker outage makes the relay retry the
+#event later instead of failing the request that caused it
+@handler('rating.five_star')
+def five_star_rating(post_id):
+  post = Post.objects.select_related('author').filter(pk=post_id).first()
+  if post is not None and post.author.email:
+    send_rating_notification_email.delay(post.author.email, post.author.username, post.title)  # type: ignore
+
+
+@handler('post.published')
+def post_published(post_id):
+  notify_subscribers.delay(post_id)  # type: ignore
+
+
+@handler('post.shared')
+def post_shared(post_title, post_url, recipient_email, sender_name):
+  share_post_via_email.delay(post_title, post_url, recipient_email, sender_name)  # type: ignore
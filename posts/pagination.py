@@ -0,0 +1,158 @@
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class PageSizePagination(PageNumberPagination):
+  #Default pagination; takes the same page_size parameter as the keyset listings
+  page_size_query_param = 'page_size'
+  max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+  """
+  Cursor pagination over (ordering_field, tiebreak_field), newest first.
+
+  Each page is a range read that starts right after the last row the client saw,
+  so page 50 costs the same as page 1, no COUNT(*) is issued, and rows inserted
+  while a client scrolls can't shift items between pages.
+  """
+  ordering_field = 'published_at'
+  #Unique field that orders rows sharing the same ordering_field value
+  tiebreak_field = 'id'
+  page_size = api_settings.PAGE_SIZE
+  page_size_query_param = 'page_size'
+  max_page_size = 100
+  cursor_query_param = 'cursor'
+  invalid_cursor_message = 'Invalid cursor'
+  #Requests with these parameters are ordered by something other than the keyset
+  #(search relevance, ?ordering=), so they fall back to page numbers
+  offset_fallback_params = (api_settings.SEARCH_PARAM, api_settings.ORDERING_PARAM)
+  fallback_class = PageSizePagination
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.fallback = None
+    if any(request.query_params.get(param) for param in self.offset_fallback_params):
+      self.fallback = self.fallback_class()
+      return self.fallback.paginate_queryset(queryset, request, view)
+
+    self.request = request
+    self.page_size = self.get_page_size(request)
+    self.base_url = request.build_absolute_uri()
+    position, self.reverse = self.decode_cursor(request)
+    field, tiebreak = self.ordering_field, self.tiebreak_field
+
+    if position is not None:
+      value, pk = position
+      if self.reverse:
+        queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, f'{tiebreak}__gt': pk}))
+      else:
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, f'{tiebreak}__lt': pk}))
+
+    ordering = (field, tiebreak) if self.reverse else (f'-{field}', f'-{tiebreak}')
+    #Fetch one extra row to know whether there is another page in this direction
+    results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+    has_more = len(results) > self.page_size
+    self.page = results[:self.page_size]
+
+    if self.reverse:
+      self.page.reverse()
+      self.has_next, self.has_previous = position is not None, has_more
+    else:
+      self.has_next, self.has_previous = has_more, position is not None
+
+    return self.page
+
+  def get_page_size(self, request):
+    try:
+      size = int(request.query_params[self.page_size_query_param])
+    except (KeyError, ValueError):
+      return self.page_size
+    return max(1, min(size, self.max_page_size))
+
+  def get_next_link(self):
+    if not self.has_next or not self.page:
+      return None
+    return self.encode_cursor(self.page[-1], reverse=False)
+
+  def get_previous_link(self):
+    if not self.has_previous or not self.page:
+      return None
+    return self.encode_cursor(self.page[0], reverse=True)
+
+  def encode_cursor(self, instance, reverse):
+    value = getattr(instance, self.ordering_field)
+    pk = getattr(instance, self.tiebreak_field)
+    raw = '|'.join([value.isoformat() if value is not None else '', str(pk), '1' if reverse else '0'])
+    cursor = base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+    return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+  def decode_cursor(self, request):
+    encoded = request.query_params.get(self.cursor_query_param)
+    if not encoded:
+      return None, False
+
+    try:
+      raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8')
+      value, pk, reverse = raw.split('|')
+      position = parse_datetime(value)
+      if position is None:
+        raise ValueError(value)
+      return (position, int(pk)), reverse == '1'
+    except (TypeError, ValueError, UnicodeError):
+      raise NotFound(self.invalid_cursor_message)
+
+  def get_paginated_response(self, data):
+    if self.fallback is not None:
+      return self.fallback.get_paginated_response(data)
+
+    return Response({
+      'next': self.get_next_link(),
+      'previous': self.get_previous_link(),
+      'results': data,
+    })
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'required': ['results'],
+      'properties': {
+        'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'results': schema,
+      },
+    }
+
+  def get_schema_operation_parameters(self, view):
+    return [
+      {
+        'name': self.cursor_query_param,
+        'required': False,
+        'in': 'query',
+        'description': 'The pagination cursor value.',
+        'schema': {'type': 'string'},
+      },
+      {
+        'name': self.page_size_query_param,
+        'required': False,
+        'in': 'query',
+        'description': 'Number of results to return per page.',
+        'schema': {'type': 'integer'},
+      },
+    ]
+
+
+class CreatedKeysetPagination(KeysetPagination):
+  #For listings that include drafts, which have no published_at yet
+  ordering_field = 'created_at'
+
+
+class FeedKeysetPagination(KeysetPagination):
+  #Pages on the timeline's own columns so the personalized feed is a range read on its index
+  ordering_field = 'feed_published_at'
+  tiebreak_field = 'feed_post_id'
@@ -0,0 +1,42 @@
+import hashlib
+import markdown
+import bleach
+from blogging_platform_api.timing import timed
+
+
+#Markdown extensions used to render post content
+#extensions=['extra'] adds support for tables, footnotes, etc.
+MARKDOWN_EXTENSIONS = ['extra', 'codehilite']
+
+#Define which HTML tags are allowed
+ALLOWED_TAGS = [
+  'p', 'b', 'i', 'u', 'em', 'string', 'a', 'h1', 'h2', 'h3', 'li', 'ul', 'ol', 'code', 'pre'
+]
+ALLOWED_ATTRIBUTES = {'a': ['href', 'title']}
+
+#Bump this when the rendering pipeline changes in a way the settings above don't capture
+RENDERER_REVISION = 1
+
+
+def _fingerprint(*parts):
+  return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+#Changes whenever the extensions, the allowlist or the revision change,
+#so every stored render made with an older pipeline is detected as stale
+RENDER_VERSION = _fingerprint(
+  RENDERER_REVISION, MARKDOWN_EXTENSIONS, ALLOWED_TAGS, sorted(ALLOWED_ATTRIBUTES.items())
+)[:16]
+
+
+def content_hash(content):
+  return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def render_markdown(content):
+  """
+  Converts raw Markdown into sanitized HTML.
+  """
+  with timed('markdown'):
+    html = markdown.markdown(content, extensions=MARKDOWN_EXTENSIONS)
+    return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES)
@@ -0,0 +1,175 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+
+class BaseSearchBackend:
+  """
+  Keeps a full-text index of posts (title, content, author username, tag names)
+  and answers ranked searches against it.
+
+  search() returns the given queryset narrowed to the matches; ranked backends
+  also annotate 'search_rank' (higher is better) and order by it.
+  """
+  def index_post(self, post_id):
+    pass
+
+  def remove_post(self, post_id):
+    pass
+
+  def rebuild(self, chunk_size=1000):
+    pass
+
+  def search(self, queryset, terms):
+    raise NotImplementedError
+
+
+class BasicSearchBackend(BaseSearchBackend):
+  """
+  Fallback for databases without a native index here (e.g. MySQL): icontains scans,
+  unranked, in the queryset's own order.
+  """
+  def search(self, queryset, terms):
+    from .models import Post
+
+    for term in terms:
+      matches = Post.objects.filter(
+        Q(title__icontains=term) | Q(content__icontains=term) |
+        Q(author__username__icontains=term) | Q(tags__name__icontains=term)
+      ).values('pk')
+      #Subquery on pk, so the tags join can't duplicate rows
+      queryset = queryset.filter(pk__in=matches)
+    return queryset
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+  """
+  SQLite FTS5 virtual table keyed by the post id (rowid), ranked with bm25.
+  """
+  table = 'posts_post_fts'
+
+  #Builds index rows straight from the posts, so a rebuild is set-based
+  SOURCE_SQL = """
+    SELECT p.id, p.title, p.content, u.username,
+      COALESCE((SELECT group_concat(t.name, ' ') FROM posts_post_tags pt
+        JOIN posts_tag t ON t.id = pt.tag_id WHERE pt.post_id = p.id), '')
+    FROM posts_post p JOIN auth_user u ON u.id = p.author_id
+  """
+
+  def index_post(self, post_id):
+    with connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [post_id])
+      cursor.execute(
+        f'INSERT INTO {self.table} (rowid, title, content, author, tags) {self.SOURCE_SQL} WHERE p.id = %s', [post_id]
+      )
+
+  def remove_post(self, post_id):
+    with connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [post_id])
+
+  def rebuild(self, chunk_size=1000):
+    with connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {self.table}')
+      cursor.execute('SELECT COALESCE(MAX(id), 0) FROM posts_post')
+      max_id = cursor.fetchone()[0]
+      for start in range(0, max_id, chunk_size):
+        cursor.execute(
+          f'INSERT INTO {self.table} (rowid, title, content, author, tags) {self.SOURCE_SQL} WHERE p.id > %s AND p.id <= %s',
+          [start, start + chunk_size]
+        )
+
+  def match_expression(self, terms):
+    #Every term is quoted so user input can't inject FTS5 syntax; '*' keeps prefix matches
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+  def search(self, queryset, terms):
+    match = self.match_expression(terms)
+    matches = RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match])
+    #bm25 is lower-is-better, negate it so every backend ranks descending
+    rank = RawSQL(
+      f'SELECT -bm25({self.table}, 10.0, 1.0, 5.0, 5.0) FROM {self.table} '
+      f'WHERE {self.table} MATCH %s AND rowid = "posts_post"."id"', [match]
+    )
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by('-search_rank', '-id')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+  """
+  Weighted tsvector document per post in a side table with a GIN index.
+  """
+  table = 'posts_post_search'
+
+  SOURCE_SQL = """
+    SELECT p.id,
+      setweight(to_tsvector('english', p.title), 'A') ||
+      setweight(to_tsvector('english', u.username), 'B') ||
+      setweight(to_tsvector('english', COALESCE((SELECT string_agg(t.name, ' ') FROM posts_post_tags pt
+        JOIN posts_tag t ON t.id = pt.tag_id WHERE pt.post_id = p.id), '')), 'B') ||
+      setweight(to_tsvector('english', p.content), 'C')
+    FROM posts_post p JOIN auth_user u ON u.id = p.author_id
+  """
+
+  UPSERT = 'ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document'
+
+  def index_post(self, post_id):
+    with connection.cursor() as cursor:
+      cursor.execute(f'INSERT INTO {self.table} (post_id, document) {self.SOURCE_SQL} WHERE p.id = %s {self.UPSERT}', [post_id])
+
+  def remove_post(self, post_id):
+    #The side table cascades on post delete; this covers explicit removals
+    with connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {self.table} WHERE post_id = %s', [post_id])
+
+  def rebuild(self, chunk_size=1000):
+    with connection.cursor() as cursor:
+      cursor.execute(f'TRUNCATE {self.table}')
+      cursor.execute('SELECT COALESCE(MAX(id), 0) FROM posts_post')
+      max_id = cursor.fetchone()[0]
+      for start in range(0, max_id, chunk_size):
+        cursor.execute(
+          f'INSERT INTO {self.table} (post_id, document) {self.SOURCE_SQL} WHERE p.id > %s AND p.id <= %s {self.UPSERT}',
+          [start, start + chunk_size]
+        )
+
+  def search(self, queryset, terms):
+    query = ' '.join(terms)
+    matches = RawSQL(
+      f"SELECT post_id FROM {self.table} WHERE document @@ websearch_to_tsquery('english', %s)", [query]
+    )
+    rank = RawSQL(
+      f"SELECT ts_rank(document, websearch_to_tsquery('english', %s)) FROM {self.table} "
+      f'WHERE post_id = "posts_post"."id"', [query]
+    )
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by('-search_rank', '-id')
+
+
+BACKENDS = {
+  'sqlite': SQLiteSearchBackend,
+  'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend():
+  """
+  POSTS_SEARCH_BACKEND (a dotted path) wins; otherwise picked from the database vendor.
+  """
+  path = getattr(settings, 'POSTS_SEARCH_BACKEND', None)
+  if path:
+    return import_string(path)()
+  return BACKENDS.get(connection.vendor, BasicSearchBackend)()
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+  """
+  Drop-in for DRF's SearchFilter (same ?search= parameter) backed by the search index.
+  """
+  search_description = 'Full-text search over title, content, author and tags. Results are ranked by relevance.'
+
+  def filter_queryset(self, request, queryset, view):
+    terms = self.get_search_terms(request)
+    if not terms:
+      return queryset
+    return get_search_backend().search(queryset, terms)
@@ -1,10 +1,17 @@
 from rest_framework import serializers
-from .models import Post, Category, Tag, Comment, Rating
+from rest_framework.relations import MANY_RELATION_KWARGS
+from django.conf import settings
+from django.db import models
+from .models import Post, Category, Tag, Comment, Rating, Like, ArchiveMonth, FacetCount
 from .utils import get_social_share_links
+from .rendering import render_markdown
 from drf_spectacular.utils import extend_schema_field
 from drf_spectacular.types import OpenApiTypes
-import markdown
-import bleach
+from blogging_platform_api.timing import TimedSerializerMixin
+from blogging_platform_api.metrics import record_cache
+from blogging_platform_api.sparse_fields import DynamicFieldsMixin
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -15,7 +22,58 @@ class CommentSerializer(serializers.ModelSerializer):
     fields = ['id', 'post', 'author_username', 'content', 'created_at']
     read_only_fields = ['author', 'post']
 
-class PostSerializer(serializers.ModelSerializer):
+class SlugListField(serializers.ManyRelatedField):
+  #Looks up every submitted slug with one query, not one per item
+  def to_internal_value(self, data):
+    if isinstance(data, str) or not hasattr(data, '__iter__'):
+      self.fail('not_a_list', input_type=type(data).__name__)
+    if not self.allow_empty and len(data) == 0:
+      self.fail('empty')
+    child = self.child_relation
+    slugs = [str(slug) for slug in data]
+    found = {
+      str(getattr(obj, child.slug_field)): obj
+      for obj in child.get_queryset().filter(**{f'{child.slug_field}__in': slugs})
+    }
+    for slug in slugs:
+      if slug not in found:
+        child.fail('does_not_exist', slug_name=child.slug_field, value=slug)
+    return [found[slug] for slug in slugs]
+
+
+class BulkSlugRelatedField(serializers.SlugRelatedField):
+  @classmethod
+  def many_init(cls, *args, **kwargs):
+    list_kwargs = {'child_relation': cls(*args, **kwargs)}
+    for key in kwargs:
+      if key in MANY_RELATION_KWARGS:
+        list_kwargs[key] = kwargs[key]
+    return SlugListField(**list_kwargs)
+
+
+class PostListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+  """
+  Resolves the viewer's likes for a whole page of posts in one query,
+  instead of one EXISTS query per post in get_has_liked.
+  """
+  liked_post_ids = None
+
+  def to_representation(self, data):
+    iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+    posts = list(iterable)
+
+    request = self.context.get('request')
+    if request is not None and request.user.is_authenticated and 'has_liked' in self.child.fields:  # type: ignore [union-attr]
+      self.liked_post_ids = set(
+        Like.objects.filter(
+          user_id=request.user.pk, post_id__in=[post.pk for post in posts]
+        ).values_list('post_id', flat=True)
+      )
+
+    return super().to_representation(posts)
+
+
+class PostSerializer(DynamicFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
   # Use StringRelatedField to show the author's username instead of their ID
   author = serializers.ReadOnlyField(source='author.username')
   # Use SlugRelatedField to show category name, and make it required
@@ -26,57 +84,119 @@ class PostSerializer(serializers.ModelSerializer):
 
   #This field will show the rendered HTML
   content_html = serializers.SerializerMethodField()
+  #Plain-text start of the post, for lists that skip 'content' (?fields=...)
+  snippet = serializers.SerializerMethodField()
 
   # Tags are optional, allow reading/writing names
-  tags = serializers.SlugRelatedField(
+  tags = BulkSlugRelatedField(
     many=True,
     slug_field='name', 
     queryset=Tag.objects.all(),
     required=False, #Tages are optional requirement
   )
 
-  likes_count = serializers.ReadOnlyField(source='total_likes')
+  likes_count = serializers.ReadOnlyField(source='like_count')
   has_liked = serializers.SerializerMethodField()
-  avg_rating = serializers.FloatField(read_only=True)
+  #Bayesian average read from the rating counters; null until the first rating
+  avg_rating = serializers.SerializerMethodField()
+  rating_count = serializers.ReadOnlyField()
+  #Ratings per score ({"1": n, ... "5": n}), only sent with ?expand=rating_histogram
+  rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+  comment_count = serializers.ReadOnlyField()
 
   #share_links = serializers.SerializerMethodField()
 
   status_display = serializers.CharField(source='get_status_display', read_only=True)
+  #Bounded preview; the full list is paginated at /api/<id>/comments/
+  latest_comments = serializers.SerializerMethodField()
+  #Unbounded, so only sent for a single post with ?expand=comments
   comments = CommentSerializer(many=True, read_only=True)
+  expandable_fields = ('comments', 'rating_histogram')
+  detail_only_fields = ('comments',)
+
+  SNIPPET_LENGTH = 200
 
   class Meta:
     model = Post
-    fields = ['id', 'title', 'content', 'author', 'status_display', 'category', 'created_at', 'has_liked', 'likes_count', 'comments', 'content_html', 'avg_rating', 'tags', 'status']
+    fields = ['id', 'title', 'content', 'snippet', 'author', 'status_display', 'category', 'created_at', 'has_liked', 'likes_count', 'comment_count', 'rating_count', 'latest_comments', 'comments', 'content_html', 'avg_rating', 'rating_histogram', 'tags', 'status']
 
+    list_serializer_class = PostListSerializer
     read_only_fields = ('author',) #These are set by the server, not the user
     extra_kwargs = {
       'status': {'required': True}
     }
 
+  @staticmethod
+  def setup_eager_loading(queryset, fields=None):
+    """
+    Loads everything the payload reads from related tables up front, so serializing
+    a page costs the same number of queries whatever its size. 'fields' is the
+    requested shape (see field_names_for); relations outside it aren't loaded and
+    the large text columns are deferred.
+    """
+    if fields is None:
+      fields = set(PostSerializer.Meta.fields)
+
+    related = [name for name in ('author', 'category') if name in fields]
+    if related:
+      queryset = queryset.select_related(*related)
+    if 'tags' in fields:
+      queryset = queryset.prefetch_related('tags')
+    if 'latest_comments' in fields:
+      #A sliced prefetch is one windowed query (ROW_NUMBER() per post) for the whole page
+      latest = Comment.objects.select_related('author').order_by('-created_at', '-id')[:settings.POST_LATEST_COMMENTS]
+      queryset = queryset.prefetch_related(models.Prefetch('comments', queryset=latest, to_attr='latest_comments'))
+    if 'comments' in fields:
+      queryset = queryset.prefetch_related(models.Prefetch('comments', queryset=Comment.objects.select_related('author')))
+
+    #content_html and the snippet only read 'content' for stale renders, which then
+    #load it per row; rerender_posts keeps those rare
+    deferred = []
+    if 'content' not in fields:
+      deferred.append('content')
+    if not fields & {'content_html', 'snippet'}:
+      deferred.append('content_html')
+    return queryset.defer(*deferred) if deferred else queryset
+
+  @extend_schema_field(OpenApiTypes.FLOAT)
+  def get_avg_rating(self, obj):
+    return obj.bayesian_rating if obj.rating_count else None
+
   @extend_schema_field(serializers.BooleanField)
   def get_has_liked(self, obj):
     request = self.context.get('request')
     if request is None or not request.user.is_authenticated:
       return False
-    
-    #Check if the user exists in the ManyToMany relationship
-    return obj.likes.filter(pk=request.user.pk).exists()
+
+    #When serialized as part of a list, the likes were resolved for the whole page
+    liked_post_ids = getattr(self.parent, 'liked_post_ids', None)
+    if liked_post_ids is not None:
+      return obj.pk in liked_post_ids
+
+    return Like.objects.filter(post_id=obj.pk, user_id=request.user.pk).exists()
 
   @extend_schema_field(OpenApiTypes.STR)
   def get_content_html(self, obj):
-    
+    #Serve the HTML stored at save time; only rows rendered by an older
+    #renderer fall back to rendering here (rerender_posts fixes them in bulk)
+    record_cache('post_render', obj.has_current_render)
+    if obj.has_current_render:
+      return obj.content_html
 
-    #Converts the raw 'content' (Markdown) into HTML
-    #extensions=['extra'] adds support for tables, footnotes, etc.
-    html =  markdown.markdown(obj.content, extensions=['extra', 'codehilite'])
+    return render_markdown(obj.content)
 
-    #Define which HTML tags are allowed
-    allowed_tags = [
-      'p', 'b', 'i', 'u', 'em', 'string', 'a', 'h1', 'h2', 'h3', 'li', 'ul', 'ol', 'code', 'pre'
-    ]
-    allowed_attrs = {'a': ['href', 'title']}
+  @extend_schema_field(CommentSerializer(many=True))
+  def get_latest_comments(self, obj):
+    #Prefetched for the whole page by setup_eager_loading; single posts (e.g. just created) query here
+    comments = getattr(obj, 'latest_comments', None)
+    if comments is None:
+      comments = obj.comments.select_related('author').order_by('-created_at', '-id')[:settings.POST_LATEST_COMMENTS]
+    return CommentSerializer(comments, many=True, context=self.context).data
 
-    return bleach.clean(html, tags=allowed_tags, attributes=allowed_attrs)
+  @extend_schema_field(OpenApiTypes.STR)
+  def get_snippet(self, obj):
+    html = obj.content_html if obj.has_current_render else render_markdown(obj.content)
+    return Truncator(strip_tags(html).strip()).chars(self.SNIPPET_LENGTH)
 
   @extend_schema_field(OpenApiTypes.OBJECT)
   def get_share_links(self, obj):
@@ -93,6 +213,26 @@ class RatingSerializer(serializers.ModelSerializer):
         fields = ['score']
 
 
+class EngagementBatchSerializer(serializers.Serializer):
+  #Items are validated one by one by the view, so one bad item doesn't reject the batch
+  items = serializers.ListField(allow_empty=False)
+
+  def validate_items(self, items):
+    if len(items) > settings.ENGAGEMENT_BATCH_SIZE:
+      raise serializers.ValidationError(f'At most {settings.ENGAGEMENT_BATCH_SIZE} items per request.')
+    return items
+
+
+class BatchLikeItemSerializer(serializers.Serializer):
+  post = serializers.IntegerField(min_value=1)
+  liked = serializers.BooleanField(default=True)
+
+
+class BatchRatingItemSerializer(serializers.Serializer):
+  post = serializers.IntegerField(min_value=1)
+  score = serializers.IntegerField(min_value=1, max_value=5)
+
+
 class CategorySerializer(serializers.ModelSerializer):
   post_count = serializers.SerializerMethodField()
 
@@ -101,5 +241,21 @@ class CategorySerializer(serializers.ModelSerializer):
     fields = ['id', 'name', 'post_count']
 
   def get_post_count(self, obj):
-    #Counts only posts that are Published
-    return Post.objects.filter(category=obj, status='PB').count()
\ No newline at end of file
+    #Listings annotate the count (see CategoryListView), single instances count here
+    if hasattr(obj, 'published_post_count'):
+      return obj.published_post_count
+    #Published posts only, precomputed in FacetCount
+    return FacetCount.objects.filter(facet=FacetCount.Facet.CATEGORY, value_id=obj.pk).values_list('post_count', flat=True).first() or 0
+
+
+class ArchiveMonthSerializer(serializers.ModelSerializer):
+  #'2026-03', and 'March 2026' for the sidebar
+  month = serializers.DateField(format='%Y-%m', read_only=True)
+  label = serializers.SerializerMethodField()
+
+  class Meta:
+    model = ArchiveMonth
+    fields = ['month', 'label', 'post_count']
+
+  def get_label(self, obj) -> str:
+    return obj.month.strftime('%B %Y')
@@ -1,26 +1,240 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.core.mail import send_mail
-from .models import Rating, Post
-from .tasks import send_rating_notification_email, notify_subscribers
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.contrib.auth.models import User
+from users.models import Follow, Profile
+from .models import Rating, Post, Comment, Category, Tag, CategorySubscription, FacetCount
+from .tasks import fan_out_post, backfill_timeline, prune_timeline, update_leaderboards
+from .counters import adjust_post_counters, apply_rating_change, touch_post
+from . import timelines, leaderboards, cache_tags, outbox, archive, facets
+from .search import get_search_backend
+from blogging_platform_api.response_cache import invalidate
 
 @receiver(post_save, sender=Rating)
 def notify_author_of_five_star(sender, instance, created, **kwargs):
-  #Only notify if the score is 5
+  #Only notify if the score is 5; sent by the outbox relay, not this request
   if instance.score == 5 and instance.post.status == Post.Status.PUBLISHED:
-    post = instance.post
-
-    if post.author.email:
-      #Execute synchronously for development (remove .delay() to avoid Celery dependency)
-      send_rating_notification_email(  # type: ignore
-        post.author.email,
-        post.author.username,
-        post.title
-      )
+    outbox.publish('rating.five_star', post_id=instance.post_id)
 
 
 @receiver(post_save, sender=Post)
 def notify_subscribers_on_publish(sender, instance, created, **kwargs):
-  if created and instance.status == Post.Status.PUBLISHED:
-    #Execute synchronously for development (remove .delay() to avoid Celery dependency)
-    notify_subscribers(instance.id)  # type: ignore
+  #New published posts and drafts being published
+  if instance.status == Post.Status.PUBLISHED and instance.loaded_value('status') != Post.Status.PUBLISHED:
+    outbox.publish('post.published', post_id=instance.id)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_on_create(sender, instance, created, **kwargs):
+  if created:
+    adjust_post_counters(instance.post_id, comment_count=1)
+
+
+def _deleting_post(origin):
+  #Comments and ratings removed with their post: its counters go with it
+  return isinstance(origin, Post) or (isinstance(origin, QuerySet) and origin.model is Post)
+
+
+@receiver(post_delete, sender=Comment)
+def count_comment_on_delete(sender, instance, origin=None, **kwargs):
+  if _deleting_post(origin):
+    return
+  adjust_post_counters(instance.post_id, comment_count=-1)
+
+
+@receiver(post_save, sender=Rating)
+def count_rating_on_save(sender, instance, created, update_fields=None, **kwargs):
+  if update_fields is not None and 'score' not in update_fields:
+    return
+  apply_rating_change(instance.post_id, None if created else instance._loaded_score, instance.score)
+
+
+@receiver(post_delete, sender=Rating)
+def count_rating_on_delete(sender, instance, origin=None, **kwargs):
+  if _deleting_post(origin):
+    return
+  previous = instance._loaded_score
+  apply_rating_change(instance.post_id, instance.score if previous is None else previous, None)
+
+
+@receiver(post_save, sender=Post)
+def update_timelines_on_status_change(sender, instance, **kwargs):
+  was_published = instance.loaded_value('status') == Post.Status.PUBLISHED
+  is_published = instance.status == Post.Status.PUBLISHED
+
+  post_id = instance.id
+  if is_published and not was_published:
+    #Fan out once the post is committed, so the task can see it
+    transaction.on_commit(lambda: fan_out_post.delay(post_id))  # type: ignore
+    transaction.on_commit(lambda: update_leaderboards.delay(post_id))  # type: ignore
+  elif was_published and not is_published:
+    timelines.remove_post(post_id)
+    leaderboards.remove_post(post_id)
+  elif is_published and instance.loaded_value('category_id') != instance.category_id:
+    #Another audience: drop it from the old category's subscribers and fan out again,
+    #which also copies a changed published_at
+    timelines.remove_post(post_id)
+    transaction.on_commit(lambda: fan_out_post.delay(post_id))  # type: ignore
+  elif is_published and instance.loaded_value('published_at') != instance.published_at:
+    timelines.redate_post(post_id, instance.published_at)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline_on_follow(sender, instance, created, **kwargs):
+  if created:
+    user_id, author_id = instance.follower_id, instance.followed_user_id
+    transaction.on_commit(lambda: backfill_timeline.delay(user_id, author_id=author_id))  # type: ignore
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline_on_unfollow(sender, instance, **kwargs):
+  user_id, author_id = instance.follower_id, instance.followed_user_id
+  transaction.on_commit(lambda: prune_timeline.delay(user_id, author_id=author_id))  # type: ignore
+
+
+@receiver(post_save, sender=CategorySubscription)
+def backfill_timeline_on_subscribe(sender, instance, created, **kwargs):
+  if created:
+    user_id, category_id = instance.user_id, instance.category_id
+    transaction.on_commit(lambda: backfill_timeline.delay(user_id, category_id=category_id))  # type: ignore
+
+
+@receiver(post_delete, sender=CategorySubscription)
+def prune_timeline_on_unsubscribe(sender, instance, **kwargs):
+  user_id, category_id = instance.user_id, instance.category_id
+  transaction.on_commit(lambda: prune_timeline.delay(user_id, category_id=category_id))  # type: ignore
+
+
+@receiver(post_save, sender=Post)
+def index_post_for_search(sender, instance, **kwargs):
+  get_search_backend().index_post(instance.id)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_from_search(sender, instance, **kwargs):
+  get_search_backend().remove_post(instance.id)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def reindex_post_on_tag_change(sender, instance, action, reverse, pk_set, **kwargs):
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+
+  backend = get_search_backend()
+  if not reverse:
+    backend.index_post(instance.id)
+  elif pk_set:
+    #tag.post_set.add(...) style changes: pk_set holds the affected posts
+    for post_id in pk_set:
+      backend.index_post(post_id)
+
+
+#Anonymous response cache invalidation
+@receiver(post_save, sender=Post)
+def invalidate_responses_on_post_save(sender, instance, **kwargs):
+  #Drafts aren't in any cached response
+  if instance.status != Post.Status.PUBLISHED and instance.loaded_value('status') != Post.Status.PUBLISHED:
+    return
+  cache_tags.invalidate_post(instance.author_id, instance.category_id, instance.loaded_value('category_id'))
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_responses_on_post_delete(sender, instance, **kwargs):
+  if instance.status == Post.Status.PUBLISHED:
+    cache_tags.invalidate_post(instance.author_id, instance.category_id)
+
+
+#Counter changes (likes, ratings, comment counts) invalidate in adjust_post_counters;
+#this covers edited comment bodies, which are nested in the post payloads
+@receiver(post_save, sender=Comment)
+def invalidate_responses_on_comment_edit(sender, instance, created, **kwargs):
+  if not created:
+    cache_tags.invalidate_published_post(instance.post_id)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_responses_on_tag_change(sender, instance, action, reverse, pk_set, **kwargs):
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+  for post_id in (pk_set or [] if reverse else [instance.pk]):
+    cache_tags.invalidate_published_post(post_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_responses_on_category_change(sender, instance, **kwargs):
+  invalidate(cache_tags.CATEGORIES, cache_tags.category(instance.name))
+
+
+#Conditional request validators (see blogging_platform_api/conditional.py)
+@receiver(post_save, sender=Comment)
+def touch_post_on_comment_edit(sender, instance, created, **kwargs):
+  #New and deleted comments already move the post through comment_count
+  if not created:
+    touch_post(instance.post_id)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def touch_post_on_tag_change(sender, instance, action, reverse, pk_set, **kwargs):
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+  for post_id in (pk_set or [] if reverse else [instance.pk]):
+    touch_post(post_id)
+
+
+@receiver(post_save, sender=Post)
+def touch_profile_on_publish_change(sender, instance, **kwargs):
+  #A post entering or leaving the author's public list; edits show in the posts' own updated_at
+  if instance.loaded_value('status') != instance.status:
+    Profile.objects.filter(user_id=instance.author_id).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Post)
+def touch_profile_on_post_delete(sender, instance, **kwargs):
+  if instance.status == Post.Status.PUBLISHED:
+    Profile.objects.filter(user_id=instance.author_id).update(updated_at=timezone.now())
+
+
+#Archive month counts (posts/archive.py)
+@receiver(post_save, sender=Post)
+def count_archive_month_on_save(sender, instance, **kwargs):
+  archive.post_saved(instance)
+
+
+@receiver(post_delete, sender=Post)
+def count_archive_month_on_delete(sender, instance, **kwargs):
+  archive.post_deleted(instance)
+
+
+#Facet counts (posts/facets.py)
+@receiver(post_save, sender=Post)
+def count_facets_on_save(sender, instance, **kwargs):
+  facets.post_saved(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def count_facets_on_delete(sender, instance, **kwargs):
+  facets.post_deleting(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def count_facets_on_tag_change(sender, instance, action, reverse, pk_set, **kwargs):
+  facets.tags_changed(instance, action, reverse, pk_set)
+
+
+@receiver(post_delete, sender=Category)
+def drop_category_facet(sender, instance, **kwargs):
+  facets.value_deleted(FacetCount.Facet.CATEGORY, instance.pk)
+
+
+@receiver(post_delete, sender=Tag)
+def drop_tag_facet(sender, instance, **kwargs):
+  facets.value_deleted(FacetCount.Facet.TAG, instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def drop_author_facet(sender, instance, **kwargs):
+  facets.value_deleted(FacetCount.Facet.AUTHOR, instance.pk)
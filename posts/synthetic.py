@@ -0,0 +1,185 @@
+import random
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from users.models import Follow, Profile
+from .counters import reconcile_post_counters
+from .models import Post, Category, Tag, Comment, Rating, Like, CategorySubscription
+
+
+BATCH_SIZE = 1000
+
+WORDS = (
+  'api cache query index latency feed post author reader django python database server request '
+  'response token model view serializer migration signal worker queue redis celery timeline search '
+  'ranking markdown render template deploy release review commit branch test benchmark profile '
+  'follow like rating comment category tag draft publish archive metric trace throughput budget'
+).split()
+
+
+def _zipf_weights(count, exponent):
+  #Rank r gets weight 1/r^s: a few very popular items and a long tail
+  return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def _cumulative(weights):
+  total = 0
+  for weight in weights:
+    total += weight
+    yield total
+
+
+class SyntheticDataGenerator:
+  """
+  Writes a reproducible dataset with bulk_create: users with profiles, power-law
+  follows, categories, tags, Markdown posts, likes, ratings and comments.
+
+  Everything the signals would maintain (counters, follower counts, timelines,
+  leaderboards, the search index, facet counts, the archive) is rebuilt by the
+  caller afterwards.
+  """
+  def __init__(self, users=1000, posts=10000, categories=10, tags=50, avg_follows=20,
+               avg_likes=5, avg_ratings=2, avg_comments=2, draft_ratio=0.1, days=30,
+               exponent=1.1, prefix='synthetic', seed=0):
+    self.users = users
+    self.posts = posts
+    self.categories = categories
+    self.tags = tags
+    self.avg_follows = avg_follows
+    self.avg_likes = avg_likes
+    self.avg_ratings = avg_ratings
+    self.avg_comments = avg_comments
+    self.draft_ratio = draft_ratio
+    self.days = days
+    self.exponent = exponent
+    self.prefix = prefix
+    self.random = random.Random(seed)
+    self.now = timezone.now()
+
+  def sentence(self, low=4, high=12):
+    words = self.random.choices(WORDS, k=self.random.randint(low, high))
+    return ' '.join(words).capitalize()
+
+  def paragraph(self):
+    return ' '.join(f'{self.sentence()}.' for _ in range(self.random.randint(2, 5)))
+
+  def markdown(self):
+    #Headings, emphasis, links, lists and code, so rendering cost resembles real posts
+    blocks = [f'## {self.sentence(2, 5)}', self.paragraph()]
+    for _ in range(self.random.randint(1, 4)):
+      kind = self.random.choice(['paragraph', 'list', 'code', 'quote', 'link'])
+      if kind == 'list':
+        blocks.append('\n'.join(f'- {self.sentence(2, 6)}' for _ in range(self.random.randint(2, 5))))
+      elif kind == 'code':
+        blocks.append('```python\ndef {0}():\n    return {1!r}\n```'.format(self.random.choice(WORDS), self.sentence(1, 3)))
+      elif kind == 'quote':
+        blocks.append(f'> {self.sentence()}')
+      elif kind == 'link':
+        blocks.append(f'{self.sentence()} [{self.random.choice(WORDS)}](https://example.com/{self.random.choice(WORDS)}) **{self.random.choice(WORDS)}**.')
+      else:
+        blocks.append(self.paragraph())
+    return '\n\n'.join(blocks)
+
+  def pick(self, population, weights, count):
+    #Weighted sample without replacement, by drawing until enough distinct items came up
+    count = min(count, len(population))
+    chosen = set()
+    while len(chosen) < count:
+      chosen.update(self.random.choices(population, cum_weights=weights, k=count - len(chosen)))
+    return chosen
+
+  def degree(self, mean):
+    #Pareto-distributed degree with the given mean (alpha=2 has mean 2x the minimum)
+    return int(self.random.paretovariate(2) * mean / 2)
+
+  def generate(self, log=lambda message: None):
+    password = make_password(None)
+    users = User.objects.bulk_create(
+      [User(username=f'{self.prefix}{i}', email=f'{self.prefix}{i}@example.com', password=password) for i in range(self.users)],
+      batch_size=BATCH_SIZE
+    )
+    Profile.objects.bulk_create([Profile(user=user, bio=self.sentence()) for user in users], batch_size=BATCH_SIZE)
+    user_ids = [user.id for user in users]
+    log(f'{len(users)} users')
+
+    #Popularity is a fixed ranking over the users, shared by follows and authorship
+    popular = list(user_ids)
+    self.random.shuffle(popular)
+    popularity = list(_cumulative(_zipf_weights(len(popular), self.exponent)))
+
+    follows = []
+    for user_id in user_ids:
+      targets = self.pick(popular, popularity, self.degree(self.avg_follows))
+      follows.extend(Follow(follower_id=user_id, followed_user_id=target) for target in targets if target != user_id)
+    Follow.objects.bulk_create(follows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    log(f'{len(follows)} follows')
+
+    Category.objects.bulk_create(
+      [Category(name=f'{self.prefix} category {i}') for i in range(self.categories)], ignore_conflicts=True
+    )
+    categories = list(Category.objects.filter(name__startswith=f'{self.prefix} category '))
+    Tag.objects.bulk_create([Tag(name=f'{self.prefix}-{i}') for i in range(self.tags)], ignore_conflicts=True)
+    tags = list(Tag.objects.filter(name__startswith=f'{self.prefix}-'))
+    category_weights = list(_cumulative(_zipf_weights(len(categories), self.exponent)))
+    tag_weights = list(_cumulative(_zipf_weights(len(tags), self.exponent)))
+
+    subscriptions = [
+      CategorySubscription(user_id=user_id, category=category)
+      for user_id in user_ids for category in self.pick(categories, category_weights, self.random.randint(0, 2))
+    ]
+    CategorySubscription.objects.bulk_create(subscriptions, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    span = timedelta(days=self.days).total_seconds()
+    posts = []
+    for i in range(self.posts):
+      draft = self.random.random() < self.draft_ratio
+      post = Post(
+        title=self.sentence(3, 8),
+        content=self.markdown(),
+        author_id=self.random.choices(popular, cum_weights=popularity)[0],
+        category=self.random.choices(categories, cum_weights=category_weights)[0],
+        status=Post.Status.DRAFT if draft else Post.Status.PUBLISHED,
+        published_at=None if draft else self.now - timedelta(seconds=self.random.uniform(0, span)),
+      )
+      post.refresh_rendered_content()
+      posts.append(post)
+    posts = Post.objects.bulk_create(posts, batch_size=BATCH_SIZE)
+    post_ids = [post.id for post in posts]
+    #ID ranges rather than IN lists, which would run into SQLite's parameter limit
+    generated = Post.objects.filter(id__gte=min(post_ids, default=0), id__lte=max(post_ids, default=0))
+    #created_at is auto_now_add, so spread it out after the insert
+    generated.filter(published_at__isnull=False).update(created_at=F('published_at'))
+    log(f'{len(posts)} posts')
+
+    Post.tags.through.objects.bulk_create([
+      Post.tags.through(post_id=post_id, tag_id=tag.id)
+      for post_id in post_ids for tag in self.pick(tags, tag_weights, self.random.randint(0, 4))
+    ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    #Engagement is skewed too: the same popular users do most of the liking and rating
+    published = [post for post in posts if post.status == Post.Status.PUBLISHED]
+    likes, ratings, comments = [], [], []
+    for post in published:
+      for user_id in self.pick(popular, popularity, self.degree(self.avg_likes)):
+        likes.append(Like(post_id=post.id, user_id=user_id))
+      for user_id in self.pick(popular, popularity, self.degree(self.avg_ratings)):
+        ratings.append(Rating(post_id=post.id, user_id=user_id, score=self.random.choices([1, 2, 3, 4, 5], weights=[1, 1, 3, 5, 4])[0]))
+      for _ in range(self.degree(self.avg_comments)):
+        comments.append(Comment(post_id=post.id, author_id=self.random.choice(user_ids), content=self.sentence()))
+    Like.objects.bulk_create(likes, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    Rating.objects.bulk_create(ratings, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    Comment.objects.bulk_create(comments, batch_size=BATCH_SIZE)
+    log(f'{len(likes)} likes, {len(ratings)} ratings, {len(comments)} comments')
+
+    #Denormalized counts the skipped signals would have kept
+    reconcile_post_counters(generated)
+    followers = Follow.objects.filter(followed_user_id=OuterRef('user_id')).order_by().values('followed_user_id').annotate(value=Count('*')).values('value')
+    Profile.objects.filter(user__username__startswith=self.prefix).update(follower_count=Coalesce(Subquery(followers, output_field=IntegerField()), 0))
+
+    return {
+      'users': len(users), 'follows': len(follows), 'categories': len(categories), 'tags': len(tags),
+      'posts': len(posts), 'likes': len(likes), 'ratings': len(ratings), 'comments': len(comments),
+    }
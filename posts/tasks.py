@@ -1,7 +1,8 @@
 from celery import shared_task
+from django.conf import settings
 from django.core.mail import send_mail
-from .models import Post, CategorySubscription
-from users.models import Follow
+from .models import Post
+from . import timelines, leaderboards, notifications
 
 
 @shared_task
@@ -30,26 +31,62 @@ def share_post_via_email(post_title, post_url, recipient_email, sender_name):
 
 @shared_task
 def notify_subscribers(post_id):
-  post = Post.objects.get(pk=post_id)
+  #Splits the recipients into batches, each its own task so they retry independently
+  post = Post.objects.filter(pk=post_id, status=Post.Status.PUBLISHED).first()
+  if post is None:
+    return
+  for user_ids in notifications.recipient_batches(post, settings.NOTIFICATION_BATCH_SIZE):
+    send_notification_batch.delay(post_id, user_ids)  # type: ignore
 
-  #1. Get emails of people following the author
-  author_followers = Follow.objects.filter(followed_user=post.author).values_list('follower__email', flat=True)
 
-  #2. Get emails of people subscribed to the category
-  category_subs = CategorySubscription.objects.filter(category=post.category).values_list('user__email', flat=True)
+#Connection-level SMTP errors are OSErrors (refused recipients are handled per recipient);
+#retries back off exponentially (1s, 2s, 4s... up to 10 minutes)
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, retry_backoff_max=600, retry_jitter=True, max_retries=6)
+def send_notification_batch(post_id, user_ids):
+  return notifications.send_batch(post_id, user_ids)
 
-  #3. Combine and remove duplicates
-  recipient_list = list(set(list(author_followers) + list(category_subs)))
 
-  #4. Remove empty emails
-  recipient_list = [email for email in recipient_list if email]
+@shared_task
+def send_notification_digests(frequency):
+  #Scheduled hourly and daily by Celery beat; one batch task per DIGEST_BATCH_SIZE users
+  for user_ids in notifications.digest_users(frequency, settings.DIGEST_BATCH_SIZE):
+    send_digest_batch.delay(user_ids)  # type: ignore
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, retry_backoff_max=600, retry_jitter=True, max_retries=6)
+def send_digest_batch(user_ids):
+  return notifications.send_digest_batch(user_ids)
+
+
+@shared_task
+def fan_out_post(post_id):
+  post = Post.objects.filter(pk=post_id, status=Post.Status.PUBLISHED).first()
+  #The post may have been unpublished or deleted before the task ran
+  if post is not None:
+    timelines.fan_out_post(post)
+
+
+@shared_task
+def backfill_timeline(user_id, author_id=None, category_id=None):
+  if author_id is not None:
+    timelines.backfill_author(user_id, author_id)
+  if category_id is not None:
+    timelines.backfill_category(user_id, category_id)
 
-  if recipient_list:
-    category_name = post.category.name if post.category else "General"
-    send_mail(
-      subject=f"New Post: {post.title}",
-      message=f"{post.author.username} just published a new post in {category_name}!\n\nRead it here: http://myblog.com/posts/{post.id}/",
-      from_email='notifications@blogapi.com',
-      recipient_list=recipient_list,
-      fail_silently=False,
-    )
+
+@shared_task
+def prune_timeline(user_id, author_id=None, category_id=None):
+  if author_id is not None:
+    timelines.prune_author(user_id, author_id)
+  if category_id is not None:
+    timelines.prune_category(user_id, category_id)
+
+
+@shared_task
+def update_leaderboards(post_id):
+  leaderboards.record_engagement(post_id)
+
+
+@shared_task
+def rebuild_leaderboards():
+  leaderboards.rebuild()
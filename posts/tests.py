@@ -1,9 +1,38 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from smtplib import SMTPRecipientsRefused
+from unittest import mock, skipUnless
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import QuerySet
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIRequestFactory
 from django.contrib.auth.models import User
-from .models import Post, Category
+from users.models import Follow, Profile
+from .models import Post, Category, Tag, Comment, Rating, CategorySubscription, TimelineEntry, LeaderboardEntry, NotificationDelivery, OutboxEvent, PendingNotification, Like, ArchiveMonth, FacetCount
+from blogging_platform_api.response_cache import request_key
+from .search import get_search_backend
+from . import leaderboards, benchmark, notifications, outbox, archive, facets
+from .rendering import RENDER_VERSION
+from .serializers import PostSerializer
+from .tasks import send_notification_digests
+from .counters import toggle_like, reconcile_post_counters
+from users.views import UserListView
 
 class PostTests(APITestCase):
   def setUp(self):
@@ -125,3 +154,1900 @@ class PostTests(APITestCase):
 
     #Assert that it blocks the user (401 Unauthorized)
     self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class RenderCacheTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='writer', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    self.post = Post.objects.create(
+      title='Rendered', content='# Hello\n\nSome **text**', author=self.user,
+      category=self.category, status=Post.Status.PUBLISHED
+    )
+
+  def test_html_is_stored_on_save(self):
+    self.assertIn('<h1>Hello</h1>', self.post.content_html)
+    self.assertEqual(self.post.render_version, RENDER_VERSION)
+
+  def test_content_change_re_renders(self):
+    self.post.content = 'Changed'
+    self.post.save()
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.content_html, '<p>Changed</p>')
+
+  def test_serializer_serves_stored_html(self):
+    with mock.patch('posts.serializers.render_markdown') as render:
+      data = PostSerializer(self.post).data
+    render.assert_not_called()
+    self.assertEqual(data['content_html'], self.post.content_html)
+
+  def test_rerender_command_fixes_stale_rows(self):
+    Post.objects.filter(pk=self.post.pk).update(content_html='', render_version='old')
+
+    call_command('rerender_posts', chunk_size=1, stdout=StringIO())
+
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.render_version, RENDER_VERSION)
+    self.assertIn('<h1>Hello</h1>', self.post.content_html)
+
+
+class HasLikedBatchTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='reader', password='password123')
+    author = User.objects.create_user(username='author', password='password123')
+    self.posts = [
+      Post.objects.create(title=f'Post {i}', content='Body', author=author, status=Post.Status.PUBLISHED)
+      for i in range(5)
+    ]
+    self.posts[1].likes.add(self.user)
+    self.client.force_authenticate(user=self.user)
+
+  def test_has_liked_resolved_with_one_query_per_page(self):
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('explore'))
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    liked = {post['id']: post['has_liked'] for post in response.data['results']}  # type: ignore
+    self.assertEqual(liked, {post.id: post.id == self.posts[1].id for post in self.posts})
+
+    like_lookups = [q['sql'] for q in ctx.captured_queries if '"posts_like"' in q['sql'] and '"user_id" =' in q['sql']]
+    self.assertEqual(len(like_lookups), 1)
+
+
+class EngagementCounterTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='reader', password='password123')
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.post = Post.objects.create(title='Counted', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+    self.client.force_authenticate(user=self.user)
+
+  def test_like_toggle_updates_counter(self):
+    response = self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+    self.assertEqual(response.data['current_total'], 1)  # type: ignore
+
+    response = self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+    self.assertEqual(response.data['current_total'], 0)  # type: ignore
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.like_count, 0)
+
+  def test_rating_change_applies_delta(self):
+    url = reverse('post-rate', kwargs={'pk': self.post.pk})
+    self.client.post(url, {'score': 2})
+    self.client.post(url, {'score': 5})
+
+    self.post.refresh_from_db()
+    self.assertEqual((self.post.rating_count, self.post.rating_sum), (1, 5))
+    self.assertEqual(self.post.avg_rating, 5)
+
+  def test_invalid_score_is_rejected(self):
+    response = self.client.post(reverse('post-rate', kwargs={'pk': self.post.pk}), {'score': 9})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_comment_create_and_delete_update_counter(self):
+    self.client.post(reverse('post-comments', kwargs={'post_pk': self.post.pk}), {'content': 'Nice'})
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.comment_count, 1)
+
+    Comment.objects.get(post=self.post).delete()
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.comment_count, 0)
+
+  def test_reconcile_command_recomputes_counters(self):
+    self.post.likes.add(self.user)
+    Rating.objects.create(user=self.user, post=self.post, score=4)
+    Post.objects.filter(pk=self.post.pk).update(like_count=7, rating_count=0, rating_sum=0)
+
+    call_command('reconcile_post_counters', stdout=StringIO())
+
+    self.post.refresh_from_db()
+    self.assertEqual((self.post.like_count, self.post.rating_count, self.post.rating_sum), (1, 1, 4))
+
+  def test_like_toggle_is_a_single_transaction(self):
+    url = reverse('post-like', kwargs={'pk': self.post.pk})
+    self.client.post(url)
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.post(url)
+    self.assertEqual((response.data['has_liked'], response.data['current_total']), (False, 0))  # type: ignore
+    sql = [query['sql'] for query in ctx.captured_queries]
+    #No recount of the likes and no check-then-act lookup before the write
+    self.assertFalse(any('COUNT(' in query for query in sql))
+    self.assertTrue(sql[0].startswith('SAVEPOINT') or sql[0] == 'BEGIN')
+    self.assertTrue(sql[1].startswith('DELETE FROM "posts_like"'))
+
+  def test_like_on_unknown_post_is_404(self):
+    response = self.client.post(reverse('post-like', kwargs={'pk': self.post.pk + 100}))
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    self.assertFalse(Like.objects.exists())
+
+  def test_saving_a_stale_post_keeps_the_counters(self):
+    stale = Post.objects.get(pk=self.post.pk)
+    toggle_like(self.post.pk, self.user.pk)
+    Comment.objects.create(post=self.post, author=self.user, content='First')
+    version = Post.objects.values_list('version', flat=True).get(pk=self.post.pk)
+
+    stale.title = 'Edited'
+    stale.save()
+
+    self.post.refresh_from_db()
+    self.assertEqual((self.post.title, self.post.like_count, self.post.comment_count), ('Edited', 1, 1))
+    self.assertEqual(self.post.version, version + 1)
+    self.assertEqual(stale.version, version + 1)
+
+    #Without UPDATE ... RETURNING the bumped version is reloaded after the save
+    comment = Comment.objects.get(post=self.post)
+    with mock.patch.object(type(connection.features), 'can_return_rows_from_update', False):
+      stale.save()
+      comment.save()
+    #Read from the instance dict: a deferred field would hide a missing reload
+    self.assertEqual(vars(stale)['version'], version + 2)
+    self.assertEqual(vars(comment)['version'], 2)
+
+  def test_deleting_a_post_skips_its_childrens_counter_upkeep(self):
+    raters = [User.objects.create_user(username=f'rater{i}', password='password123') for i in range(10)]
+    small = Post.objects.create(title='Small', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+    for post, count in ((small, 1), (self.post, 10)):
+      Comment.objects.bulk_create([Comment(post=post, author=self.user, content='Hi') for _ in range(2 * count)])
+      Rating.objects.bulk_create([Rating(post=post, user=rater, score=4) for rater in raters[:count]])
+
+    queries = []
+    for post in (small, self.post):
+      with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+        post.delete()
+      queries.append(len(ctx.captured_queries))
+    self.assertEqual(queries[0], queries[1])
+    self.assertFalse(Comment.objects.exists() or Rating.objects.exists())
+
+    #Deleting a comment or rating on its own still updates the post
+    other = Post.objects.create(title='Other', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+    comment = Comment.objects.create(post=other, author=self.user, content='Hi')
+    rating = Rating.objects.create(post=other, user=self.user, score=5)
+    comment.delete()
+    rating.delete()
+    other.refresh_from_db()
+    self.assertEqual((other.comment_count, other.rating_count, other.rating_sum), (0, 0, 0))
+
+
+class BatchEngagementTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='reader', password='password123')
+    self.author = User.objects.create_user(username='author', email='author@example.com', password='password123')
+    self.posts = [
+      Post.objects.create(title=f'Post {i}', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+      for i in range(4)
+    ]
+    self.draft = Post.objects.create(title='Draft', content='Body', author=self.author)
+    self.client.force_authenticate(user=self.user)
+
+  def test_state_uses_one_query_per_relation(self):
+    toggle_like(self.posts[1].pk, self.user.pk)
+    Rating.objects.create(user=self.user, post=self.posts[2], score=4)
+    ids = [post.pk for post in self.posts] + [self.draft.pk]
+    url = reverse('post-engagement') + '?ids=' + ','.join(map(str, ids))
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(url)
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    results = response.data['results']  # type: ignore
+    self.assertEqual([result['post'] for result in results], ids)
+    self.assertEqual([result.get('has_liked') for result in results[:2]], [False, True])
+    self.assertEqual((results[2]['my_rating'], results[2]['rating_count']), (4, 1))
+    self.assertAlmostEqual(results[2]['avg_rating'], Post.bayesian_average(4, 1))
+    self.assertEqual(results[2]['rating_histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0})
+    self.assertEqual(results[4]['status'], status.HTTP_404_NOT_FOUND)
+    #Posts, likes, ratings
+    self.assertEqual(len(ctx.captured_queries), 3)
+
+  def test_state_rejects_bad_ids(self):
+    response = self.client.get(reverse('post-engagement') + '?ids=1,x')
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    with override_settings(ENGAGEMENT_BATCH_SIZE=2):
+      response = self.client.get(reverse('post-engagement') + '?ids=1,2,3')
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_batch_like_reports_each_item(self):
+    toggle_like(self.posts[1].pk, self.user.pk)
+    items = [
+      {'post': self.posts[0].pk},
+      {'post': self.posts[1].pk, 'liked': False},
+      {'post': self.draft.pk},
+      {'post': 'nope'},
+      {'post': self.posts[0].pk, 'liked': False},
+      {'post': self.posts[2].pk, 'liked': False},
+    ]
+    response = self.client.post(reverse('post-like-batch'), {'items': items}, format='json')
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    results = response.data['results']  # type: ignore
+    self.assertEqual([result['status'] for result in results], [201, 200, 404, 400, 400, 200])
+    self.assertEqual([result.get('likes_count') for result in results], [1, 0, None, None, None, 0])
+    self.assertEqual(list(Like.objects.values_list('post_id', flat=True)), [self.posts[0].pk])
+    self.assertEqual(
+      list(Post.objects.filter(pk__in=[p.pk for p in self.posts]).order_by('pk').values_list('like_count', flat=True)), [1, 0, 0, 0]
+    )
+
+    #Setting, not toggling: a retried batch changes nothing
+    response = self.client.post(reverse('post-like-batch'), {'items': items[:2]}, format='json')
+    self.assertEqual([result['status'] for result in response.data['results']], [200, 200])  # type: ignore
+    self.assertEqual(Post.objects.get(pk=self.posts[0].pk).like_count, 1)
+
+  @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+  def test_batch_rate_upserts_and_applies_deltas(self):
+    Rating.objects.create(user=self.user, post=self.posts[0], score=2)
+    items = [
+      {'post': self.posts[0].pk, 'score': 5},
+      {'post': self.posts[1].pk, 'score': 3},
+      {'post': self.posts[2].pk, 'score': 9},
+    ]
+    response = self.client.post(reverse('post-rate-batch'), {'items': items}, format='json')
+
+    results = response.data['results']  # type: ignore
+    self.assertEqual([result['status'] for result in results], [200, 201, 400])
+    self.assertIn('score', results[2]['errors'])
+    self.assertEqual(Rating.objects.get(user=self.user, post=self.posts[0]).score, 5)
+    post = Post.objects.get(pk=self.posts[0].pk)
+    self.assertEqual((post.rating_count, post.rating_sum), (1, 5))
+    self.assertEqual(results[1]['rating_count'], 1)
+    self.assertAlmostEqual(results[1]['avg_rating'], Post.bayesian_average(3, 1))
+    post.refresh_from_db()
+    self.assertEqual(post.rating_histogram, {'1': 0, '2': 0, '3': 0, '4': 0, '5': 1})
+    self.assertFalse(Rating.objects.filter(post=self.posts[2]).exists())
+
+    #The upsert skips the post_save signal, so the five-star event is recorded explicitly
+    outbox.relay()
+    self.assertEqual([message.to for message in mail.outbox], [['author@example.com']])
+
+  def test_rows_written_concurrently_after_the_read_count_once(self):
+    bulk_create = QuerySet.bulk_create
+
+    def racing_bulk_create(queryset, objs, **kwargs):
+      #Another request stores the same like/rating between the batch's read and its write
+      for obj in objs:
+        if isinstance(obj, Like):
+          toggle_like(obj.post_id, obj.user_id)
+        else:
+          Rating.objects.create(user_id=obj.user_id, post_id=obj.post_id, score=1)
+      return bulk_create(queryset, objs, **kwargs)
+
+    with mock.patch.object(QuerySet, 'bulk_create', racing_bulk_create):
+      self.client.post(reverse('post-like-batch'), {'items': [{'post': self.posts[0].pk}]}, format='json')
+      self.client.post(reverse('post-rate-batch'), {'items': [{'post': self.posts[1].pk, 'score': 4}]}, format='json')
+
+    self.assertEqual(Post.objects.get(pk=self.posts[0].pk).like_count, 1)
+    post = Post.objects.get(pk=self.posts[1].pk)
+    self.assertEqual((post.rating_count, post.rating_sum), (1, 4))
+    self.assertEqual(post.rating_histogram, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0})
+
+  def test_batch_envelope_is_validated(self):
+    response = self.client.post(reverse('post-rate-batch'), {'items': []}, format='json')
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    with override_settings(ENGAGEMENT_BATCH_SIZE=1):
+      response = self.client.post(reverse('post-like-batch'), {'items': [{'post': 1}, {'post': 2}]}, format='json')
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.client.force_authenticate(user=None)
+    response = self.client.post(reverse('post-like-batch'), {'items': [{'post': 1}]}, format='json')
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+
+class RatingAggregateTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.raters = [User.objects.create_user(username=f'rater{i}', password='password123') for i in range(3)]
+    self.post = Post.objects.create(title='Rated', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+
+  def rate(self, user, post, score):
+    self.client.force_authenticate(user=user)
+    return self.client.post(reverse('post-rate', kwargs={'pk': post.pk}), {'score': score})
+
+  def test_histogram_follows_inserts_changes_and_deletes(self):
+    self.rate(self.raters[0], self.post, 4)
+    self.rate(self.raters[1], self.post, 4)
+    self.rate(self.raters[1], self.post, 2)
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.rating_histogram, {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0})
+    self.assertEqual((self.post.rating_count, self.post.rating_sum), (2, 6))
+
+    #Re-sending the same score changes nothing
+    self.rate(self.raters[1], self.post, 2)
+    Rating.objects.get(user=self.raters[0]).delete()
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.rating_histogram, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0})
+    self.assertEqual((self.post.rating_count, self.post.rating_sum), (1, 2))
+
+    Post.objects.filter(pk=self.post.pk).update(rating_count_2=0, rating_count_5=3)
+    reconcile_post_counters()
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.rating_histogram, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0})
+
+  def test_model_writes_keep_the_aggregates(self):
+    rating = Rating.objects.create(user=self.raters[0], post=self.post, score=4)
+    rating.score = 2
+    rating.save()
+    Rating.objects.create(user=self.raters[1], post=self.post, score=5)
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.rating_histogram, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1})
+    self.assertEqual((self.post.rating_count, self.post.rating_sum), (2, 7))
+
+    rating.delete()
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.rating_histogram, {'1': 0, '2': 0, '3': 0, '4': 0, '5': 1})
+    self.assertEqual((self.post.rating_count, self.post.rating_sum), (1, 5))
+
+  def test_avg_rating_is_the_bayesian_average(self):
+    self.rate(self.raters[0], self.post, 5)
+    response = self.client.get(reverse('post-detail', kwargs={'pk': self.post.pk}) + '?expand=rating_histogram')
+    self.assertAlmostEqual(response.data['avg_rating'], Post.bayesian_average(5, 1))  # type: ignore
+    self.assertEqual(response.data['rating_histogram']['5'], 1)  # type: ignore
+
+    unrated = Post.objects.create(title='Quiet', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+    response = self.client.get(reverse('post-detail', kwargs={'pk': unrated.pk}))
+    self.assertIsNone(response.data['avg_rating'])  # type: ignore
+    self.assertNotIn('rating_histogram', response.data)  # type: ignore
+
+  def test_lists_order_by_avg_rating_without_aggregating(self):
+    #One 5 star vote ranks below many 4s once smoothed
+    lucky = Post.objects.create(title='Lucky', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+    unrated = Post.objects.create(title='Unrated', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+    for rater in self.raters:
+      self.rate(rater, self.post, 4)
+    self.rate(self.raters[0], lucky, 5)
+    self.client.force_authenticate(user=None)
+
+    for url in (reverse('post-list'), reverse('explore')):
+      with CaptureQueriesContext(connection) as ctx:
+        response = self.client.get(url + '?ordering=-avg_rating&fields=id')
+      self.assertEqual([post['id'] for post in response.data['results']], [self.post.pk, lucky.pk, unrated.pk])  # type: ignore
+      #Ordered pages fall back from cursors to page numbers
+      self.assertIn('count', response.data)  # type: ignore
+      self.assertFalse(any('GROUP BY' in query['sql'] or '"posts_rating"' in query['sql'] for query in ctx.captured_queries))
+
+    response = self.client.get(reverse('post-list') + '?ordering=avg_rating&fields=id')
+    #Unrated posts still come last
+    self.assertEqual([post['id'] for post in response.data['results']], [lucky.pk, self.post.pk, unrated.pk])  # type: ignore
+
+
+
+class ArchiveTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.tech = Category.objects.create(name='Tech')
+    self.life = Category.objects.create(name='Life')
+
+  def publish(self, title, published_at, category=None):
+    return Post.objects.create(
+      title=title, content='Body', author=self.author, category=category, status=Post.Status.PUBLISHED, published_at=published_at
+    )
+
+  def counts(self, category=None):
+    return [(row.month.isoformat(), row.post_count) for row in archive.months(category)]
+
+  def test_date_filters_use_published_at(self):
+    early = self.publish('Early', datetime(2026, 3, 1, 0, 30, tzinfo=dt_timezone.utc))
+    late = self.publish('Late', datetime(2026, 3, 31, 23, 30, tzinfo=dt_timezone.utc))
+    self.publish('April', datetime(2026, 4, 1, 0, 0, tzinfo=dt_timezone.utc))
+    url = reverse('post-list')
+
+    def titles(query):
+      response = self.client.get(f'{url}?{query}&ordering=published_at&fields=title')
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      return [post['title'] for post in response.data['results']]  # type: ignore
+
+    #Both ends are inclusive days
+    self.assertEqual(titles('published_after=2026-03-01&published_before=2026-03-31'), [early.title, late.title])
+    self.assertEqual(titles('published_date=2026-03-31'), [late.title])
+    self.assertEqual(titles('published_after=2026-04-01'), ['April'])
+
+  def test_counts_follow_publishing_moves_and_deletes(self):
+    march = datetime(2026, 3, 10, tzinfo=dt_timezone.utc)
+    post = self.publish('One', march, self.tech)
+    self.publish('Two', march, self.life)
+    Post.objects.create(title='Draft', content='Body', author=self.author, category=self.tech)
+    self.assertEqual(self.counts(), [('2026-03-01', 2)])
+    self.assertEqual(self.counts('tech'), [('2026-03-01', 1)])
+
+    post.category = self.life
+    post.published_at = datetime(2026, 2, 27, tzinfo=dt_timezone.utc)
+    post.save()
+    self.assertEqual(self.counts(), [('2026-03-01', 1), ('2026-02-01', 1)])
+    self.assertEqual(self.counts('Tech'), [])
+    self.assertEqual(self.counts('Life'), [('2026-03-01', 1), ('2026-02-01', 1)])
+
+    post.status = Post.Status.DRAFT
+    post.save()
+    self.assertEqual(self.counts(), [('2026-03-01', 1)])
+    post.status = Post.Status.PUBLISHED
+    post.save()
+    post.delete()
+    self.assertEqual(self.counts(), [('2026-03-01', 1)])
+
+    #The rebuild agrees with the incremental counts and fixes drift
+    ArchiveMonth.objects.update(post_count=99)
+    call_command('rebuild_archive', stdout=StringIO())
+    self.assertEqual(self.counts(), [('2026-03-01', 1)])
+    self.assertEqual(self.counts('life'), [('2026-03-01', 1)])
+
+  def test_archive_endpoint_reads_the_precomputed_counts(self):
+    for day in (1, 2, 3):
+      self.publish(f'March {day}', datetime(2026, 3, day, tzinfo=dt_timezone.utc), self.tech)
+    self.publish('January', datetime(2026, 1, 5, tzinfo=dt_timezone.utc))
+
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('archive'))
+    self.assertEqual(response.data, [  # type: ignore
+      {'month': '2026-03', 'label': 'March 2026', 'post_count': 3},
+      {'month': '2026-01', 'label': 'January 2026', 'post_count': 1},
+    ])
+    self.assertFalse(any('"posts_post"' in query['sql'] or 'COUNT(' in query['sql'] for query in ctx.captured_queries))
+
+    response = self.client.get(reverse('archive') + '?category=tech')
+    self.assertEqual([row['post_count'] for row in response.data], [3])  # type: ignore
+
+
+
+class FacetTests(APITestCase):
+  def setUp(self):
+    self.alice = User.objects.create_user(username='alice', password='password123')
+    self.bob = User.objects.create_user(username='bob', password='password123')
+    self.tech = Category.objects.create(name='Tech')
+    self.life = Category.objects.create(name='Life')
+    self.django, self.python = Tag.objects.create(name='django'), Tag.objects.create(name='python')
+
+    self.first = self.publish('First', self.alice, self.tech, self.django, self.python)
+    self.publish('Second', self.alice, self.tech, self.python)
+    self.publish('Third', self.bob, self.life, self.python)
+    self.draft = Post.objects.create(title='Draft', content='Body', author=self.alice, category=self.tech)
+    self.draft.tags.add(self.django)
+
+  def publish(self, title, author, category, *tags):
+    post = Post.objects.create(title=title, content='Body', author=author, category=category, status=Post.Status.PUBLISHED)
+    post.tags.add(*tags)
+    return post
+
+  def stored(self):
+    return {facet: {row['value']: row['count'] for row in rows} for facet, rows in facets.counts().items()}
+
+  def test_counts_are_kept_current(self):
+    expected = {
+      'category': {'Tech': 2, 'Life': 1},
+      'tags': {'python': 3, 'django': 1},
+      'author': {'alice': 2, 'bob': 1},
+    }
+    self.assertEqual(self.stored(), expected)
+
+    self.first.tags.remove(self.django)
+    self.django.post_set.add(self.draft)
+    self.first.category = self.life
+    self.first.save()
+    self.draft.status = Post.Status.PUBLISHED
+    self.draft.save()
+    self.assertEqual(self.stored(), {
+      'category': {'Tech': 2, 'Life': 2},
+      'tags': {'python': 3, 'django': 1},
+      'author': {'alice': 3, 'bob': 1},
+    })
+
+    self.first.tags.clear()
+    self.draft.delete()
+    self.first.status = Post.Status.DRAFT
+    self.first.save()
+    after = {'category': {'Tech': 1, 'Life': 1}, 'tags': {'python': 2}, 'author': {'alice': 1, 'bob': 1}}
+    self.assertEqual(self.stored(), after)
+
+    #The rebuild agrees with the incremental counts and fixes drift
+    FacetCount.objects.update(post_count=42)
+    call_command('rebuild_facets', stdout=StringIO())
+    self.assertEqual(self.stored(), after)
+
+  def test_removing_unlinked_tags_changes_nothing(self):
+    #remove() reports every id it was given, linked or not
+    second = Post.objects.get(title='Second')
+    second.tags.remove(self.django)
+    self.django.post_set.remove(second, self.draft)
+    second.tags.add(self.python)
+    self.assertEqual(self.stored()['tags'], {'python': 3, 'django': 1})
+
+    self.python.post_set.remove(self.first, second, self.draft)
+    self.first.tags.remove(self.django, self.python)
+    self.assertEqual(self.stored()['tags'], {'python': 1})
+
+  def test_unfiltered_facets_are_read_not_counted(self):
+    self.client.force_authenticate(user=self.alice)
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('post-list') + '?facets=true&fields=id')
+    self.assertEqual(response.data['facets']['tags'], [{'value': 'python', 'count': 3}, {'value': 'django', 'count': 1}])  # type: ignore
+    facet_queries = [query['sql'] for query in ctx.captured_queries if 'GROUP BY' in query['sql'] or 'posts_facetcount' in query['sql']]
+    self.assertEqual(len(facet_queries), 3)
+    self.assertFalse(any('GROUP BY' in sql for sql in facet_queries))
+
+  def test_filtered_facets_count_the_matching_posts(self):
+    #alice's draft matches the filter in her own list, but facets only count published posts
+    self.client.force_authenticate(user=self.alice)
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('post-list') + '?category=tech&tags=django&facets=true&fields=id')
+    self.assertEqual(len(response.data['results']), 2)  # type: ignore
+    self.assertEqual(response.data['facets'], {  # type: ignore
+      'category': [{'value': 'Tech', 'count': 1}],
+      'tags': [{'value': 'django', 'count': 1}, {'value': 'python', 'count': 1}],
+      'author': [{'value': 'alice', 'count': 1}],
+    })
+    self.assertEqual(len([query for query in ctx.captured_queries if 'GROUP BY' in query['sql']]), 3)
+
+    response = self.client.get(reverse('post-list') + '?search=third&facets=true')
+    self.assertEqual(response.data['facets']['author'], [{'value': 'bob', 'count': 1}])  # type: ignore
+
+  def test_category_list_uses_the_stored_counts(self):
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('category-list') + '?facets=true')
+    self.assertEqual({c['name']: c['post_count'] for c in response.data['results']}, {'Life': 1, 'Tech': 2})  # type: ignore
+    self.assertEqual(response.data['facets']['author'], [{'value': 'alice', 'count': 2}, {'value': 'bob', 'count': 1}])  # type: ignore
+    self.assertFalse(any('"posts_post"' in query['sql'] for query in ctx.captured_queries))
+
+
+  @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'facet-tests'}})
+  def test_cached_category_facets_follow_tag_changes(self):
+    cache.clear()
+    url = reverse('category-list') + '?facets=true'
+    self.client.get(url)
+    self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    self.django.post_set.add(Post.objects.get(title='Third'))
+    response = self.client.get(url)
+    self.assertEqual(response['X-Cache'], 'MISS')
+    self.assertEqual(response.data['facets']['tags'][1], {'value': 'django', 'count': 2})  # type: ignore
+
+  def test_no_facets_by_default(self):
+    response = self.client.get(reverse('category-list'))
+    self.assertNotIn('facets', response.data)  # type: ignore
+
+
+class ConcurrentLikeTests(TransactionTestCase):
+  def test_parallel_toggles_keep_the_count_exact(self):
+    author = User.objects.create_user(username='author', password='password123')
+    post = Post.objects.create(title='Hot', content='Body', author=author, status=Post.Status.PUBLISHED)
+    users = [User.objects.create_user(username=f'fan{i}', password='password123') for i in range(8)]
+    #Every fan likes, the even ones unlike again, all at the same time
+    toggles = [user.pk for user in users] + [user.pk for user in users[::2]]
+    errors = []
+
+    def toggle(user_id):
+      try:
+        for attempt in range(50):
+          try:
+            return toggle_like(post.pk, user_id)
+          except OperationalError:
+            #SQLite allows one writer at a time; a locked-out toggle rolled back whole and retries
+            time.sleep(0.01)
+        errors.append(user_id)
+      except Exception as exc:
+        errors.append(exc)
+      finally:
+        connection.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+      list(pool.map(toggle, toggles))
+
+    self.assertEqual(errors, [])
+    post.refresh_from_db()
+    self.assertEqual(Like.objects.filter(post=post).count(), 4)
+    self.assertEqual(post.like_count, 4)
+
+
+class KeysetPaginationTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    base = timezone.now()
+    self.posts = []
+    for i in range(7):
+      #Pairs of posts share a timestamp so the id tie-breaker is exercised
+      self.posts.append(Post.objects.create(
+        title=f'Post {i}', content='Body', author=self.author,
+        status=Post.Status.PUBLISHED, published_at=base - timedelta(minutes=i // 2)
+      ))
+    self.expected = [post.id for post in sorted(self.posts, key=lambda p: (p.published_at, p.id), reverse=True)]
+
+  def walk(self, url):
+    ids = []
+    while url:
+      response = self.client.get(url)
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      ids += [post['id'] for post in response.data['results']]  # type: ignore
+      url = response.data['next']  # type: ignore
+    return ids
+
+  def test_pages_cover_every_post_once_in_order(self):
+    ids = self.walk(reverse('explore') + '?page_size=2')
+    self.assertEqual(ids, self.expected)
+
+  def test_cursor_is_stable_across_inserts(self):
+    first = self.client.get(reverse('explore') + '?page_size=3')
+    Post.objects.create(title='Newer', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+
+    ids = [post['id'] for post in first.data['results']]  # type: ignore
+    ids += self.walk(first.data['next'])  # type: ignore
+    self.assertEqual(ids, self.expected)
+
+  def test_previous_link_returns_prior_page(self):
+    first = self.client.get(reverse('explore') + '?page_size=3')
+    second = self.client.get(first.data['next'])  # type: ignore
+    back = self.client.get(second.data['previous'])  # type: ignore
+    self.assertEqual(back.data['results'], first.data['results'])  # type: ignore
+
+  def test_no_count_query(self):
+    with CaptureQueriesContext(connection) as ctx:
+      self.client.get(reverse('explore'))
+    self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+
+  def test_invalid_cursor_is_404(self):
+    response = self.client.get(reverse('explore') + '?cursor=garbage')
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+  def test_published_rows_always_have_a_cursor_key(self):
+    #A NULL published_at would encode an empty cursor the next page rejects
+    with self.assertRaises(IntegrityError), transaction.atomic():
+      Post.objects.filter(pk=self.posts[0].pk).update(published_at=None)
+    Post.objects.filter(pk=self.posts[0].pk).update(status=Post.Status.DRAFT, published_at=None)
+
+
+class TimelineTests(APITestCase):
+  def setUp(self):
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    self.client.force_authenticate(user=self.reader)
+
+  def publish(self, **kwargs):
+    kwargs.setdefault('author', self.author)
+    with self.captureOnCommitCallbacks(execute=True):
+      return Post.objects.create(title='Post', content='Body', status=Post.Status.PUBLISHED, **kwargs)
+
+  def feed_ids(self):
+    response = self.client.get(reverse('user-feed'))
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return [post['id'] for post in response.data['results']]  # type: ignore
+
+  def test_publish_fans_out_to_followers(self):
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    post = self.publish()
+    self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post=post).exists())
+    self.assertEqual(self.feed_ids(), [post.id])
+
+  def test_publishing_a_draft_fans_out(self):
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    draft = Post.objects.create(title='Draft', content='Body', author=self.author)
+    self.assertEqual(self.feed_ids(), [])
+
+    draft.status = Post.Status.PUBLISHED
+    with self.captureOnCommitCallbacks(execute=True):
+      draft.save()
+    self.assertEqual(self.feed_ids(), [draft.id])
+
+  def test_follow_backfills_and_unfollow_prunes(self):
+    followed_post = self.publish()
+    subscribed_post = self.publish(category=self.category)
+
+    with self.captureOnCommitCallbacks(execute=True):
+      follow = Follow.objects.create(follower=self.reader, followed_user=self.author)
+      CategorySubscription.objects.create(user=self.reader, category=self.category)
+    self.assertEqual(set(self.feed_ids()), {followed_post.id, subscribed_post.id})
+
+    with self.captureOnCommitCallbacks(execute=True):
+      follow.delete()
+    #Still reaches the reader through the category subscription
+    self.assertEqual(self.feed_ids(), [subscribed_post.id])
+
+  def test_unpublish_removes_entries(self):
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    post = self.publish()
+    post.status = Post.Status.DRAFT
+    post.save()
+    self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+
+  def test_category_moves_and_redates_update_entries(self):
+    other = Category.objects.create(name='Art')
+    subscriber = User.objects.create_user(username='subscriber', password='password123')
+    CategorySubscription.objects.create(user=self.reader, category=self.category)
+    CategorySubscription.objects.create(user=subscriber, category=other)
+    post = self.publish(category=self.category)
+    self.assertEqual(list(TimelineEntry.objects.filter(post=post).values_list('user_id', flat=True)), [self.reader.pk])
+
+    post.category = other
+    with self.captureOnCommitCallbacks(execute=True):
+      post.save()
+    self.assertEqual(list(TimelineEntry.objects.filter(post=post).values_list('user_id', flat=True)), [subscriber.pk])
+
+    post.published_at = timezone.now() - timedelta(days=3)
+    post.save()
+    self.assertEqual(TimelineEntry.objects.get(post=post).published_at, post.published_at)
+
+  def test_rebuild_command_pages_through_relations(self):
+    readers = [User.objects.create_user(username=f'follower{i}', password='password123') for i in range(5)]
+    post = self.publish(category=self.category)
+    Follow.objects.bulk_create([Follow(follower=reader, followed_user=self.author) for reader in readers])
+    CategorySubscription.objects.bulk_create([CategorySubscription(user=self.reader, category=self.category)])
+
+    with mock.patch('posts.management.commands.rebuild_timelines.BATCH_SIZE', 2):
+      call_command('rebuild_timelines', stdout=StringIO())
+    self.assertEqual(
+      set(TimelineEntry.objects.filter(post=post).values_list('user_id', flat=True)), {self.reader.pk} | {r.pk for r in readers}
+    )
+
+  @override_settings(FEED_FANOUT_FOLLOWER_LIMIT=0)
+  def test_high_fanout_authors_are_merged_at_read_time(self):
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    post = self.publish()
+    self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+    self.assertEqual(self.feed_ids(), [post.id])
+
+
+@override_settings(LEADERBOARD_SIZE=2)
+class LeaderboardTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.readers = [User.objects.create_user(username=f'reader{i}', password='password123') for i in range(3)]
+
+  def publish(self, title, **kwargs):
+    with self.captureOnCommitCallbacks(execute=True):
+      return Post.objects.create(title=title, content='Body', author=self.author, status=Post.Status.PUBLISHED, **kwargs)
+
+  def like(self, post, readers):
+    for reader in readers:
+      self.client.force_authenticate(user=reader)
+      with self.captureOnCommitCallbacks(execute=True):
+        self.client.post(reverse('post-like', kwargs={'pk': post.pk}))
+
+  def top(self, **params):
+    response = self.client.get(reverse('top-posts'), params)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return [post['title'] for post in response.data['results']]  # type: ignore
+
+  def test_likes_board_is_maintained_incrementally(self):
+    quiet, popular, viral = self.publish('quiet'), self.publish('popular'), self.publish('viral')
+    self.like(popular, self.readers[:2])
+    self.like(viral, self.readers)
+
+    self.assertEqual(self.top(sort_by='likes'), ['viral', 'popular'])
+    self.assertEqual(LeaderboardEntry.objects.filter(metric='likes', window='all').count(), 2)
+
+  def test_engagement_updates_every_board_in_fixed_queries(self):
+    posts = [self.publish(f'post {i}') for i in range(3)]
+    for likes, post in enumerate(posts, 1):
+      Post.objects.filter(pk=post.pk).update(like_count=likes)
+      leaderboards.record_engagement(post.pk)
+    self.assertEqual(self.top(sort_by='likes'), ['post 2', 'post 1'])
+
+    #Can't enter the full boards: a single read after the post's own
+    Post.objects.filter(pk=posts[0].pk).update(like_count=2)
+    with self.assertNumQueries(2):
+      leaderboards.record_engagement(posts[0].pk)
+
+    #Enters every board, pushing the last place off, with the same queries for all nine boards
+    Post.objects.filter(pk=posts[0].pk).update(like_count=10, rating_count=1, rating_sum=5)
+    with CaptureQueriesContext(connection) as ctx:
+      leaderboards.record_engagement(posts[0].pk)
+    self.assertLessEqual(len([q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]), 4)
+    self.assertEqual(self.top(sort_by='likes'), ['post 0', 'post 2'])
+    self.assertEqual(self.top(sort_by='rating'), ['post 0'])
+    for metric, window in LeaderboardEntry.objects.values_list('metric', 'window').distinct():
+      self.assertLessEqual(LeaderboardEntry.objects.filter(metric=metric, window=window).count(), 2)
+
+  def test_drafts_never_rank(self):
+    draft = Post.objects.create(title='draft', content='Body', author=self.author, like_count=50)
+    leaderboards.record_engagement(draft.pk)
+    leaderboards.rebuild()
+    self.assertEqual(self.top(), [])
+
+  def test_rating_board_uses_bayesian_average(self):
+    one_vote = self.publish('one vote')
+    many_votes = self.publish('many votes')
+    Post.objects.filter(pk=one_vote.pk).update(rating_count=1, rating_sum=5)
+    Post.objects.filter(pk=many_votes.pk).update(rating_count=40, rating_sum=190)
+
+    leaderboards.rebuild()
+    self.assertEqual(self.top(sort_by='rating'), ['many votes', 'one vote'])
+
+  def test_windows_exclude_older_posts(self):
+    self.publish('old', published_at=timezone.now() - timedelta(days=3))
+    self.publish('new')
+    leaderboards.rebuild()
+
+    self.assertEqual(self.top(window='24h'), ['new'])
+    self.assertEqual(set(self.top(window='7d')), {'old', 'new'})
+
+  def test_trending_prefers_recent_engagement(self):
+    old = self.publish('old', published_at=timezone.now() - timedelta(days=2))
+    new = self.publish('new')
+    Post.objects.filter(pk=old.pk).update(like_count=20)
+    Post.objects.filter(pk=new.pk).update(like_count=5)
+
+    leaderboards.rebuild()
+    self.assertEqual(self.top(sort_by='trending'), ['new', 'old'])
+
+  def test_invalid_sort_is_rejected(self):
+    response = self.client.get(reverse('top-posts'), {'sort_by': 'views'})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SearchIndexTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.django = Tag.objects.create(name='django')
+
+  def create(self, title, content='Body', **kwargs):
+    return Post.objects.create(title=title, content=content, author=self.author, status=Post.Status.PUBLISHED, **kwargs)
+
+  def search(self, url, term):
+    response = self.client.get(url, {'search': term})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return [post['title'] for post in response.data['results']]  # type: ignore
+
+  def test_matches_are_ranked_by_relevance(self):
+    self.create('Cooking pasta', 'Mentions serializers once')
+    self.create('Serializers in depth', 'All about serializers and serializers')
+    self.create('Unrelated')
+
+    self.assertEqual(self.search(reverse('explore'), 'serializers'), ['Serializers in depth', 'Cooking pasta'])
+
+  def test_tag_changes_are_indexed_without_duplicates(self):
+    post = self.create('Tagged')
+    post.tags.add(self.django, Tag.objects.create(name='djangorest'))
+
+    self.assertEqual(self.search(reverse('post-list'), 'django'), ['Tagged'])
+
+    post.tags.clear()
+    self.assertEqual(self.search(reverse('post-list'), 'django'), [])
+
+  def test_content_edits_and_deletes_are_indexed(self):
+    post = self.create('Edited', 'first draft')
+    post.content = 'final words'
+    post.save()
+    self.assertEqual(self.search(reverse('explore'), 'final'), ['Edited'])
+
+    post.delete()
+    self.assertEqual(self.search(reverse('explore'), 'final'), [])
+
+  def test_search_syntax_is_escaped(self):
+    self.create('Quotes')
+    self.assertEqual(self.search(reverse('explore'), '"AND OR*('), [])
+
+  def test_rebuild_command(self):
+    post = self.create('Rebuilt')
+    get_search_backend().remove_post(post.id)
+    self.assertEqual(self.search(reverse('explore'), 'rebuilt'), [])
+
+    call_command('rebuild_search_index', stdout=StringIO())
+    self.assertEqual(self.search(reverse('explore'), 'rebuilt'), ['Rebuilt'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(APITestCase):
+  #Lookup tables that stay small enough for a scan to be the right plan
+  SMALL_TABLES = {'posts_category', 'posts_tag'}
+
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    self.post = Post.objects.create(title='Plan', content='Body', author=self.author, category=self.category, status=Post.Status.PUBLISHED)
+    Post.objects.create(title='Draft', content='Body', author=self.reader)
+    Comment.objects.create(post=self.post, author=self.reader, content='Comment')
+
+  def full_scans(self, url, user=None):
+    self.client.force_authenticate(user=user)
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(url)
+    self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+
+    scans = []
+    for query in ctx.captured_queries:
+      if not query['sql'].startswith('SELECT'):
+        continue
+      with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+        plan = [row[3] for row in cursor.fetchall()]
+      #Sliced prefetches (ROW_NUMBER() per parent) scan their own derived table,
+      #whose rows were already read through an index
+      windowed = '"qualify"' in query['sql']
+      for step in plan:
+        #'SCAN t' reads every row of t; FTS lookups show up as 'SCAN ... VIRTUAL TABLE'
+        if not step.startswith('SCAN ') or 'VIRTUAL TABLE' in step:
+          continue
+        table = step.split()[1]
+        if table in self.SMALL_TABLES or (windowed and (table == 'qualify' or table.startswith('(subquery-'))):
+          continue
+        scans.append(f"{step}\n    in: {query['sql']}")
+    return scans
+
+  def test_endpoints_use_indexes(self):
+    endpoints = [
+      (reverse('post-list'), None),
+      (reverse('post-list'), self.reader),
+      (reverse('post-list') + '?search=plan', self.reader),
+      (reverse('explore'), None),
+      (reverse('user-feed'), self.reader),
+      (reverse('top-posts') + '?window=7d', None),
+      (reverse('category-list'), None),
+      (reverse('category-posts', kwargs={'category_name': 'Tech'}), None),
+      (reverse('my-drafts'), self.reader),
+      (reverse('post-detail', kwargs={'pk': self.post.pk}), None),
+      (reverse('post-comments', kwargs={'post_pk': self.post.pk}), None),
+      (reverse('profile-detail', kwargs={'username': 'author'}), None),
+      (reverse('post-list') + '?published_after=2020-01-01&published_before=2030-12-31&ordering=-published_at', None),
+      (reverse('archive'), None),
+      (reverse('archive') + '?category=Tech', None),
+      (reverse('post-list') + '?facets=true', None),
+      (reverse('category-list') + '?facets=true', None),
+    ]
+    for url, user in endpoints:
+      with self.subTest(url=url, authenticated=user is not None):
+        scans = self.full_scans(url, user)
+        self.assertFalse(scans, 'Full table scan:\n' + '\n'.join(scans))
+
+
+class QueryBudgetTests(APITestCase):
+  """
+  Every endpoint has a fixed query budget. Each one is requested twice with payloads
+  of different sizes (page sizes, or a small and a large object), so a query per
+  row fails even while the total still fits the budget. The batch engagement and
+  archive endpoints have their own query tests (BatchEngagementTests, QueryPlanTests).
+  """
+  @classmethod
+  def setUpTestData(cls):
+    now = timezone.now()
+    users = User.objects.bulk_create([User(username=f'user{i}') for i in range(40)])
+    Profile.objects.bulk_create([Profile(user=user) for user in users])
+    #user1 only writes drafts (every tenth post), user2 only published posts
+    cls.reader, cls.drafter, cls.prolific, cls.quiet = users[0], users[1], users[2], users[39]
+
+    categories = Category.objects.bulk_create([Category(name=f'Category {i}') for i in range(5)])
+    tags = Tag.objects.bulk_create([Tag(name=f'tag{i}') for i in range(20)])
+
+    posts = []
+    for i in range(300):
+      post = Post(
+        title=f'Post {i}', content=f'# Post {i}\n\nSome *markdown* body.',
+        author=users[1 + i % 30], category=categories[i % 5],
+        status=Post.Status.DRAFT if i % 10 == 0 else Post.Status.PUBLISHED,
+        published_at=None if i % 10 == 0 else now - timedelta(minutes=i),
+      )
+      post.refresh_rendered_content()
+      posts.append(post)
+    #A single post, so the small profile still exercises every prefetch
+    posts.append(Post(
+      title='Quiet', content='Quiet', author=cls.quiet, status=Post.Status.PUBLISHED, published_at=now - timedelta(days=1)
+    ))
+    posts[-1].refresh_rendered_content()
+    posts = Post.objects.bulk_create(posts)
+    cls.busy_post, cls.bare_post = posts[1], posts[2]
+
+    Post.tags.through.objects.bulk_create([
+      Post.tags.through(post_id=post.id, tag_id=tags[(i + n) % 20].id)
+      for i, post in enumerate(posts) for n in range(3)
+    ])
+    Post.likes.through.objects.bulk_create([
+      Post.likes.through(post_id=post.id, user_id=users[(i + n) % 40].id)
+      for i, post in enumerate(posts) for n in range(i % 7)
+    ])
+    Rating.objects.bulk_create([
+      Rating(post=post, user=users[(i + n) % 40], score=1 + (i + n) % 5)
+      for i, post in enumerate(posts) for n in range(i % 4)
+    ])
+    comments = [
+      Comment(post=post, author=users[(i + n) % 40], content=f'Comment {n}')
+      for i, post in enumerate(posts) for n in range(i % 3)
+    ]
+    comments += [Comment(post=cls.busy_post, author=users[n], content='More') for n in range(30)]
+    Comment.objects.bulk_create(comments)
+
+    Follow.objects.bulk_create([
+      Follow(follower=follower, followed_user=followed)
+      for f, follower in enumerate(users[:30]) for followed in users[f + 1:f + 11]
+    ])
+    CategorySubscription.objects.create(user=cls.reader, category=categories[0])
+
+    #bulk_create skips the signals, so derive everything they would have maintained
+    for command in ['reconcile_post_counters', 'rebuild_timelines', 'rebuild_leaderboards', 'rebuild_search_index']:
+      call_command(command, stdout=StringIO())
+
+  def capture(self, url, user, method='get', data=None, expected=status.HTTP_200_OK):
+    self.client.force_authenticate(user=user)
+    #TestCase never commits, so on_commit work (eager Celery tasks) runs here as it would in the request
+    with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+      if method == 'get':
+        response = self.client.get(url)
+      else:
+        response = getattr(self.client, method)(url, data, format='json')
+    self.assertEqual(response.status_code, expected, url)
+    return [query['sql'] for query in ctx.captured_queries]
+
+  def assertQueryBudget(self, small_url, large_url, budget, user=None, **request):
+    small, large = self.capture(small_url, user, **request), self.capture(large_url, user, **request)
+    self.assertBudget(small_url, small, large_url, large, budget)
+
+  def assertBudget(self, small_url, small, large_url, large, budget):
+    listing = '\n'.join(f'  {n}. {sql}' for n, sql in enumerate(large, 1))
+    self.assertLessEqual(len(large), budget, f'{large_url} ran {len(large)} queries, budget is {budget}:\n{listing}')
+    self.assertEqual(
+      len(small), len(large),
+      f'{large_url} ran {len(large)} queries, {small_url} ran {len(small)}; something queries per row:\n{listing}'
+    )
+
+  def test_list_endpoints(self):
+    endpoints = [
+      (reverse('post-list'), None, 3),
+      (reverse('post-list'), self.reader, 4),
+      (reverse('post-list') + '?search=markdown', self.reader, 5),
+      (reverse('explore'), None, 3),
+      (reverse('explore') + '?search=post', None, 4),
+      (reverse('user-feed'), self.reader, 5),
+      (reverse('top-posts') + '?sort_by=rating', None, 4),
+      (reverse('category-list'), None, 2),
+      (reverse('category-posts', kwargs={'category_name': 'Category 1'}), None, 4),
+      (reverse('my-drafts'), self.drafter, 5),
+      #+1 for the conditional GET validators (ETag / Last-Modified)
+      (reverse('post-comments', kwargs={'post_pk': self.busy_post.pk}), None, 3),
+    ]
+    for url, user, budget in endpoints:
+      separator = '&' if '?' in url else '?'
+      with self.subTest(url=url, authenticated=user is not None):
+        self.assertQueryBudget(f'{url}{separator}page_size=5', f'{url}{separator}page_size=20', budget, user)
+
+  def test_detail_endpoints(self):
+    #Both include one query for the conditional GET validators
+    self.assertQueryBudget(
+      reverse('post-detail', kwargs={'pk': self.bare_post.pk}),
+      reverse('post-detail', kwargs={'pk': self.busy_post.pk}),
+      5, self.reader
+    )
+    self.assertQueryBudget(
+      reverse('profile-detail', kwargs={'username': self.quiet.username}),
+      reverse('profile-detail', kwargs={'username': self.prolific.username}),
+      8, self.reader
+    )
+
+  def test_user_endpoints(self):
+    #'/api/' is answered by api_root before users.urls is reached, so the list view is called directly
+    view, factory = UserListView.as_view(), APIRequestFactory()
+    sizes = []
+    for page_size in (5, 20):
+      with CaptureQueriesContext(connection) as ctx:
+        response = view(factory.get('/api/', {'page_size': page_size}))
+      self.assertEqual((response.status_code, len(response.data['results'])), (200, page_size))  # type: ignore
+      sizes.append([query['sql'] for query in ctx.captured_queries])
+    self.assertBudget('user-list?page_size=5', sizes[0], 'user-list?page_size=20', sizes[1], 2)
+
+    #Fresh instances, so the profile isn't already cached on the user
+    quiet, prolific = User.objects.get(pk=self.quiet.pk), User.objects.get(pk=self.prolific.pk)
+    self.assertBudget(
+      'user-profile (quiet)', self.capture(reverse('user-profile'), quiet),
+      'user-profile (prolific)', self.capture(reverse('user-profile'), prolific), 1
+    )
+
+  def test_comment_detail(self):
+    #+1 for the conditional GET validators
+    short, long = Comment.objects.bulk_create([
+      Comment(post=self.bare_post, author=self.reader, content='Short'),
+      Comment(post=self.busy_post, author=self.prolific, content='Long ' * 500),
+    ])
+    self.assertQueryBudget(
+      reverse('comment-detail', kwargs={'pk': short.pk}), reverse('comment-detail', kwargs={'pk': long.pk}), 2
+    )
+
+  def test_write_endpoints(self):
+    """
+    Writes include their signal side effects: search index, archive and facet
+    counts, outbox events, counters and cache invalidation, and the fan-out and
+    leaderboard tasks that CELERY_TASK_ALWAYS_EAGER runs on commit, in the request.
+    """
+    #Empty boards, so both posts enter them the same way; pushing the last place
+    #off a full board adds one DELETE, included in the budgets
+    LeaderboardEntry.objects.all().delete()
+    post = {'title': 'New', 'content': 'Body', 'category': 'Category 0', 'status': Post.Status.PUBLISHED}
+    self.assertBudget(
+      'post-list (1 tag)', self.capture(reverse('post-list'), self.reader, 'post', {**post, 'tags': ['tag1']}, 201),
+      'post-list (5 tags)', self.capture(reverse('post-list'), self.reader, 'post', {**post, 'tags': [f'tag{i}' for i in range(5)]}, 201),
+      42
+    )
+
+    #(method, url name, its post id kwarg, data, user (None: the post's author), status, budget)
+    writes = [
+      ('patch', 'post-detail', 'pk', {'title': 'Edited'}, None, 200, 15),
+      ('post', 'post-comments', 'post_pk', {'content': 'Hi'}, self.reader, 201, 10),
+      ('post', 'post-like', 'pk', None, self.reader, 201, 15),
+      ('post', 'post-rate', 'pk', {'score': 4}, self.reader, 200, 19),
+    ]
+    for method, name, kwarg, data, user, expected, budget in writes:
+      with self.subTest(name=name, method=method):
+        results = []
+        for post in (self.bare_post, self.busy_post):
+          url = reverse(name, kwargs={kwarg: post.pk})
+          results += [url, self.capture(url, user or post.author, method, data, expected)]
+        self.assertBudget(*results, budget)
+
+    #Posts 0 and 10, by authors with one follower and with ten
+    results = []
+    for draft in Post.objects.filter(status=Post.Status.DRAFT).order_by('pk')[:2]:
+      url = reverse('post-publish', kwargs={'pk': draft.pk})
+      results += [url, self.capture(url, draft.author, 'post')]
+    self.assertBudget(*results, 33)
+
+  def test_profile_hides_drafts(self):
+    self.client.force_authenticate(user=None)
+    response = self.client.get(reverse('profile-detail', kwargs={'username': self.prolific.username}))
+    statuses = {post['status'] for post in response.data['posts']}  # type: ignore
+    self.assertEqual(statuses, {Post.Status.PUBLISHED})
+
+
+class BenchmarkTests(APITestCase):
+  def setUp(self):
+    call_command('generate_synthetic_data', users=30, posts=60, seed=7, stdout=StringIO())
+
+  def test_generated_data_is_consistent(self):
+    self.assertEqual(User.objects.filter(username__startswith='synthetic').count(), 30)
+    self.assertEqual(Post.objects.count(), 60)
+    #Counters and follower counts are derived after the bulk inserts
+    for post in Post.objects.all():
+      self.assertEqual(post.like_count, post.likes.count())
+      self.assertEqual(post.comment_count, post.comments.count())
+    for profile in Profile.objects.all():
+      self.assertEqual(profile.follower_count, Follow.objects.filter(followed_user=profile.user).count())
+    self.assertTrue(Post.objects.exclude(content_html='').exists())
+    #The category and facet counts are read from the precomputed table
+    def by_value(counts):
+      return {facet: {row['value']: row['count'] for row in rows} for facet, rows in counts.items()}
+    with self.settings(FACET_LIMIT=1000):
+      published = by_value(facets.counts(Post.objects.filter(status=Post.Status.PUBLISHED)))
+      self.assertTrue(published['category'])
+      self.assertEqual(by_value(facets.counts()), published)
+    self.assertEqual(
+      sum(archive.months().values_list('post_count', flat=True)),
+      Post.objects.filter(status=Post.Status.PUBLISHED).count()
+    )
+
+  def test_prefix_must_be_unused(self):
+    with self.assertRaises(CommandError):
+      call_command('generate_synthetic_data', users=5, posts=5, stdout=StringIO())
+
+  def test_report_and_comparison(self):
+    before = benchmark.dataset_summary()
+    out = StringIO()
+    call_command('run_benchmarks', requests=3, warmup=1, stdout=out)
+    report = json.loads(out.getvalue())
+    self.assertEqual(report['dataset']['posts'], 60)
+    for name in ['posts_list', 'feed', 'explore', 'top_likes', 'profile', 'like', 'rate']:
+      self.assertEqual(report['scenarios'][name]['errors'], 0, name)
+      self.assertLessEqual(report['scenarios'][name]['p50_ms'], report['scenarios'][name]['p99_ms'])
+
+    #Writes are rolled back, so the dataset is unchanged
+    self.assertEqual(benchmark.dataset_summary(), before)
+
+    slower = json.loads(json.dumps(report))
+    slower['scenarios']['feed']['p95_ms'] *= 2
+    rows = {row['scenario']: row for row in benchmark.compare(report, slower)}
+    self.assertTrue(rows['feed']['regression'])
+    self.assertFalse(rows['explore']['regression'])
+
+
+class RequestTimingTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.post = Post.objects.create(title='Timed', content='# Timed', author=self.author, status=Post.Status.PUBLISHED)
+    #Stale render, so serving the post renders Markdown
+    Post.objects.filter(pk=self.post.pk).update(render_version='')
+    self.url = reverse('post-detail', kwargs={'pk': self.post.pk})
+
+  def test_server_timing_header(self):
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(self.url)
+    metrics = {part.split(';')[0]: part for part in response['Server-Timing'].split(', ')}
+    self.assertEqual(set(metrics), {'db', 'serialize', 'markdown', 'view', 'total'})
+    self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', metrics['db'])
+    duration = {name: float(part.split('dur=')[1].split(';')[0]) for name, part in metrics.items()}
+    self.assertLessEqual(duration['view'], duration['total'])
+
+  def test_log_line(self):
+    with self.assertLogs('blogging_platform_api.timing', 'INFO') as logs:
+      self.client.get(self.url)
+    record = json.loads(logs.records[0].getMessage())
+    self.assertEqual(record['path'], self.url)
+    self.assertEqual(record['status'], 200)
+    self.assertGreater(record['queries'], 0)
+    self.assertIn('markdown_ms', record)
+    self.assertIn('view_ms', record)
+    self.assertNotIn('top_queries', record)
+
+  @override_settings(REQUEST_TIMING={'SLOW_REQUEST_MS': 0, 'TOP_QUERIES': 2})
+  def test_slow_requests_log_top_queries_with_origin(self):
+    with self.assertLogs('blogging_platform_api.timing', 'WARNING') as logs:
+      self.client.get(reverse('post-list'))
+    record = json.loads(logs.records[0].getMessage())
+    self.assertTrue(record['slow'])
+    self.assertEqual(len(record['top_queries']), 2)
+    origins = [frame for query in record['top_queries'] for frame in query['origin']]
+    self.assertTrue(any(frame.startswith('posts/') for frame in origins), origins)
+
+  @override_settings(REQUEST_TIMING={'SAMPLE_RATE': 0})
+  def test_unsampled_requests_are_untouched(self):
+    response = self.client.get(self.url)
+    self.assertFalse(response.has_header('Server-Timing'))
+    #Only counted, for the metrics
+    self.assertGreater(response.wsgi_request.timing.query_count, 0)
+    self.assertEqual(response.wsgi_request.timing.statements, {})
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.post = Post.objects.create(title='Measured', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+
+  def scrape(self):
+    response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+    self.assertEqual(response.status_code, 200)
+    samples = {}
+    for line in response.content.decode().splitlines():
+      if line and not line.startswith('#'):
+        series, value = line.rsplit(' ', 1)
+        samples[series] = float(value)
+    return samples
+
+  def test_request_metrics_by_route(self):
+    before = self.scrape()
+    self.client.get(reverse('post-detail', kwargs={'pk': self.post.pk}))
+    after = self.scrape()
+
+    series = 'http_requests_total{method="GET",route="api/<int:pk>/",status="200"}'
+    self.assertEqual(after[series] - before.get(series, 0), 1)
+    count = 'http_request_duration_seconds_count{method="GET",route="api/<int:pk>/"}'
+    self.assertEqual(after[count] - before.get(count, 0), 1)
+    self.assertEqual(after['http_request_duration_seconds_bucket{method="GET",route="api/<int:pk>/",le="+Inf"}'], after[count])
+    self.assertGreater(after['http_request_db_queries_total{route="api/<int:pk>/"}'], 0)
+    self.assertGreater(after['cache_requests_total{cache="post_render",result="hit"}'], 0)
+
+  def test_celery_task_metrics(self):
+    leaderboards.rebuild()
+    before = self.scrape()
+    from .tasks import rebuild_leaderboards
+    rebuild_leaderboards.delay()  # type: ignore
+    after = self.scrape()
+    series = 'celery_task_duration_seconds_count{task="posts.tasks.rebuild_leaderboards"}'
+    self.assertEqual(after[series] - before.get(series, 0), 1)
+    self.assertIn('celery_tasks_total{state="SUCCESS",task="posts.tasks.rebuild_leaderboards"}', after)
+
+  def test_values_from_other_processes_are_merged(self):
+    with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+      with open(os.path.join(directory, 'metrics-999999.json'), 'w') as handle:
+        json.dump([['cache_requests_total', [['cache', 'other'], ['result', 'miss']], 7]], handle)
+      self.client.get(reverse('post-list'))
+      samples = self.scrape()
+      self.assertEqual(samples['cache_requests_total{cache="other",result="miss"}'], 7)
+      self.assertIn('http_requests_total{method="GET",route="api/posts/",status="200"}', samples)
+      self.assertTrue(os.path.exists(os.path.join(directory, f'metrics-{os.getpid()}.json')))
+
+  def test_token_or_staff_is_required(self):
+    self.assertEqual(self.client.get('/metrics/').status_code, 403)
+    self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+    self.client.force_login(self.author)
+    self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+    staff = User.objects.create_user(username='staff', password='password123', is_staff=True)
+    self.client.force_login(staff)
+    self.assertEqual(self.client.get('/metrics/').status_code, 200)
+    with override_settings(METRICS_TOKEN=None):
+      self.client.logout()
+      self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'response-cache-tests'}})
+class ResponseCacheTests(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    self.category = Category.objects.create(name='Django')
+    self.post = Post.objects.create(
+      title='Cached', content='Body', author=self.author, category=self.category, status=Post.Status.PUBLISHED
+    )
+
+  def get(self, url):
+    response = self.client.get(url)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return response
+
+  def test_second_anonymous_request_is_served_from_cache(self):
+    url = reverse('explore')
+    self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.get(url)
+    self.assertEqual(response['X-Cache'], 'HIT')
+    self.assertEqual(len(ctx.captured_queries), 0)
+    self.assertEqual(response.data['results'][0]['id'], self.post.id)  # type: ignore
+
+  def test_query_parameter_order_shares_an_entry(self):
+    self.get(reverse('explore') + '?page_size=5&search=cached')
+    self.assertEqual(self.get(reverse('explore') + '?search=cached&page_size=5')['X-Cache'], 'HIT')
+    self.assertEqual(self.get(reverse('explore') + '?page_size=6&search=cached')['X-Cache'], 'MISS')
+
+  def test_authenticated_requests_bypass_the_cache(self):
+    self.client.force_authenticate(user=self.reader)
+    self.get(reverse('explore'))
+    response = self.get(reverse('explore'))
+    self.assertNotIn('X-Cache', response)
+
+  def test_like_invalidates_listings_and_profile(self):
+    urls = [
+      reverse('explore'),
+      reverse('category-posts', kwargs={'category_name': 'django'}),
+      reverse('profile-detail', kwargs={'username': 'author'}),
+    ]
+    for url in urls:
+      self.get(url)
+
+    self.client.force_authenticate(user=self.reader)
+    self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+    self.client.force_authenticate(user=None)
+
+    for url in urls:
+      response = self.get(url)
+      self.assertEqual(response['X-Cache'], 'MISS', url)
+    self.assertEqual(self.get(urls[0]).data['results'][0]['likes_count'], 1)  # type: ignore
+
+  def test_comment_and_rating_invalidate(self):
+    url = reverse('explore')
+    self.get(url)
+    Comment.objects.create(post=self.post, author=self.reader, content='Nice')
+    self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+
+    self.client.force_authenticate(user=self.reader)
+    self.client.post(reverse('post-rate', kwargs={'pk': self.post.pk}), {'score': 4}, format='json')
+    self.client.force_authenticate(user=None)
+    self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+
+  def test_publishing_and_moving_posts_invalidate_categories(self):
+    other = Category.objects.create(name='Python')
+    old_url = reverse('category-posts', kwargs={'category_name': 'Django'})
+    new_url = reverse('category-posts', kwargs={'category_name': 'Python'})
+    for url in (old_url, new_url, reverse('category-list')):
+      self.get(url)
+
+    self.post.category = other
+    self.post.save()
+
+    self.assertEqual(self.get(old_url).data['results'], [])  # type: ignore
+    self.assertEqual(self.get(new_url).data['results'][0]['id'], self.post.id)  # type: ignore
+    counts = {row['name']: row['post_count'] for row in self.get(reverse('category-list')).data['results']}  # type: ignore
+    self.assertEqual(counts, {'Django': 0, 'Python': 1})
+
+  def test_draft_changes_keep_the_cache(self):
+    url = reverse('explore')
+    self.get(url)
+    draft = Post.objects.create(title='Draft', content='Body', author=self.author, status=Post.Status.DRAFT)
+    draft.title = 'Still a draft'
+    draft.save()
+    self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+
+    draft.status = Post.Status.PUBLISHED
+    draft.save()
+    self.assertEqual(len(self.get(url).data['results']), 2)  # type: ignore
+
+  def test_follow_invalidates_both_profiles(self):
+    urls = [reverse('profile-detail', kwargs={'username': name}) for name in ('author', 'reader')]
+    for url in urls:
+      self.get(url)
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    for url in urls:
+      self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+
+  def test_leaderboard_changes_invalidate_top(self):
+    url = reverse('top-posts')
+    self.get(url)
+    self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+    leaderboards.rebuild()
+    self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+
+  def test_outdated_entry_is_served_while_another_request_refreshes(self):
+    url = reverse('explore')
+    self.get(url)
+    Post.objects.filter(pk=self.post.pk).update(title='Renamed')
+    self.post.refresh_from_db()
+    self.post.save()
+
+    #Another request holds the refresh lock
+    cache.add(request_key(Request(APIRequestFactory().get(url))) + ':lock', 1)
+    stale = self.get(url)
+    self.assertEqual(stale['X-Cache'], 'STALE')
+    self.assertEqual(stale.data['results'][0]['title'], 'Cached')  # type: ignore
+
+
+class ConditionalRequestTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    self.post = Post.objects.create(title='Polled', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+    self.comment = Comment.objects.create(post=self.post, author=self.reader, content='First')
+
+  def revalidate(self, url, response):
+    return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+  def test_unchanged_post_is_not_serialized_again(self):
+    url = reverse('post-detail', kwargs={'pk': self.post.pk})
+    first = self.client.get(url)
+    self.assertIn('ETag', first)
+    self.assertIn('Last-Modified', first)
+
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.revalidate(url, first)
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    self.assertEqual(response['ETag'], first['ETag'])
+    self.assertEqual(len(ctx.captured_queries), 1)
+
+    response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+  def test_engagement_and_comment_edits_change_the_post_etag(self):
+    url = reverse('post-detail', kwargs={'pk': self.post.pk})
+    first = self.client.get(url)
+
+    self.client.force_authenticate(user=self.reader)
+    self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+    self.client.force_authenticate(user=None)
+    second = self.revalidate(url, first)
+    self.assertEqual(second.status_code, status.HTTP_200_OK)
+    self.assertEqual(second.data['likes_count'], 1)  # type: ignore
+
+    self.comment.content = 'Edited'
+    self.comment.save()
+    self.assertEqual(self.revalidate(url, second).status_code, status.HTTP_200_OK)
+
+  def test_etag_differs_per_viewer(self):
+    url = reverse('post-detail', kwargs={'pk': self.post.pk})
+    anonymous = self.client.get(url)
+    self.client.force_authenticate(user=self.reader)
+    self.assertEqual(self.revalidate(url, anonymous).status_code, status.HTTP_200_OK)
+
+  def test_if_match_guards_post_updates(self):
+    url = reverse('post-detail', kwargs={'pk': self.post.pk})
+    self.client.force_authenticate(user=self.author)
+    fetched = self.client.get(url)
+
+    response = self.client.patch(url, {'title': 'Mine'}, format='json', HTTP_IF_MATCH=fetched['ETag'])
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertNotEqual(response['ETag'], fetched['ETag'])
+
+    #A second writer still holding the old ETag lost the race
+    response = self.client.patch(url, {'title': 'Theirs'}, format='json', HTTP_IF_MATCH=fetched['ETag'])
+    self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.title, 'Mine')
+
+  def test_if_match_guards_comment_updates(self):
+    url = reverse('comment-detail', kwargs={'pk': self.comment.pk})
+    self.client.force_authenticate(user=self.reader)
+    fetched = self.client.get(url)
+    Comment.objects.get(pk=self.comment.pk).save()
+
+    response = self.client.patch(url, {'content': 'Late'}, format='json', HTTP_IF_MATCH=fetched['ETag'])
+    self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+    response = self.client.patch(url, {'content': 'Late'}, format='json', HTTP_IF_MATCH=self.client.get(url)['ETag'])
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+  def test_comment_collection_fingerprint(self):
+    url = reverse('post-comments', kwargs={'post_pk': self.post.pk})
+    first = self.client.get(url)
+    self.assertEqual(self.revalidate(url, first).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    Comment.objects.create(post=self.post, author=self.author, content='Second')
+    second = self.revalidate(url, first)
+    self.assertEqual(second.status_code, status.HTTP_200_OK)
+
+    self.comment.delete()
+    self.assertEqual(self.revalidate(url, second).status_code, status.HTTP_200_OK)
+
+  def test_profile_revalidation(self):
+    url = reverse('profile-detail', kwargs={'username': 'author'})
+    first = self.client.get(url)
+    self.assertEqual(self.revalidate(url, first).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    second = self.revalidate(url, first)
+    self.assertEqual(second.status_code, status.HTTP_200_OK)
+
+    Post.objects.filter(pk=self.post.pk).get().delete()
+    self.assertEqual(self.revalidate(url, second).status_code, status.HTTP_200_OK)
+
+
+class SparseFieldsTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    self.post = Post.objects.create(
+      title='Shaped', content='# Heading\n\n' + 'word ' * 100, author=self.author, status=Post.Status.PUBLISHED
+    )
+    self.post.tags.add(Tag.objects.create(name='django'))
+    Comment.objects.create(post=self.post, author=self.reader, content='Nice')
+
+  def test_comments_are_only_sent_when_expanded(self):
+    default = self.client.get(reverse('explore')).data['results'][0]  # type: ignore
+    self.assertNotIn('comments', default)
+    self.assertTrue(default['snippet'].startswith('Heading'))
+    self.assertLessEqual(len(default['snippet']), PostSerializer.SNIPPET_LENGTH)
+
+    detail = reverse('post-detail', kwargs={'pk': self.post.pk})
+    expanded = self.client.get(detail + '?expand=comments').data  # type: ignore
+    self.assertEqual([comment['content'] for comment in expanded['comments']], ['Nice'])
+
+  def test_lists_never_expand_comments(self):
+    #A page of posts would nest every comment of every post; lists keep latest_comments
+    with CaptureQueriesContext(connection) as ctx:
+      listed = self.client.get(reverse('explore') + '?expand=comments').data['results'][0]  # type: ignore
+    self.assertNotIn('comments', listed)
+    self.assertEqual(len(listed['latest_comments']), 1)
+    self.assertEqual(len([q for q in ctx.captured_queries if '"posts_comment"' in q['sql']]), 1)
+
+  def test_fields_skips_unrequested_work(self):
+    self.client.force_authenticate(user=self.reader)
+    url = reverse('explore') + '?fields=id,title,snippet,likes_count'
+    with CaptureQueriesContext(connection) as ctx, mock.patch('posts.serializers.render_markdown') as render:
+      response = self.client.get(url)
+
+    self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'snippet', 'likes_count'})  # type: ignore
+    render.assert_not_called()
+    sql = '\n'.join(query['sql'] for query in ctx.captured_queries)
+    self.assertNotIn('"posts_like"', sql)
+    self.assertNotIn('posts_tag', sql)
+    self.assertNotIn('"posts_post"."content",', sql)
+
+  def test_exclude(self):
+    post = self.client.get(reverse('post-detail', kwargs={'pk': self.post.pk}) + '?exclude=content,content_html').data  # type: ignore
+    self.assertNotIn('content', post)
+    self.assertNotIn('content_html', post)
+    self.assertIn('title', post)
+
+  def test_nested_fields_on_profiles(self):
+    url = reverse('profile-detail', kwargs={'username': 'author'})
+    with CaptureQueriesContext(connection) as ctx:
+      profile = self.client.get(url + '?fields=username,posts.title,posts.tags').data  # type: ignore
+    self.assertEqual(set(profile), {'username', 'posts'})
+    self.assertEqual(profile['posts'], [{'title': 'Shaped', 'tags': ['django']}])
+    self.assertFalse(any('users_follow' in query['sql'] for query in ctx.captured_queries))
+
+    profile = self.client.get(url + '?expand=posts.comments').data  # type: ignore
+    self.assertNotIn('comments', profile['posts'][0])
+    self.assertIn('followers', profile)
+
+  def test_writes_ignore_sparse_fields(self):
+    self.client.force_authenticate(user=self.author)
+    url = reverse('post-detail', kwargs={'pk': self.post.pk}) + '?fields=title'
+    response = self.client.patch(url, {'content': 'Rewritten'}, format='json')
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.data['content'], 'Rewritten')  # type: ignore
+
+
+@override_settings(POST_LATEST_COMMENTS=2)
+class LatestCommentsTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.posts = [
+      Post.objects.create(title=f'Post {i}', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+      for i in range(3)
+    ]
+    for post in self.posts:
+      for i in range(4):
+        Comment.objects.create(post=post, author=self.author, content=f'{post.title} comment {i}')
+
+  def test_page_embeds_latest_comments_with_one_query(self):
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('explore'))
+
+    for post in response.data['results']:  # type: ignore
+      self.assertEqual(post['comment_count'], 4)
+      self.assertEqual(
+        [comment['content'] for comment in post['latest_comments']],
+        [f"{post['title']} comment 3", f"{post['title']} comment 2"]
+      )
+    comment_queries = [q['sql'] for q in ctx.captured_queries if 'FROM "posts_comment"' in q['sql']]
+    self.assertEqual(len(comment_queries), 1)
+
+  def test_single_post_without_prefetch(self):
+    data = PostSerializer(Post.objects.get(pk=self.posts[0].pk)).data
+    self.assertEqual(len(data['latest_comments']), 2)
+
+  def test_comment_list_is_cursor_paginated(self):
+    url = reverse('post-comments', kwargs={'post_pk': self.posts[0].pk})
+    first = self.client.get(url + '?page_size=3').data  # type: ignore
+    self.assertNotIn('count', first)
+    self.assertEqual(len(first['results']), 3)
+
+    second = self.client.get(first['next']).data  # type: ignore
+    contents = [c['content'] for c in first['results'] + second['results']]
+    self.assertEqual(contents, [f'Post 0 comment {i}' for i in (3, 2, 1, 0)])
+    self.assertIsNone(second['next'])
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', NOTIFICATION_BATCH_SIZE=2)
+class NotificationPipelineTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', email='author@example.com', password='password123')
+    self.category = Category.objects.create(name='Django')
+    self.readers = [
+      User.objects.create_user(username=f'reader{i}', email=f'reader{i}@example.com', password='password123')
+      for i in range(5)
+    ]
+    for reader in self.readers[:4]:
+      Follow.objects.create(follower=reader, followed_user=self.author)
+    #Follows the author and subscribes to the category, but is mailed once
+    CategorySubscription.objects.create(user=self.readers[0], category=self.category)
+    CategorySubscription.objects.create(user=self.readers[4], category=self.category)
+    Follow.objects.create(follower=User.objects.create_user(username='silent', password='password123'), followed_user=self.author)
+
+  def publish(self, **kwargs):
+    post = Post.objects.create(
+      title='News', content='Body', author=self.author, category=self.category, status=Post.Status.PUBLISHED, **kwargs
+    )
+    outbox.relay()
+    return post
+
+  def test_each_recipient_gets_one_private_message(self):
+    post = self.publish()
+    recipients = sorted(address for message in mail.outbox for address in message.to)
+    self.assertEqual(recipients, sorted(reader.email for reader in self.readers))
+    self.assertTrue(all(len(message.to) == 1 and not message.cc and not message.bcc for message in mail.outbox))
+    self.assertEqual(NotificationDelivery.objects.filter(post=post, sent_at__isnull=False).count(), 5)
+
+  def test_nothing_is_sent_by_the_request(self):
+    Post.objects.create(title='News', content='Body', author=self.author, category=self.category, status=Post.Status.PUBLISHED)
+    self.assertEqual(mail.outbox, [])
+    outbox.relay()
+    self.assertEqual(len(mail.outbox), 5)
+
+  def test_publishing_a_draft_notifies_once(self):
+    draft = Post.objects.create(title='Draft', content='Body', author=self.author, category=self.category)
+    outbox.relay()
+    self.assertEqual(mail.outbox, [])
+    draft.status = Post.Status.PUBLISHED
+    draft.save()
+    draft.title = 'Edited'
+    draft.save()
+    outbox.relay()
+    self.assertEqual(len(mail.outbox), 5)
+
+  def test_recipients_are_deduplicated_in_one_query(self):
+    post = Post.objects.create(title='Quiet', content='Body', author=self.author, category=self.category)
+    with CaptureQueriesContext(connection) as ctx:
+      ids = list(notifications.recipients(post).values_list('pk', flat=True))
+    self.assertEqual(ids, [reader.pk for reader in self.readers])
+    self.assertEqual(len(ctx.captured_queries), 1)
+
+  def test_failed_batches_retry_without_duplicates(self):
+    original = locmem.EmailBackend.send_messages
+    failures = []
+
+    def flaky(backend, messages):
+      #The mail server drops the connection on the second reader's first attempt
+      if messages[0].to == [self.readers[1].email] and not failures:
+        failures.append(messages[0].to)
+        raise ConnectionResetError('connection reset')
+      return original(backend, messages)
+
+    with mock.patch.object(locmem.EmailBackend, 'send_messages', autospec=True, side_effect=flaky):
+      post = self.publish()
+
+    self.assertEqual(len(failures), 1)
+    recipients = sorted(address for message in mail.outbox for address in message.to)
+    self.assertEqual(recipients, sorted(reader.email for reader in self.readers))
+
+    #Re-running the whole pipeline finds nobody left to mail
+    from .tasks import notify_subscribers
+    notify_subscribers.delay(post.pk)  # type: ignore
+    self.assertEqual(len(mail.outbox), 5)
+
+  def test_refused_recipients_are_recorded_and_skipped(self):
+    original = locmem.EmailBackend.send_messages
+    attempts = []
+
+    def refusing(backend, messages):
+      if messages[0].to == [self.readers[1].email]:
+        attempts.append(messages[0].to)
+        raise SMTPRecipientsRefused({self.readers[1].email: (550, b'No such user')})
+      return original(backend, messages)
+
+    with mock.patch.object(locmem.EmailBackend, 'send_messages', autospec=True, side_effect=refusing):
+      post = self.publish()
+      #Nobody after the bad address is held back, and the batch isn't retried
+      self.assertEqual(len(mail.outbox), 4)
+      self.assertEqual(len(attempts), 1)
+      delivery = NotificationDelivery.objects.get(post=post, user=self.readers[1])
+      self.assertIsNone(delivery.sent_at)
+      self.assertIsNotNone(delivery.failed_at)
+      self.assertIn('No such user', delivery.error)
+
+      from .tasks import notify_subscribers
+      notify_subscribers.delay(post.pk)  # type: ignore
+      self.assertEqual((len(mail.outbox), len(attempts)), (4, 1))
+
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class NotificationDigestTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', email='author@example.com', password='password123')
+    self.category = Category.objects.create(name='Django')
+    self.instant = User.objects.create_user(username='instant', email='instant@example.com', password='password123')
+    self.hourly = self.follower('hourly', Profile.NotificationFrequency.HOURLY)
+    self.daily = self.follower('daily', Profile.NotificationFrequency.DAILY)
+    Follow.objects.create(follower=self.instant, followed_user=self.author)
+
+  def follower(self, username, frequency):
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='password123')
+    Profile.objects.filter(user=user).update(notification_frequency=frequency)
+    Follow.objects.create(follower=user, followed_user=self.author)
+    return user
+
+  def publish(self, title):
+    post = Post.objects.create(title=title, content='Body', author=self.author, category=self.category, status=Post.Status.PUBLISHED)
+    outbox.relay()
+    return post
+
+  def test_digest_users_are_queued_not_mailed(self):
+    post = self.publish('First')
+    self.assertEqual([message.to for message in mail.outbox], [['instant@example.com']])
+    self.assertEqual(
+      sorted(PendingNotification.objects.filter(post=post).values_list('user__username', flat=True)), ['daily', 'hourly']
+    )
+
+  def test_hourly_run_sends_one_email_per_user(self):
+    self.publish('First')
+    self.publish('Second')
+    mail.outbox.clear()
+
+    send_notification_digests('hourly')
+    self.assertEqual(len(mail.outbox), 1)
+    digest = mail.outbox[0]
+    self.assertEqual(digest.to, ['hourly@example.com'])
+    self.assertEqual(digest.subject, '2 new posts from authors you follow')
+    self.assertLess(digest.body.index('First'), digest.body.index('Second'))
+    self.assertFalse(PendingNotification.objects.filter(user=self.hourly).exists())
+    #The daily queue is left for its own run
+    self.assertEqual(PendingNotification.objects.filter(user=self.daily).count(), 2)
+
+    send_notification_digests('daily')
+    self.assertEqual([message.to for message in mail.outbox[1:]], [['daily@example.com']])
+    send_notification_digests('hourly')
+    send_notification_digests('daily')
+    self.assertEqual(len(mail.outbox), 2)
+
+  def test_unpublished_posts_are_dropped(self):
+    kept = self.publish('Kept')
+    withdrawn = self.publish('Withdrawn')
+    withdrawn.status = Post.Status.DRAFT
+    withdrawn.save()
+    mail.outbox.clear()
+
+    send_notification_digests('hourly')
+    self.assertEqual(mail.outbox[0].subject, f'New Post: {kept.title}')
+    self.assertNotIn('Withdrawn', mail.outbox[0].body)
+    self.assertFalse(PendingNotification.objects.filter(user=self.hourly).exists())
+
+  def test_switching_back_to_immediate_flushes_leftovers(self):
+    self.publish('First')
+    self.client.force_authenticate(user=self.daily)
+    response = self.client.patch(reverse('user-profile'), {'notification_frequency': 'immediate'}, format='json')
+    self.assertEqual(response.data['notification_frequency'], 'immediate')  # type: ignore
+    mail.outbox.clear()
+
+    send_notification_digests('hourly')
+    self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['daily@example.com', 'hourly@example.com'])
+
+  def test_refused_digest_is_recorded_and_skipped(self):
+    self.follower('second', Profile.NotificationFrequency.HOURLY)
+    self.publish('First')
+    mail.outbox.clear()
+    original = locmem.EmailBackend.send_messages
+
+    def refusing(backend, messages):
+      if messages[0].to == ['hourly@example.com']:
+        raise SMTPRecipientsRefused({'hourly@example.com': (550, b'No such user')})
+      return original(backend, messages)
+
+    with mock.patch.object(locmem.EmailBackend, 'send_messages', autospec=True, side_effect=refusing):
+      send_notification_digests('hourly')
+      self.assertEqual([message.to for message in mail.outbox], [['second@example.com']])
+      row = PendingNotification.objects.get(user=self.hourly)
+      self.assertIsNotNone(row.failed_at)
+      self.assertIn('No such user', row.error)
+
+      send_notification_digests('hourly')
+      self.assertEqual(len(mail.outbox), 1)
+
+  def test_batch_reads_are_constant(self):
+    for i in range(4):
+      self.follower(f'extra{i}', Profile.NotificationFrequency.HOURLY)
+    for title in ('First', 'Second', 'Third'):
+      self.publish(title)
+    user_ids = list(PendingNotification.objects.values_list('user_id', flat=True).distinct())
+    with CaptureQueriesContext(connection) as ctx:
+      sent = notifications.send_digest_batch(user_ids)
+    self.assertEqual(sent, 6)
+    #Users, pending rows with their posts, then the delete
+    self.assertEqual(len(ctx.captured_queries), 3)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', email='author@example.com', password='password123')
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    self.post = Post.objects.create(title='Rated', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+    outbox.relay()
+    self.client.force_authenticate(user=self.reader)
+
+  def test_requests_only_record_events(self):
+    self.client.post(reverse('post-rate', kwargs={'pk': self.post.pk}), {'score': 5}, format='json')
+    self.client.post(reverse('post-share', kwargs={'pk': self.post.pk}), {'recipient_email': 'friend@example.com'}, format='json')
+    self.assertEqual(mail.outbox, [])
+    self.assertEqual(
+      list(OutboxEvent.objects.filter(processed_at__isnull=True).values_list('topic', flat=True).order_by('id')),
+      ['rating.five_star', 'post.shared']
+    )
+
+    call_command('relay_outbox', once=True, stdout=StringIO())
+    self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['author@example.com', 'friend@example.com'])
+    self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+
+  def test_rolled_back_changes_leave_no_event(self):
+    from django.db import transaction
+    with self.assertRaises(RuntimeError), transaction.atomic():
+      Post.objects.create(title='Doomed', content='Body', author=self.author, status=Post.Status.PUBLISHED)
+      raise RuntimeError
+    self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+
+  def test_claimed_events_are_leased(self):
+    event = outbox.publish('post.published', post_id=self.post.pk)
+    self.assertEqual([e.pk for e in outbox.claim('relay-a', 10, 60)], [event.pk])
+    #Another relay can't take it while the lease holds...
+    self.assertEqual(outbox.claim('relay-b', 10, 60), [])
+    #...but can once it ran out (relay-a died)
+    OutboxEvent.objects.filter(pk=event.pk).update(claimed_until=timezone.now() - timedelta(seconds=1))
+    self.assertEqual([e.pk for e in outbox.claim('relay-b', 10, 60)], [event.pk])
+    #relay-a coming back late can't finish an event it no longer owns
+    event.refresh_from_db()
+    self.assertTrue(outbox.dispatch(event, 'relay-a'))
+    event.refresh_from_db()
+    self.assertIsNone(event.processed_at)
+
+  def test_failures_back_off_then_give_up(self):
+    event = outbox.publish('post.published', post_id=self.post.pk)
+    with mock.patch.dict(outbox.HANDLERS, {'post.published': mock.Mock(side_effect=ConnectionError('broker down'))}):
+      self.assertEqual(outbox.relay(), {'processed': 0, 'failed': 1})
+      event.refresh_from_db()
+      self.assertEqual(event.attempts, 1)
+      self.assertGreater(event.available_at, timezone.now())
+      self.assertIn('broker down', event.last_error)
+
+      #Not due yet
+      self.assertEqual(outbox.relay(), {'processed': 0, 'failed': 0})
+      OutboxEvent.objects.filter(pk=event.pk).update(available_at=timezone.now())
+      outbox.relay()
+    event.refresh_from_db()
+    self.assertIsNotNone(event.failed_at)
+    self.assertEqual(outbox.relay(), {'processed': 0, 'failed': 0})
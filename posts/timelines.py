@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.db.models import F, Q
+from users.models import Follow, Profile
+from .models import Post, TimelineEntry, CategorySubscription
+
+
+BATCH_SIZE = 1000
+
+
+def fanout_follower_limit():
+  #Authors with more followers than this are not fanned out to their followers;
+  #their posts are merged into the feed at read time instead
+  return getattr(settings, 'FEED_FANOUT_FOLLOWER_LIMIT', 10000)
+
+
+def backfill_limit():
+  #How many recent posts are copied into a timeline on follow/subscribe
+  return getattr(settings, 'FEED_BACKFILL_LIMIT', 200)
+
+
+def _insert(user_ids, posts):
+  #ignore_conflicts makes every write path idempotent, so tasks can safely re-run
+  entries = [
+    TimelineEntry(user_id=user_id, post_id=post.id, published_at=post.published_at)
+    for user_id in user_ids for post in posts
+  ]
+  TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def _stream(queryset):
+  #Yields lists of user IDs without loading the whole audience into memory
+  batch = []
+  for user_id in queryset.iterator(chunk_size=BATCH_SIZE):
+    batch.append(user_id)
+    if len(batch) == BATCH_SIZE:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def is_high_fanout(author_id):
+  return Profile.objects.filter(user_id=author_id, follower_count__gt=fanout_follower_limit()).exists()
+
+
+def fan_out_post(post):
+  """
+  Writes a published post into the timeline of every follower and category subscriber.
+  """
+  audiences = []
+  if post.category_id:
+    audiences.append(CategorySubscription.objects.filter(category_id=post.category_id).values_list('user_id', flat=True))
+  if not is_high_fanout(post.author_id):
+    audiences.append(Follow.objects.filter(followed_user_id=post.author_id).values_list('follower_id', flat=True))
+
+  for audience in audiences:
+    for user_ids in _stream(audience.order_by()):
+      _insert(user_ids, [post])
+
+
+def remove_post(post_id):
+  TimelineEntry.objects.filter(post_id=post_id).delete()
+
+
+def redate_post(post_id, published_at):
+  #Keeps the copied sort key in step with a re-dated post
+  TimelineEntry.objects.filter(post_id=post_id).update(published_at=published_at)
+
+
+def _recent_published(**filters):
+  return list(
+    Post.objects.filter(status=Post.Status.PUBLISHED, **filters)
+    .only('id', 'published_at').order_by('-published_at')[:backfill_limit()]
+  )
+
+
+def backfill_author(user_id, author_id):
+  #Posts by high fan-out authors are merged at read time, copying them would duplicate work
+  if is_high_fanout(author_id):
+    return
+  _insert([user_id], _recent_published(author_id=author_id))
+
+
+def backfill_category(user_id, category_id):
+  _insert([user_id], _recent_published(category_id=category_id))
+
+
+def prune_author(user_id, author_id):
+  #Keep the author's posts that still reach the user through a category subscription
+  subscribed = CategorySubscription.objects.filter(user_id=user_id).values('category_id')
+  TimelineEntry.objects.filter(user_id=user_id, post__author_id=author_id).exclude(
+    post__category_id__in=subscribed
+  ).delete()
+
+
+def prune_category(user_id, category_id):
+  #Keep the category's posts that still reach the user because they follow the author
+  followed = Follow.objects.filter(follower_id=user_id).values('followed_user_id')
+  TimelineEntry.objects.filter(user_id=user_id, post__category_id=category_id).exclude(
+    post__author_id__in=followed
+  ).delete()
+
+
+def feed_queryset(user):
+  """
+  Published posts in the user's feed, annotated with feed_published_at/feed_post_id
+  for keyset pagination.
+
+  Normally a single range read on the user's timeline index. Posts by followed
+  high fan-out authors were never fanned out and are merged in here.
+  """
+  high_fanout_authors = list(
+    Profile.objects.filter(
+      user__followers__follower=user, follower_count__gt=fanout_follower_limit()
+    ).values_list('user_id', flat=True)
+  )
+
+  if not high_fanout_authors:
+    return Post.objects.filter(timeline_entries__user=user, status=Post.Status.PUBLISHED).annotate(
+      feed_published_at=F('timeline_entries__published_at'),
+      feed_post_id=F('timeline_entries__post_id'),
+    )
+
+  timeline = TimelineEntry.objects.filter(user=user).values('post_id')
+  return Post.objects.filter(
+    Q(pk__in=timeline) | Q(author_id__in=high_fanout_authors),
+    status=Post.Status.PUBLISHED
+  ).annotate(feed_published_at=F('published_at'), feed_post_id=F('id'))
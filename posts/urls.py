@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import (
-  PostListCreateView, PostDetailView, CommentListCreateView, CommentDetailView, LikePostView, RatePostView, TopPostsView, PostShareView, SubscribeCategoryView, UserFeedView, GlobalFeedView, CategoryListView, MyDraftListView, publish_post, CategoryPostListView, PostPublishView
+  PostListCreateView, PostDetailView, CommentListCreateView, CommentDetailView, LikePostView, RatePostView, TopPostsView, PostShareView, SubscribeCategoryView, UserFeedView, GlobalFeedView, CategoryListView, MyDraftListView, publish_post, CategoryPostListView, PostPublishView,
+  PostEngagementView, BatchLikeView, BatchRateView, ArchiveView
 )
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 
@@ -17,6 +18,9 @@ urlpatterns = [
   #Engagements (Likes/Ratings)
   path('<int:pk>/like/', LikePostView.as_view(), name='post-like'),
   path('<int:pk>/rate/', RatePostView.as_view(), name='post-rate'),
+  path('engagement/', PostEngagementView.as_view(), name='post-engagement'),
+  path('like/batch/', BatchLikeView.as_view(), name='post-like-batch'),
+  path('rate/batch/', BatchRateView.as_view(), name='post-rate-batch'),
   path('top/', TopPostsView.as_view(), name='top-posts'),
   path('<int:pk>/share/', PostShareView.as_view(), name='post-share'),
   path('<int:pk>/publish/', PostPublishView.as_view(), name='post-publish'),
@@ -30,6 +34,7 @@ urlpatterns = [
   #Feed
   path('feed/', UserFeedView.as_view(), name='user-feed'),
   path('explore/', GlobalFeedView.as_view(), name='explore'),
+  path('archive/', ArchiveView.as_view(), name='archive'),
 
   #Drafts
   path('drafts/', MyDraftListView.as_view(), name='my-drafts'),
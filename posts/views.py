@@ -1,24 +1,40 @@
 from django.shortcuts import render, get_object_or_404
+from django.http import Http404
+from django.conf import settings
 from rest_framework import generics, permissions, status
-from .models import Post, Comment, Like, Rating, Category, CategorySubscription
-from .serializers import PostSerializer, CommentSerializer, RatingSerializer, CategorySerializer
+from .models import Post, Comment, Like, Rating, Category, CategorySubscription, LeaderboardEntry, FacetCount
+from .serializers import (
+  PostSerializer, CommentSerializer, RatingSerializer, CategorySerializer,
+  EngagementBatchSerializer, BatchLikeItemSerializer, BatchRatingItemSerializer, ArchiveMonthSerializer
+)
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from .permissions import IsAuthorOrReadOnly
-from .filters import PostFilter
+from .filters import PostFilter, PostOrderingFilter
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiResponse, inline_serializer, OpenApiParameter
 from rest_framework import generics
 from rest_framework import serializers
-from django.db.models import Count, Avg, QuerySet
+from django.db.models import Count, Avg, Max, QuerySet, OuterRef, Subquery, IntegerField
 from django.db.models.functions import Coalesce
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import Q
+from rest_framework.settings import api_settings
+from django.db.models import Q, F
+from django.db import transaction
 from rest_framework.decorators import action, api_view, permission_classes
-from .tasks import share_post_via_email
+from .counters import toggle_like
+from .pagination import KeysetPagination, CreatedKeysetPagination, FeedKeysetPagination
+from .timelines import feed_queryset
+from .search import FullTextSearchFilter
+from . import leaderboards, outbox, engagement, archive
+from .facets import FacetsMixin
+from .cache_tags import EXPLORE, TOP, CATEGORIES, ARCHIVE, category as category_tag
 from .utils import get_social_share_links
 from django.utils import timezone
+from blogging_platform_api.response_cache import AnonymousCacheMixin
+from blogging_platform_api.conditional import ConditionalRequestMixin, make_etag
+from .rendering import RENDER_VERSION
 
 #A simple serializer for one-off messages
 MessageSerializer = inline_serializer(
@@ -47,24 +63,25 @@ MessageSerializer = inline_serializer(
     tags=['Author Actions']
   ),
 )
-class PostListCreateView(generics.ListCreateAPIView):
+class PostListCreateView(FacetsMixin, generics.ListCreateAPIView):
   
   serializer_class = PostSerializer
   filterset_class = PostFilter
+  #Drafts have no published_at yet, so this listing pages by creation time
+  pagination_class = CreatedKeysetPagination
 
   filter_backends = [
     DjangoFilterBackend,
-    filters.SearchFilter
+    FullTextSearchFilter,
+    PostOrderingFilter
   ]
 
-  search_fields = ['title', 'content', 'author__username', 'tags__name']
-
   def perform_create(self, serializer):
     serializer.save(author=self.request.user)
 
   def get_queryset(self): # type: ignore
     user = self.request.user
-    queryset = Post.objects.select_related('author', 'category').prefetch_related('tags', 'likes', 'ratings').all().order_by('-created_at') #Order by newest posts
+    queryset = PostSerializer.setup_eager_loading(Post.objects.all(), PostSerializer.field_names_for(self.request, many=True)).order_by('-created_at') #Order by newest posts
 
     if user.is_authenticated:
       #Show all published posts OR drafts owned by the current user
@@ -74,6 +91,14 @@ class PostListCreateView(generics.ListCreateAPIView):
     
     #Anonymous users only see published posts
     return queryset.filter(status=Post.Status.PUBLISHED)
+
+  def get_facet_queryset(self):
+    #Without filters the precomputed counts are the answer
+    params = set(PostFilter.base_filters) | {api_settings.SEARCH_PARAM}
+    if not any(self.request.query_params.get(param) for param in params):
+      return None
+    #Facets count published posts only, never the viewer's drafts
+    return self.filter_queryset(Post.objects.all())
   
   #Only Authenticated users can CREATE posts
   def get_permissions(self):
@@ -109,7 +134,7 @@ class PostListCreateView(generics.ListCreateAPIView):
   )
 )
 #View for retrieving a single post (Read) and updating/deleting 
-class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
+class PostDetailView(ConditionalRequestMixin, generics.RetrieveUpdateDestroyAPIView):
   queryset = Post.objects.all().order_by('-created_at') #Order by newest first
   serializer_class = PostSerializer
   
@@ -117,6 +142,20 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
   # 2. They must pass the custom check (IsAuthorOrReadOnly).
   permission_classes = [IsAuthenticatedOrReadOnly]
 
+  def get_queryset(self): # type: ignore
+    return PostSerializer.setup_eager_loading(super().get_queryset(), PostSerializer.field_names_for(self.request))
+
+  def get_validators(self, for_update=False):
+    queryset = Post.objects.filter(pk=self.kwargs['pk'])
+    if for_update:
+      queryset = queryset.select_for_update()
+    row = queryset.values('version', 'updated_at').order_by('pk').first()
+    if row is None:
+      return None, None
+    #has_liked differs per viewer, and a renderer upgrade changes content_html
+    etag = make_etag('post', self.kwargs['pk'], row['version'], row['updated_at'], self.request.user.pk, RENDER_VERSION)
+    return etag, row['updated_at']
+
   def get_serializer_context(self):
     context = super().get_serializer_context()
     context.update({"request": self.request})
@@ -126,14 +165,26 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
   list=extend_schema(summary='List comments for a post', tags=['Comments']),
   create=extend_schema(summary='Add a comment to a post', tags=['Comments']),
 )
-class CommentListCreateView(generics.ListCreateAPIView):
+class CommentListCreateView(ConditionalRequestMixin, generics.ListCreateAPIView):
   queryset = Comment.objects.none()
   serializer_class = CommentSerializer
   permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+  #Cursor pages on (created_at, id): a viral post's thread is read in constant-cost slices
+  pagination_class = CreatedKeysetPagination
+
+  def get_validators(self, for_update=False):
+    #Count + newest edit fingerprint the collection; every comment added, edited or
+    #deleted also moves the post's updated_at, so deletions show in Last-Modified
+    row = Post.objects.filter(pk=self.kwargs['post_pk']).values('updated_at').annotate(
+      total=Count('comments'), latest=Max('comments__updated_at')
+    ).order_by('pk').first()
+    if row is None:
+      return None, None
+    return make_etag('comments', self.kwargs['post_pk'], row['total'], row['latest']), row['updated_at']
 
   def get_queryset(self) -> QuerySet[Comment]:  # type: ignore [override]
     #Only return comments for the post specified in the URL
-    return Comment.objects.filter(post_id=self.kwargs['post_pk']).order_by('-created_at')
+    return Comment.objects.filter(post_id=self.kwargs['post_pk']).select_related('author').order_by('-created_at', '-id')
   
   def perform_create(self, serializer):
     # Automatically assign author and post
@@ -144,29 +195,47 @@ class CommentListCreateView(generics.ListCreateAPIView):
   update=extend_schema(summary='Edit a comment', tags=['Comments']),
   destroy=extend_schema(summary='Delete a comment', tags=['Comments']),
 )
-class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
-  queryset = Comment.objects.all().order_by('-created_at')
+class CommentDetailView(ConditionalRequestMixin, generics.RetrieveUpdateDestroyAPIView):
+  queryset = Comment.objects.select_related('author').order_by('-created_at')
   serializer_class = CommentSerializer
   permission_classes = [IsAuthorOrReadOnly] #Reusing our custom permissions
 
-class TopPostsView(generics.ListAPIView):
-  """
-  Returns the top posts based on likes or average rating.
-  """
-  serializer_class = PostSerializer
+  def get_validators(self, for_update=False):
+    queryset = Comment.objects.filter(pk=self.kwargs['pk'])
+    if for_update:
+      queryset = queryset.select_for_update()
+    row = queryset.values('version', 'updated_at').order_by('pk').first()
+    if row is None:
+      return None, None
+    return make_etag('comment', self.kwargs['pk'], row['version'], row['updated_at']), row['updated_at']
 
-  @extend_schema(
-    summary='Get top rated/liked posts', 
+@extend_schema_view(
+  list=extend_schema(
+    summary='Get top rated/liked/trending posts',
     parameters=[
-      OpenApiParameter(name='sort_by', type=str, description='Sort by "likes" or "rating"')
+      OpenApiParameter(name='sort_by', type=str, enum=list(LeaderboardEntry.Metric.values), description='Sort by "likes", "rating" (Bayesian average) or "trending"'),
+      OpenApiParameter(name='window', type=str, enum=list(LeaderboardEntry.Window.values), description='Only posts published in the last "24h", "7d", or "all" time'),
     ]
   )
+)
+class TopPostsView(AnonymousCacheMixin, generics.ListAPIView):
+  """
+  Returns the top posts based on likes, average rating or trending score.
+  Served from the precomputed leaderboards (see posts/leaderboards.py).
+  """
+  serializer_class = PostSerializer
+  cache_tags = [TOP]
+
   def get_queryset(self) -> QuerySet[Post]:  # type: ignore [override]
-    
-  
-    return Post.objects.annotate(
-      likes_count=Count('likes')
-    ).order_by('-likes_count')[:10] #Get top 10
+    metric = self.request.query_params.get('sort_by', LeaderboardEntry.Metric.LIKES)
+    window = self.request.query_params.get('window', LeaderboardEntry.Window.ALL)
+
+    if metric not in LeaderboardEntry.Metric.values:
+      raise serializers.ValidationError({'sort_by': f'Choose one of {LeaderboardEntry.Metric.values}.'})
+    if window not in LeaderboardEntry.Window.values:
+      raise serializers.ValidationError({'window': f'Choose one of {LeaderboardEntry.Window.values}.'})
+
+    return PostSerializer.setup_eager_loading(leaderboards.top_posts(metric, window), PostSerializer.field_names_for(self.request, many=True))
     
 class LikePostView(APIView):
   permission_classes = [permissions.IsAuthenticated]
@@ -174,23 +243,16 @@ class LikePostView(APIView):
 
   @extend_schema(summary='Toggle like on a post', responses={200: OpenApiResponse(description='Success')})
   def post(self, request, pk):
-    post = get_object_or_404(Post, pk=pk)
-    user = request.user
-
-    if post.likes.filter(pk=user.pk).exists():
-      post.likes.remove(user)
-      message = "Post Unliked"
-      status_code = status.HTTP_200_OK
-    else:
-      post.likes.add(user)
-      message = "Post Liked"
-      status_code = status.HTTP_201_CREATED
+    try:
+      has_liked, current_total = toggle_like(pk, request.user.pk)
+    except Post.DoesNotExist:
+      raise Http404
 
     return Response({
-      "message": message,
-      "current_total": post.likes.count(),
-      "has_liked": post.likes.filter(pk=user.pk).exists()
-    }, status=status_code)
+      "message": "Post Liked" if has_liked else "Post Unliked",
+      "current_total": current_total,
+      "has_liked": has_liked
+    }, status=status.HTTP_201_CREATED if has_liked else status.HTTP_200_OK)
   
 class RatePostView(generics.CreateAPIView):
   """
@@ -200,13 +262,114 @@ class RatePostView(generics.CreateAPIView):
   serializer_class = RatingSerializer
 
   def post(self, request, pk):
-    score = request.data.get('score')
+    serializer = self.get_serializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    score = serializer.validated_data['score']
     post = get_object_or_404(Post, pk=pk)
-    rating, created = Rating.objects.update_or_create(
-      user=request.user, post=post, defaults={'score': score}
-    )
+
+    #update_or_create locks an existing rating (or retries as an update when a
+    #concurrent first rating wins the insert); Rating's post_save receiver applies
+    #the delta from the stored score inside the same transaction
+    with transaction.atomic():
+      Rating.objects.update_or_create(user=request.user, post=post, defaults={'score': score})
+
     return Response({'message': 'Rating saved', 'score': score})
   
+class PostEngagementView(APIView):
+  """
+  Counts plus the viewer's like and rating for a page of posts (?ids=1,2,3),
+  in one query per relation instead of one request per post.
+  """
+  permission_classes = [permissions.AllowAny]
+  serializer_class = None
+
+  @extend_schema(
+    summary='Engagement state for many posts',
+    parameters=[OpenApiParameter(name='ids', type=str, required=True, description='Comma separated post ids')],
+    responses={200: OpenApiResponse(description='One result per id, in order')}
+  )
+  def get(self, request):
+    try:
+      post_ids = list(dict.fromkeys(int(part) for part in request.query_params.get('ids', '').split(',') if part.strip()))
+    except ValueError:
+      raise serializers.ValidationError({'ids': 'Expected a comma separated list of post ids.'})
+    if not post_ids:
+      raise serializers.ValidationError({'ids': 'This parameter is required.'})
+    if len(post_ids) > settings.ENGAGEMENT_BATCH_SIZE:
+      raise serializers.ValidationError({'ids': f'At most {settings.ENGAGEMENT_BATCH_SIZE} ids per request.'})
+
+    return Response({'results': engagement.engagement_state(post_ids, request.user)})
+
+
+class EngagementBatchView(APIView):
+  """
+  Applies many engagement writes in one transaction. Items are validated one
+  by one: each gets its own result with a status code, and invalid or unknown
+  items don't stop the valid ones from being applied.
+  """
+  permission_classes = [permissions.IsAuthenticated]
+  serializer_class = EngagementBatchSerializer
+  item_serializer_class = serializers.Serializer
+  value_field = ''
+
+  def apply(self, user, items):
+    raise NotImplementedError
+
+  def post(self, request):
+    batch = EngagementBatchSerializer(data=request.data)
+    batch.is_valid(raise_exception=True)
+
+    #(post id, error result) per item, in request order
+    entries, items = [], {}
+    for raw in batch.validated_data['items']:  # type: ignore [index]
+      item = self.item_serializer_class(data=raw)
+      post_id = raw.get('post') if isinstance(raw, dict) else None
+      if not item.is_valid():
+        entries.append((post_id, {'post': post_id, 'status': status.HTTP_400_BAD_REQUEST, 'errors': item.errors}))
+        continue
+      post_id = item.validated_data['post']
+      if post_id in items:
+        entries.append((post_id, {'post': post_id, 'status': status.HTTP_400_BAD_REQUEST, 'errors': {'post': ['Duplicate post in this batch.']}}))
+        continue
+      items[post_id] = item.validated_data[self.value_field]
+      entries.append((post_id, None))
+
+    applied = {result['post']: result for result in self.apply(request.user, items)} if items else {}
+    return Response({'results': [error or applied[post_id] for post_id, error in entries]})
+
+
+class BatchLikeView(EngagementBatchView):
+  item_serializer_class = BatchLikeItemSerializer
+  value_field = 'liked'
+
+  @extend_schema(
+    summary='Like or unlike many posts',
+    description='Body: {"items": [{"post": 1, "liked": true}, ...]}. Likes are set, not toggled, so retries are safe.',
+    responses={200: OpenApiResponse(description='One result per item, in order')}
+  )
+  def post(self, request):
+    return super().post(request)
+
+  def apply(self, user, items):
+    return engagement.apply_likes(user, items)
+
+
+class BatchRateView(EngagementBatchView):
+  item_serializer_class = BatchRatingItemSerializer
+  value_field = 'score'
+
+  @extend_schema(
+    summary='Rate many posts',
+    description='Body: {"items": [{"post": 1, "score": 4}, ...]}. Existing ratings are updated.',
+    responses={200: OpenApiResponse(description='One result per item, in order')}
+  )
+  def post(self, request):
+    return super().post(request)
+
+  def apply(self, user, items):
+    return engagement.apply_ratings(user, items)
+
+
 class PostPublishView(APIView):
   permission_classes = [permissions.IsAuthenticated]
 
@@ -248,7 +411,7 @@ class PostShareView(APIView):
     sender = request.data.get('sender_name', 'A friend')
 
     if recipient:
-      share_post_via_email.delay(post.title, post_url, recipient, sender)  # type: ignore
+      outbox.publish('post.shared', post_title=post.title, post_url=post_url, recipient_email=recipient, sender_name=sender)
 
     #3. Return Social Links
     share_links = get_social_share_links(post_url, post.title)
@@ -301,6 +464,7 @@ class SubscribeCategoryView(APIView):
 class UserFeedView(generics.ListAPIView):
   serializer_class = PostSerializer
   permission_classes = [IsAuthenticated]
+  pagination_class = FeedKeysetPagination
 
   @extend_schema(
     summary="Get personalized feed",
@@ -314,46 +478,33 @@ class UserFeedView(generics.ListAPIView):
     user = self.request.user
 
     if user.is_superuser:
-      return Post.objects.filter(status='PB').order_by('-published_at')
-
-    #1. Get IDs of authors the user follows
-    followed_authors = user.following.values_list('followed_user_id', flat=True)  # type: ignore
-
-    #2. Get IDs of categories the user is subscribed to
-    subscribed_categories = user.category_subscriptions.values_list('category_id', flat=True)  # type: ignore
+      queryset = Post.objects.filter(status='PB').annotate(feed_published_at=F('published_at'), feed_post_id=F('id'))
+    else:
+      #Posts from followed authors and subscribed categories, materialized on publish (see posts/timelines.py)
+      queryset = feed_queryset(user)
 
-    #3. Filter posts: (Author in list OR Category in list) AND Status is Published
-    return Post.objects.filter(
-      (Q(author_id__in=followed_authors) | Q(category_id__in=subscribed_categories)),
-      status= Post.Status.PUBLISHED
-    ).distinct().select_related('author', 'category').prefetch_related('tags').order_by('-published_at')
+    return PostSerializer.setup_eager_loading(queryset, PostSerializer.field_names_for(self.request, many=True)).order_by('-feed_published_at', '-feed_post_id')
 
 
-class GlobalFeedView(generics.ListAPIView):
+class GlobalFeedView(AnonymousCacheMixin, generics.ListAPIView):
   """
   Returns all published posts across the entire platform, 
   ordered by the most recently published.
   """
   serializer_class = PostSerializer
+  cache_tags = [EXPLORE]
   permission_classes = [permissions.AllowAny] #Public, so new users can see content
   queryset = Post.objects.filter(status='PB').order_by('-published_at')
+  pagination_class = KeysetPagination
 
   #Filter Backends
-  filter_backends = [filters.SearchFilter]
-
-  #Fields that are searchable
-  #Implement "Search": Add a search bar so users can find specific posts by keywords?
-  search_fields = ['title', 'content', 'author__username', 'category__name']
+  #Full-text search over title, content, author and tags (see posts/search.py)
+  filter_backends = [FullTextSearchFilter, PostOrderingFilter]
 
   #1. Exact Filtering (Category name or Author username)
   filterset_fields = ['category__name', 'author__username']
 
-  #2. Text Search (Partial matches)
-  search_fields = ['title', 'content', 'tags__name']
-
-  #3. Ordering (By date or by popularity)
-  ordering_fields = ['published_at', 'likes_count']
-  ordering = ['-published_at'] #Default ordering
+  #3. Ordering (By date, popularity or rating; see PostOrderingFilter)
 
   @extend_schema(
     summary="Get global discovery feed",
@@ -364,18 +515,25 @@ class GlobalFeedView(generics.ListAPIView):
 
     queryset = Post.objects.filter(status='PB').order_by('-published_at')
 
-    return Post.objects.filter(status=Post.Status.PUBLISHED).annotate(likes_count=Count('likes')).select_related('author', 'category').prefetch_related('tags').order_by('-published_at')
+    return PostSerializer.setup_eager_loading(Post.objects.filter(status=Post.Status.PUBLISHED), PostSerializer.field_names_for(self.request, many=True)).order_by('-published_at')
   
 
 @extend_schema_view(
     list=extend_schema(operation_id='categories_list'),
     create=extend_schema(operation_id='categories_create')
 )
-class CategoryListView(generics.ListCreateAPIView):
+class CategoryListView(AnonymousCacheMixin, FacetsMixin, generics.ListCreateAPIView):
   #Below calculated the count of post in the database before it even hits the serializer
-  queryset = Category.objects.all()
+  #Read from the precomputed facet counts, so no category counts posts at request time
+  queryset = Category.objects.annotate(
+    published_post_count=Coalesce(Subquery(
+      FacetCount.objects.filter(facet=FacetCount.Facet.CATEGORY, value_id=OuterRef('pk')).values('post_count'),
+      output_field=IntegerField()
+    ), 0)
+  ).order_by('name')
   serializer_class = CategorySerializer
   permission_classes = [permissions.AllowAny()]
+  cache_tags = [CATEGORIES]
 
   #Allow anyone to see Categories, but only logged-in users to create one
   def get_permissions(self):
@@ -384,29 +542,57 @@ class CategoryListView(generics.ListCreateAPIView):
     
     return [permissions.AllowAny()]
   
-class CategoryPostListView(generics.ListAPIView):
+class CategoryPostListView(AnonymousCacheMixin, generics.ListAPIView):
   serializer_class = PostSerializer
-  
+  filter_backends = [PostOrderingFilter]
+
+  def get_cache_tags(self):
+    return [category_tag(self.kwargs['category_name'])]
 
   def get_queryset(self):
     #Grab the category name from the URL
     category_name = self.kwargs['category_name']
     #Filter posts by that category AND ensure they are published
-    return Post.objects.filter(
+    return PostSerializer.setup_eager_loading(Post.objects.filter(
       category__name__iexact=category_name,
       status='PB'
-    ).order_by('-published_at')
+    ), PostSerializer.field_names_for(self.request, many=True)).order_by('-published_at', '-id')
   
+class ArchiveView(AnonymousCacheMixin, generics.ListAPIView):
+  """
+  Published post counts per month, newest first, for the archive sidebar.
+  Read from the precomputed ArchiveMonth table; list a month's posts with
+  /api/posts/?published_after=...&published_before=...
+  """
+  serializer_class = ArchiveMonthSerializer
+  permission_classes = [permissions.AllowAny]
+  cache_tags = [ARCHIVE]
+  #One row per month, so the whole archive fits in a response
+  pagination_class = None
+  filter_backends = []
+
+  @extend_schema(
+    summary='Post counts per month',
+    parameters=[OpenApiParameter(name='category', type=str, description='Only count posts in this category')],
+    tags=['Discovery']
+  )
+  def get(self, request, *args, **kwargs):
+    return super().get(request, *args, **kwargs)
+
+  def get_queryset(self):
+    return archive.months(self.request.query_params.get('category') or None)
+
+
 class MyDraftListView(generics.ListAPIView):
   serializer_class = PostSerializer
   permission_classes = [permissions.IsAuthenticated]
 
   def get_queryset(self):
     #Only show the logged-in user's own drafts
-    return Post.objects.filter(
+    return PostSerializer.setup_eager_loading(Post.objects.filter(
       author=self.request.user,
       status = 'DF'
-    ).order_by('-created_at')
+    ), PostSerializer.field_names_for(self.request, many=True)).order_by('-created_at', '-id')
   
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated()])
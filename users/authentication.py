@@ -0,0 +1,156 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from blogging_platform_api.metrics import record_cache
+
+
+DEFAULTS = {
+  #Tokens remembered per process (least recently used are dropped first)
+  'MAX_SIZE': 10000,
+  #Seconds a process trusts its own copy; other processes can't evict it, so this
+  #bounds how long a deleted token or a deactivated user still works there
+  'TTL': 30,
+  #Alias in CACHES for a second tier shared by every process, None to disable
+  'SHARED_CACHE': None,
+  'SHARED_TTL': 300,
+}
+
+
+def cache_settings():
+  return {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+
+
+class TokenCache:
+  """
+  Token key -> Token (with its user) in a bounded in-process LRU with a TTL,
+  backed by an optional shared Django cache that only holds the token key, the
+  user id and is_active.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def shared_cache(self, config):
+    return caches[config['SHARED_CACHE']] if config['SHARED_CACHE'] else None
+
+  def shared_key(self, key):
+    #Hashed, so raw tokens never end up in a cache server
+    return 'auth-token:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+  def get(self, key):
+    config = cache_settings()
+    now = time.monotonic()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None and entry[0] > now:
+        self.entries.move_to_end(key)
+        self.hits += 1
+      else:
+        entry = None
+        self.misses += 1
+    record_cache('auth_token', entry is not None)
+    if entry is not None:
+      return entry[1]
+
+    shared = self.shared_cache(config)
+    if shared is None:
+      return None
+    entry = shared.get(self.shared_key(key))
+    record_cache('auth_token_shared', entry is not None)
+    if entry is None:
+      return None
+    token = self.rebuild(entry)
+    self.remember(key, token, config)
+    return token
+
+  def set(self, key, token):
+    config = cache_settings()
+    self.remember(key, token, config)
+    shared = self.shared_cache(config)
+    if shared is not None:
+      #Only what authentication needs; a pickled User would put its password hash in the cache server
+      entry = {'key': token.key, 'user_id': token.user_id, 'is_active': token.user.is_active}
+      shared.set(self.shared_key(key), entry, config['SHARED_TTL'])
+
+  def rebuild(self, entry):
+    #The user's other fields are deferred and load on first access
+    User = get_user_model()
+    user = User.from_db(DEFAULT_DB_ALIAS, [User._meta.pk.attname, 'is_active'], [entry['user_id'], entry['is_active']])
+    token = Token.from_db(DEFAULT_DB_ALIAS, ['key', 'user_id'], [entry['key'], entry['user_id']])
+    token.user = user
+    return token
+
+  def remember(self, key, token, config):
+    with self.lock:
+      self.entries[key] = (time.monotonic() + config['TTL'], token)
+      self.entries.move_to_end(key)
+      while len(self.entries) > config['MAX_SIZE']:
+        self.entries.popitem(last=False)
+
+  def evict(self, *keys):
+    with self.lock:
+      for key in keys:
+        self.entries.pop(key, None)
+    shared = self.shared_cache(cache_settings())
+    if shared is not None and keys:
+      shared.delete_many([self.shared_key(key) for key in keys])
+
+  def evict_user(self, user_id):
+    with self.lock:
+      keys = {key for key, (expires, token) in self.entries.items() if token.user_id == user_id}
+    #Other processes may have shared tokens this one never saw, so evict them all there
+    if self.shared_cache(cache_settings()) is not None:
+      keys.update(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+    self.evict(*keys)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.hits = self.misses = 0
+
+  def stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        'size': len(self.entries),
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_ratio': self.hits / lookups if lookups else None,
+      }
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+  """
+  Drop-in for TokenAuthentication that skips the Token + User query when the
+  token was resolved recently. Entries are evicted when the token is deleted or
+  its user is saved (password change, deactivation); see users/models.py.
+  """
+  def authenticate_credentials(self, key):
+    cached = token_cache.get(key)
+    if cached is None:
+      user, token = super().authenticate_credentials(key)
+      token_cache.set(key, token)
+      cached = token
+    elif not cached.user.is_active:
+      token_cache.evict(key)
+      raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+    #Copies, so per-request changes to request.user can't leak into the cache
+    token = copy.copy(cached)
+    token.user = copy.copy(cached.user)
+    return (token.user, token)
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-17 06:41
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_follower_count(apps, schema_editor):
+    Profile = apps.get_model('users', 'Profile')
+    Follow = apps.get_model('users', 'Follow')
+
+    followers = Follow.objects.filter(followed_user_id=OuterRef('user_id')).order_by().values('followed_user_id').annotate(value=Count('*')).values('value')
+    Profile.objects.update(follower_count=Coalesce(Subquery(followers, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_follower_count, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -18,6 +20,19 @@ class Profile(models.Model):
   bio = models.TextField(max_length=500, blank=True)
   profile_picture = models.ImageField(upload_to='profile_pics/', default='default.jpg')
   location = models.CharField(max_length=100, blank=True)
+  class NotificationFrequency(models.TextChoices):
+    IMMEDIATE = 'immediate', 'Immediately'
+    HOURLY = 'hourly', 'Hourly digest'
+    DAILY = 'daily', 'Daily digest'
+
+  #Denormalized, kept current by the Follow signals below
+  follower_count = models.PositiveIntegerField(default=0, editable=False)
+  #How new-post emails reach this user (see posts/notifications.py)
+  notification_frequency = models.CharField(
+    max_length=10, choices=NotificationFrequency.choices, default=NotificationFrequency.IMMEDIATE
+  )
+  #Last change to the profile or its follower lists (the conditional GET validator)
+  updated_at = models.DateTimeField(auto_now=True)
 
   def __str__(self):
     return f"{self.user.username}'s Profile"
@@ -31,4 +46,49 @@ class Follow(models.Model):
   class Meta:
     constraints = [
       models.UniqueConstraint(fields=['follower', 'followed_user'], name='unique_followers')
-    ]
\ No newline at end of file
+    ]
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+  if created:
+    Profile.objects.filter(user_id=instance.followed_user_id).update(follower_count=F('follower_count') + 1, updated_at=timezone.now())
+    #The follower's 'following' list changed too
+    Profile.objects.filter(user_id=instance.follower_id).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Follow)
+def count_unfollow(sender, instance, **kwargs):
+  Profile.objects.filter(user_id=instance.followed_user_id, follower_count__gt=0).update(follower_count=F('follower_count') - 1)
+  Profile.objects.filter(user_id__in=[instance.follower_id, instance.followed_user_id]).update(updated_at=timezone.now())
+
+
+#Cached token authentication (users/authentication.py) must forget revoked tokens
+#and users whose password or active flag may have changed
+@receiver(post_delete, sender='authtoken.Token')
+def forget_deleted_token(sender, instance, **kwargs):
+  from .authentication import token_cache
+  token_cache.evict(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+  #Logins only touch last_login, which the cached copies don't need
+  if created or update_fields == frozenset(['last_login']):
+    return
+  from .authentication import token_cache
+  token_cache.evict_user(instance.pk)
+
+
+#Follower lists and bios are part of the cached public profiles
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_profiles_on_follow(sender, instance, **kwargs):
+  from posts.cache_tags import invalidate_profiles
+  invalidate_profiles(instance.follower_id, instance.followed_user_id)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_on_save(sender, instance, **kwargs):
+  from posts.cache_tags import invalidate_profiles
+  invalidate_profiles(instance.user_id)
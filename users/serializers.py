@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from posts.serializers import PostSerializer
 from .models import Profile
 from drf_spectacular.utils import extend_schema_field
+from blogging_platform_api.timing import TimedSerializerMixin
+from blogging_platform_api.sparse_fields import DynamicFieldsMixin
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
   password = serializers.CharField(write_only=True)
@@ -22,13 +24,26 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     return user
 
 class UserProfileSerializer(serializers.ModelSerializer):
+  #Delivery preference for new-post emails: immediately, or in an hourly/daily digest
+  notification_frequency = serializers.ChoiceField(
+    choices=Profile.NotificationFrequency.choices, source='profile.notification_frequency', required=False
+  )
+
   class Meta:
     model = User
 
-    fields = ('id', 'username', 'email', 'first_name', 'last_name')
+    fields = ('id', 'username', 'email', 'first_name', 'last_name', 'notification_frequency')
     read_only_fields = ('username',)
 
-class ProfileSerializer(serializers.ModelSerializer):
+  def update(self, instance, validated_data):
+    profile_data = validated_data.pop('profile', {})
+    instance = super().update(instance, validated_data)
+    if 'notification_frequency' in profile_data:
+      instance.profile.notification_frequency = profile_data['notification_frequency']
+      instance.profile.save(update_fields=['notification_frequency', 'updated_at'])
+    return instance
+
+class ProfileSerializer(DynamicFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
   username = serializers.ReadOnlyField(source='user.username')
   #Include the user's posts directly in the profile
   posts = PostSerializer(source='user.posts', many=True, read_only=True)
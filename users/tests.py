@@ -1,3 +1,100 @@
-from django.test import TestCase
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from .authentication import token_cache
 
-# Create your tests here.
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedTokenAuthenticationTests(APITestCase):
+  def setUp(self):
+    token_cache.clear()
+    self.user = User.objects.create_user(username='reader', password='password123')
+    self.token = Token.objects.create(user=self.user)
+    self.url = reverse('user-profile')
+
+  def get(self):
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+    token_queries = [query for query in ctx.captured_queries if 'authtoken_token' in query['sql']]
+    return response, len(token_queries)
+
+  def test_second_request_skips_the_token_query(self):
+    response, queries = self.get()
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(queries, 1)
+
+    response, queries = self.get()
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.data['username'], 'reader')  # type: ignore
+    self.assertEqual(queries, 0)
+    self.assertEqual(token_cache.stats()['hits'], 1)
+
+  def test_deleted_token_is_rejected(self):
+    self.get()
+    self.token.delete()
+    response, queries = self.get()
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+  def test_deactivated_user_is_rejected(self):
+    self.get()
+    self.user.is_active = False
+    self.user.save()
+    response, queries = self.get()
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+  def test_password_change_evicts(self):
+    self.get()
+    self.user.set_password('changed456')
+    self.user.save()
+    response, queries = self.get()
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(queries, 1)
+
+  def test_cached_user_is_not_shared_between_requests(self):
+    self.get()
+    first = token_cache.get(self.token.key)
+    response, queries = self.get()
+    self.assertIsNot(response.wsgi_request.user, first.user)
+
+  @override_settings(TOKEN_AUTH_CACHE={'TTL': 30})
+  def test_entries_expire(self):
+    self.get()
+    with mock.patch('users.authentication.time.monotonic', return_value=10 ** 9):
+      response, queries = self.get()
+    self.assertEqual(queries, 1)
+
+  @override_settings(TOKEN_AUTH_CACHE={'MAX_SIZE': 1})
+  def test_size_is_bounded(self):
+    other = Token.objects.create(user=User.objects.create_user(username='other', password='password123'))
+    self.get()
+    self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {other.key}')
+    self.assertEqual(token_cache.stats()['size'], 1)
+    response, queries = self.get()
+    self.assertEqual(queries, 1)
+
+  @override_settings(TOKEN_AUTH_CACHE={'SHARED_CACHE': 'default'})
+  def test_shared_tier(self):
+    self.get()
+    #Another process: empty local cache, same shared cache
+    token_cache.clear()
+    response, queries = self.get()
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(queries, 0)
+    self.assertEqual(response.data['username'], 'reader')  # type: ignore
+    #No password hash or other user fields in the cache server
+    self.assertEqual(
+      caches['default'].get(token_cache.shared_key(self.token.key)),
+      {'key': self.token.key, 'user_id': self.user.pk, 'is_active': True}
+    )
+
+    token_cache.clear()
+    self.user.is_active = False
+    self.user.save()
+    response, queries = self.get()
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -6,7 +6,14 @@ from django.contrib.auth.models import User
 from rest_framework.permissions import IsAuthenticated
 from .serializers import UserProfileSerializer, ProfileSerializer, UserSerializer
 from .models import Profile, Follow
+from posts.models import Post
+from posts.serializers import PostSerializer
 from django.core import exceptions
+from django.db.models import Prefetch, Count, Max, Q
+from posts.cache_tags import profile as profile_tag
+from blogging_platform_api.response_cache import AnonymousCacheMixin
+from blogging_platform_api.conditional import ConditionalRequestMixin, make_etag
+from posts.rendering import RENDER_VERSION
 
 
 
@@ -29,14 +36,51 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     # middleware if the user is logged in.
     return self.request.user
   
-class ProfileDetailView(generics.RetrieveUpdateAPIView):
+class ProfileDetailView(ConditionalRequestMixin, AnonymousCacheMixin, generics.RetrieveUpdateAPIView):
   
-  queryset = Profile.objects.all()
+  queryset = Profile.objects.select_related('user')
   serializer_class = ProfileSerializer
 
   lookup_field = 'user__username'
   lookup_url_kwarg = 'username'
 
+  def get_queryset(self): # type: ignore
+    #Everything the requested payload nests is loaded up front: the follower lists with
+    #their usernames, and only the published posts (drafts stay private)
+    fields = ProfileSerializer.field_names_for(self.request)
+    prefetches = []
+    if fields & {'followers', 'followers_count'}:
+      prefetches.append(Prefetch('user__followers', queryset=Follow.objects.select_related('follower')))
+    if fields & {'following', 'following_count'}:
+      prefetches.append(Prefetch('user__following', queryset=Follow.objects.select_related('followed_user')))
+    if 'posts' in fields:
+      posts = PostSerializer.setup_eager_loading(
+        Post.objects.filter(status=Post.Status.PUBLISHED), PostSerializer.field_names_for(self.request, 'posts.', many=True)
+      )
+      prefetches.append(Prefetch('user__posts', queryset=posts.order_by('-published_at', '-id')))
+    return super().get_queryset().prefetch_related(*prefetches)
+
+  def get_cache_tags(self):
+    return [profile_tag(self.kwargs['username'])]
+
+  def get_validators(self, for_update=False):
+    #The profile row moves with bio and follow changes and with posts being published
+    #or removed; the nested posts' own edits and counters show in their updated_at
+    published = Q(user__posts__status=Post.Status.PUBLISHED)
+    queryset = Profile.objects.filter(user__username=self.kwargs['username'])
+    if for_update:
+      #Locked on its own: FOR UPDATE can't be combined with the aggregates
+      list(queryset.select_for_update().values_list('pk', flat=True))
+    row = queryset.annotate(
+      post_total=Count('user__posts', filter=published), post_latest=Max('user__posts__updated_at', filter=published)
+    ).values('pk', 'updated_at', 'post_total', 'post_latest').order_by('pk').first()
+    if row is None:
+      return None, None
+    etag = make_etag(
+      'profile', row['pk'], row['updated_at'], row['post_total'], row['post_latest'], self.request.user.pk, RENDER_VERSION
+    )
+    return etag, max(row['updated_at'], row['post_latest'] or row['updated_at'])
+
   def get_permissions(self):
     if self.request.method in permissions.SAFE_METHODS:
       return [permissions.AllowAny()]
@@ -49,7 +93,7 @@ class ProfileDetailView(generics.RetrieveUpdateAPIView):
     serializer.save()
 
 class UserListView(generics.ListAPIView):
-  queryset = User.objects.all()
+  queryset = User.objects.select_related('profile').order_by('id')
   serializer_class = UserSerializer
   permission_classes = [permissions.AllowAny] #Anyone can see the author list
 